@@ -1,4 +1,4 @@
-from ABM.agents import LocationAgent, ProfitAgent, BuyOffer
+from ABM.agents import LocationAgent, ProfitAgent
 from .constants import *
 import random
 
@@ -23,7 +23,7 @@ class InternalDemandMerchant(ProfitAgent):
         ''' if the decision strategy is specialist, then randomly choose one product
         type to be the Specialist type. '''
         
-        index = self.random.choice([i for i in range(len(Product))])
+        index = self.model.random_streams[PLACEMENT_STREAM].choice([i for i in range(len(Product))])
         return list(Product)[index], index
         
     # There are two important parts for having different decision strategies -- 
@@ -86,7 +86,8 @@ class InternalDemandMerchant(ProfitAgent):
         if VERBOSE:
             print("Product {product_type}: There is available product to sell, checking offers...")
         
-        if len(self.buy_offers[product_type_int]) > 0:
+        highest_offer = self.get_best_offer(product_type_int)
+        if highest_offer is not None:
             normal_generalist = self.decision_strat == DecisionStrategies.GENERALIST and self.internal_demand[product_type_int] < 0
             normal_specialist = self.decision_strat == DecisionStrategies.SPECIALIST \
                                 and self.internal_demand[product_type_int] == 0
@@ -94,14 +95,11 @@ class InternalDemandMerchant(ProfitAgent):
             
             if normal_generalist:
                 # if a generalist, then want to trade away any item you have TOO much of, which means ideal - amt is NEGATIVE
-                highest_offer : BuyOffer = max(self.buy_offers[product_type_int], key=lambda offer: offer.price)
-                self.execute_trade_away(highest_offer.unique_id, product_type_int)
+                self.execute_trade_away(highest_offer[0], product_type_int)
             
             elif normal_specialist:
                 # Specialists want to consider a buy offer for items that they want to get rid of, which means that they have no internal demand for it
-                # Get the maximum-price trade offer in this agent's trade_offers list.
-                highest_offer : BuyOffer = max(self.buy_offers[product_type_int], key=lambda offer: offer.price)
-                self.execute_trade_away(highest_offer.unique_id, product_type_int)
+                self.execute_trade_away(highest_offer[0], product_type_int)
         else:
             # If no agent was chosen to sell to, then reset as if no trade.
             self.move_to_stock(product_type_int)
@@ -0,0 +1,318 @@
+from .Scheduler import MerchantSimultaneousActivation
+from .constants import *
+import numpy as np
+
+# Codes for the decision strategy of each merchant, stored in the `strategy` array
+PROFIT_STRATEGY = 0
+GENERALIST_STRATEGY = 1
+SPECIALIST_STRATEGY = 2
+# Internal demand that a specialist has for their specialist item (see InternalDemandMerchant)
+SPECIALIST_IDEAL_AMOUNT = 10000
+
+
+class ArraySimultaneousActivation(MerchantSimultaneousActivation):
+    """A scheduler that runs the same phases as MerchantSimultaneousActivation,
+    but as batched numpy operations over all merchants at once.
+
+    The merchants' product, stock, demand and max_stock_size vectors (and the
+    locations' deposited_product vectors) are stored as rows of (agents x products)
+    arrays. `bind_agent_arrays` replaces each agent's lists with views into these
+    arrays, so the agents and the DataCollector reporters still see the current values.
+
+    Within a phase, trades are resolved as if the agents were activated one at a
+    time in the order given by `phase_order`, so results follow the same rules as
+    the agent-by-agent scheduler.
+    """
+
+    def bind_agent_arrays(self):
+        '''Create the state arrays from the agents currently in the schedule, and
+           point every agent's vectors at its row. Must be called once, after all
+           agents have been added.'''
+        model = self.model
+        num_products = len(Product)
+        self.merchants.sort(key=lambda a: a.unique_id)
+        self.locations.sort(key=lambda a: a.grid_id)
+        num_merchants = len(self.merchants)
+        num_locations = len(self.locations)
+
+        self.product = np.zeros((num_merchants, num_products), dtype=np.int64)
+        self.stock = np.zeros((num_merchants, num_products), dtype=np.int64)
+        self.demand = np.zeros((num_merchants, num_products), dtype=np.int64)
+        self.max_stock_size = np.zeros((num_merchants, num_products), dtype=np.int64)
+        self.internal_demand = np.zeros((num_merchants, num_products))
+        self.expected_price = np.zeros(num_merchants)
+        self.num_trades = np.zeros(num_merchants, dtype=np.int64)
+        self.time_since_trade = np.zeros(num_merchants, dtype=np.int64)
+        self.deposited_product = np.zeros((num_locations, num_products), dtype=np.int64)
+
+        # Merchant attributes that do not change during a run
+        self.strategy = np.full(num_merchants, PROFIT_STRATEGY)
+        self.specialist_index = np.full(num_merchants, -1)
+        # Shared with the model's location membership, which moves update
+        self.location_index = model.location_membership.location_index
+        for i, agent in enumerate(self.merchants):
+            if agent.short_agent_type() == 'internal demand':
+                if agent.decision_strat == DecisionStrategies.GENERALIST:
+                    self.strategy[i] = GENERALIST_STRATEGY
+                else:
+                    self.strategy[i] = SPECIALIST_STRATEGY
+                    self.specialist_index[i] = agent.specialist_index
+            self.product[i] = agent.product
+            self.stock[i] = agent.stock
+            self.demand[i] = agent.demand
+            agent.product = self.product[i]
+            agent.stock = self.stock[i]
+            agent.demand = self.demand[i]
+            agent.max_stock_size = self.max_stock_size[i]
+        self.is_internal = self.strategy != PROFIT_STRATEGY
+        for i, agent in enumerate(self.locations):
+            self.deposited_product[i] = agent.deposited_product
+            agent.deposited_product = self.deposited_product[i]
+
+        self.known_traders_version = None
+
+        # Spatial neighbours of each location, in the same CSR-like form
+        loc_neighbours = [[n - model.num_merchants for n in l.neighbours_dist] for l in self.locations]
+        loc_degrees = np.array([len(n) for n in loc_neighbours], dtype=np.int64)
+        self.loc_neighbour_ptr = np.concatenate(([0], np.cumsum(loc_degrees)))
+        self.loc_neighbour_ids = np.array([n for ns in loc_neighbours for n in ns], dtype=np.int64)
+        self.loc_degree = loc_degrees
+
+        # Product index produced at each location, or -1 for no production
+        self.location_production = np.array(
+            [l.producer_type.value.value if l.producer_type != ProducerType.NO_PRODUCT else -1
+             for l in self.locations])
+        # One generator per random number stream of the model
+        self.activation_rng = np.random.default_rng(model.seed_sequences[ACTIVATION_STREAM])
+        self.offer_rng = np.random.default_rng(model.seed_sequences[OFFER_STREAM])
+        self.movement_rng = np.random.default_rng(model.seed_sequences[MOVEMENT_STREAM])
+
+    def phase_order(self):
+        '''Returns the activation rank of each merchant for one phase.
+           Merchants are activated in a new random order if shuffling, 
+           otherwise in order of their unique id.'''
+        if not self.shuffle:
+            return np.arange(len(self.merchants))
+        return self.activation_rng.permutation(len(self.merchants))
+
+    def step(self) -> None:
+        """Step all merchants, one batched operation per phase"""
+        self.model.offer_book.clear()
+        self.reset()
+        self.determine_demand()
+        self.discard_part_of_stock()
+        self.get_newly_produced_product()
+        self.update_price_and_max_s_s()
+        offers = self.make_buy_offers()
+        self.process_offers(*offers)
+        self.move()
+        self.sync_agent_attributes()
+
+        self.steps += 1
+        self.time += 1
+
+    def sync_agent_attributes(self):
+        '''Copy the scalar attributes that reporters read back onto the agent objects.'''
+        for agent, trades, since_trade, loc in zip(self.merchants,
+                                                   self.num_trades.tolist(),
+                                                   self.time_since_trade.tolist(),
+                                                   self.location_index.tolist()):
+            agent.num_trades = trades
+            agent.time_since_trade = since_trade
+            agent.location_id = loc + self.model.num_merchants
+
+    ################################################################################
+    ### Checkpoints
+
+    def get_state(self):
+        '''Return the state of every merchant and location (see MerchantSimultaneousActivation.get_state),
+           and the state of this scheduler's random number generators.'''
+        state = super().get_state()
+        state['rngs'] = {name: getattr(self, name).bit_generator.state 
+                         for name in ['activation_rng', 'offer_rng', 'movement_rng']}
+        return state
+
+    def set_state(self, state, restore_random=True):
+        '''Restore a state returned by get_state. The arrays are written in place, so the 
+           agents' views still point at them. If `restore_random` is False, the random number
+           generators keep their current state.'''
+        self.steps = state['steps']
+        self.time = state['time']
+        self.product[:] = state['product']
+        self.stock[:] = state['stock']
+        self.demand[:] = state['demand']
+        self.max_stock_size[:] = state['max_stock_size']
+        self.num_trades[:] = state['num_trades']
+        self.time_since_trade[:] = state['time_since_trade']
+        self.location_index[:] = state['location_id'] - self.model.num_merchants
+        self.deposited_product[:] = state['deposited_product']
+        if restore_random:
+            for name, rng_state in state['rngs'].items():
+                getattr(self, name).bit_generator.state = rng_state
+        self.sync_agent_attributes()
+
+    ################################################################################
+    ### Phases
+
+    def reset(self):
+        '''Recalculate the internal demand of generalists and specialists.
+           If the social network has changed, also rebuild the known traders.'''
+        if self.known_traders_version != self.model.social_network_version:
+            self.update_known_traders()
+        num_products = self.product.shape[1]
+        generalist = self.strategy == GENERALIST_STRATEGY
+        ideal_amt = self.product[generalist].sum(axis=1, keepdims=True) / num_products
+        self.internal_demand[generalist] = ideal_amt - self.product[generalist]
+        specialist = np.flatnonzero(self.strategy == SPECIALIST_STRATEGY)
+        self.internal_demand[specialist] = 0
+        self.internal_demand[specialist, self.specialist_index[specialist]] = SPECIALIST_IDEAL_AMOUNT
+
+    def update_known_traders(self):
+        '''Give each merchant its known traders, and take the flat neighbour arrays
+           from the model's CSR adjacency matrix of the social network. Known traders
+           of merchant i are neighbour_ids[neighbour_ptr[i]:neighbour_ptr[i+1]]'''
+        for agent in self.merchants:
+            agent.known_traders = agent.get_known_traders()
+            agent.known_traders_version = self.model.social_network_version
+        self.neighbour_ptr = self.model.social_adjacency.indptr
+        self.neighbour_ids = self.model.social_adjacency.indices
+        self.degree = self.model.social_degree.astype(np.int64)
+        self.known_traders_version = self.model.social_network_version
+
+    def determine_demand(self):
+        '''Demand increases by 1 if demand is lower than max_demand'''
+        self.demand += self.demand < self.model.max_demand
+
+    def discard_part_of_stock(self):
+        '''DISCARD_FRACTION of stock is deposited onto the location, and the rest is moved to product'''
+        amount_to_deposit = np.rint(self.model.experiment_params['discard_fraction'] * self.stock).astype(np.int64)
+        np.maximum(self.demand - amount_to_deposit, 0, out=self.demand)
+        np.add.at(self.deposited_product, self.location_index, amount_to_deposit)
+        self.product += self.stock - amount_to_deposit
+        self.stock[:] = 0
+
+    def get_newly_produced_product(self):
+        '''Merchants at production sites have their unmet demand for that product met.'''
+        produced = self.location_production[self.location_index]
+        producers = np.flatnonzero(produced >= 0)
+        prod = produced[producers]
+        unmet_demand = self.demand[producers, prod] - (self.product[producers, prod] + self.stock[producers, prod])
+        self.product[producers, prod] += np.maximum(unmet_demand, 0)
+
+    def update_price_and_max_s_s(self):
+        '''Update max_stock_size and expected_price from the known traders' supply and demand'''
+        own_product = self.product.sum(axis=1)
+        own_demand = self.demand.sum(axis=1)
+        avg_supply, avg_demand = self.model.calc_neighbour_averages(own_product,
+                                                                    own_product + self.stock.sum(axis=1),
+                                                                    own_demand)
+        self.max_stock_size[:] = np.rint(avg_demand - own_demand).astype(np.int64)[:, None]
+        total = avg_supply + avg_demand
+        self.expected_price = np.where(total != 0,
+                                       avg_demand / np.where(total != 0, total, 1),
+                                       avg_demand / 0.00001)
+
+    def make_buy_offers(self):
+        '''Every merchant that should make an offer for a product type chooses a
+           random known trader (or co-located merchant, if location_trades is set).
+           Returns flat arrays of (buyer, seller, product_type, price) for all offers.'''
+        want = self.product < np.where(self.is_internal[:, None], self.internal_demand, self.demand)
+        want |= self.max_stock_size > 0
+        want &= (self.degree > 0)[:, None]
+        buyers, product_types = np.nonzero(want)
+
+        # Candidate sellers: known traders, then merchants at the same location,
+        # which are kept up to date by moves in the model's location membership
+        pool_size = self.degree[buyers]
+        location_membership = self.model.location_membership
+        if self.model.experiment_params['location_trades']:
+            pool_size = pool_size + location_membership.counts[self.location_index[buyers]]
+        choice = (self.offer_rng.random(len(buyers)) * pool_size).astype(np.int64)
+        from_known = choice < self.degree[buyers]
+        sellers = np.empty(len(buyers), dtype=np.int64)
+        sellers[from_known] = self.neighbour_ids[self.neighbour_ptr[buyers[from_known]] + choice[from_known]]
+        if self.model.experiment_params['location_trades']:
+            local = ~from_known
+            local_choice = choice[local] - self.degree[buyers[local]]
+            sellers[local] = location_membership.members[self.location_index[buyers[local]], local_choice]
+
+        # Price is the buyer's expected price minus the transport cost
+        distances = self.model.spatial_distances[self.location_index[buyers], self.location_index[sellers]]
+        connected = np.isfinite(distances)
+        transport_cost = self.model.experiment_params['distance_multiplier'] * np.where(connected, distances, 0) \
+                         / self.model.total_spatial_cost
+        prices = np.where(connected, self.expected_price[buyers] - transport_cost, 0)
+        # Offers are kept in the order they were made, which decides ties in process_offers
+        made_order = np.argsort(self.phase_order()[buyers], kind='stable')
+        return buyers[made_order], sellers[made_order], product_types[made_order], prices[made_order]
+
+    def process_offers(self, buyers, sellers, product_types, prices):
+        '''Each seller accepts the highest offer for each product type if their
+           decision strategy allows it, otherwise the product is moved to stock.'''
+        num_merchants, num_products = self.product.shape
+        # Highest offer for each (seller, product type); the first offer made wins ties
+        offer_book = self.model.offer_book
+        offer_book.add_offers(buyers, sellers, product_types, prices, self.steps)
+        best_price, best_buyer = offer_book.get_best_offers()
+        has_offer = best_buyer >= 0
+
+        # Profit-maximizers
+        nothing_to_sell = (self.product < self.demand) | (self.product == 0)
+        profit_trade = ~nothing_to_sell & has_offer & (best_price > self.expected_price[:, None])
+        profit_to_stock = ~profit_trade
+        # Generalists and specialists
+        generalist = (self.strategy == GENERALIST_STRATEGY)[:, None]
+        specialist = (self.strategy == SPECIALIST_STRATEGY)[:, None]
+        not_specialist_item = specialist & (np.arange(num_products) != self.specialist_index[:, None])
+        considering = ~not_specialist_item & (self.product != 0)
+        internal_trade = considering & has_offer & ((generalist & (self.internal_demand < 0)) \
+                                                  | (specialist & (self.internal_demand == 0)))
+        internal_to_stock = ~not_specialist_item & ((self.product == 0) | ~has_offer)
+
+        is_internal = self.is_internal[:, None]
+        trade = np.where(is_internal, internal_trade, profit_trade)
+        to_stock = np.where(is_internal, internal_to_stock, profit_to_stock)
+
+        # Sellers: move unsold product to stock, or trade one unit away
+        self.stock[to_stock] = self.product[to_stock]
+        self.max_stock_size[to_stock] -= self.product[to_stock]
+        self.product[to_stock] = 0
+        self.product[trade] -= 1
+
+        # time_since_trade is reset by a trade, and incremented by each later move to stock
+        traded_any = trade.any(axis=1)
+        last_trade = np.where(traded_any, num_products - 1 - np.argmax(trade[:, ::-1], axis=1), -1)
+        after_last_trade = np.arange(num_products) > last_trade[:, None]
+        self.time_since_trade = np.where(traded_any, 0, self.time_since_trade) \
+                                + (to_stock & after_last_trade).sum(axis=1)
+
+        # Buyers: put the item in stock if they have demand, otherwise deposit it
+        trade_sellers, trade_products = np.nonzero(trade)
+        trade_buyers = best_buyer[trade_sellers, trade_products]
+        np.add.at(self.num_trades, trade_sellers, 1)
+        np.add.at(self.num_trades, trade_buyers, 1)
+        has_demand = self.demand[trade_buyers, trade_products] > 0
+        stocking_buyers, stocking_products = trade_buyers[has_demand], trade_products[has_demand]
+        self.max_stock_size[stocking_buyers, stocking_products] -= 1
+        # A buyer activated after the seller overwrites its stock when moving product to stock
+        rank = self.phase_order()
+        overwritten = to_stock[stocking_buyers, stocking_products] \
+                      & (rank[trade_sellers[has_demand]] < rank[stocking_buyers])
+        self.stock[stocking_buyers[~overwritten], stocking_products[~overwritten]] += 1
+        np.add.at(self.deposited_product,
+                  (self.location_index[trade_buyers[~has_demand]], trade_products[~has_demand]), 1)
+
+    def move(self):
+        '''Merchants that have not traded for no_trade_tolerance steps have a
+           chance to move to a neighbouring location.'''
+        no_trade_tolerance = self.model.experiment_params['no_trade_tolerance']
+        if no_trade_tolerance < 0:
+            return
+        coin = self.movement_rng.random(len(self.merchants))
+        moving = (self.time_since_trade >= no_trade_tolerance) & (coin > 0.8) \
+                 & (self.loc_degree[self.location_index] > 0)
+        movers = np.flatnonzero(moving)
+        old_locations = self.location_index[movers]
+        choice = (self.movement_rng.random(len(movers)) * self.loc_degree[old_locations]).astype(np.int64)
+        new_locations = self.loc_neighbour_ids[self.loc_neighbour_ptr[old_locations] + choice]
+        self.model.location_membership.move_many(movers, new_locations)
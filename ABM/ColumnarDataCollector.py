@@ -0,0 +1,255 @@
+from collections.abc import Mapping
+from .constants import *
+from .reporters import *
+import numpy as np
+import pandas as pd
+
+# Number of steps to allocate space for at first. Space is doubled whenever it runs out.
+INITIAL_STEP_CAPACITY = 64
+
+
+class ColumnarDataCollector():
+    """A data collector for MerchantModel that writes agent values straight into
+    preallocated (steps x agents) numpy arrays, instead of calling one reporter
+    function per agent per column like mesa.DataCollector.
+
+    Columns that cannot change during a run (category, type, stable id, names) are
+    recorded once. The DataFrame is only built when get_agent_vars_dataframe is called.
+
+    Rows are ordered as in the schedule: merchants by id, then locations, and the
+    columns and values match the reporters previously registered with mesa.DataCollector.
+    `model_vars`, `agent_reporters` and `_agent_records` are provided in the same form
+    as mesa.DataCollector, so that mesa.batch_run can read this collector (when 
+    collecting every step).
+
+    Args:
+        collection_period (int): keep every k-th step. FINAL_STEP_ONLY keeps no step but the latest.
+        collection_steps (list of ints): if given, keep only these steps, ignoring collection_period
+        collected_agents (string): COLLECT_BOTH, COLLECT_LOCATIONS or COLLECT_MERCHANTS
+
+    The latest step is always available, even when it is not one of the kept steps:
+    each collection overwrites the previous one unless the previous step was kept.
+    """
+    def __init__(self, model, 
+                 collection_period=COLLECTION_PERIOD, 
+                 collection_steps=COLLECTION_STEPS, 
+                 collected_agents=COLLECTED_AGENTS):
+        self.model = model
+        self.collection_period = collection_period
+        self.collection_steps = set(collection_steps) if collection_steps is not None else None
+        if collected_agents not in [COLLECT_BOTH, COLLECT_LOCATIONS, COLLECT_MERCHANTS]:
+            raise NotImplementedError(f"Collecting data for {collected_agents} has not been implemented")
+        self.collect_merchants = collected_agents != COLLECT_LOCATIONS
+        self.collect_locations = collected_agents != COLLECT_MERCHANTS
+        self.merchants = list(model.schedule.merchants)
+        self.locations = list(model.schedule.locations)
+        self.num_merchants = len(self.merchants)
+        self.num_agents = self.num_merchants + len(self.locations)
+        num_products = len(Product)
+
+        self.agent_reporters = ["agent_category", "agent_type", "agent_location", "agent_stable_id",
+                                "latin_name", "modern_name"]
+        for prod in Product:
+            self.agent_reporters += [f"{prod.name} Product", f"{prod.name} Stock", f"{prod.name} Demand"]
+        self.agent_reporters += ["num_trades", "node_degree"]
+        self.model_vars = {f"{SUM_PRODUCT_REPORTER}": []}
+
+        # Static columns, recorded once
+        agents = self.merchants + self.locations
+        self.agent_ids = np.array([a.unique_id for a in agents])
+        self.static = {
+            "agent_category": np.array([get_agent_category(a) for a in agents], dtype=object),
+            "agent_type": np.array([get_agent_type(a) for a in agents], dtype=object),
+            "agent_stable_id": np.array([get_agent_stable_id(a) for a in agents]),
+            "latin_name": np.array([get_agent_latin_name(a) for a in agents], dtype=object),
+            "modern_name": np.array([get_agent_modern_name(a) for a in agents], dtype=object),
+        }
+        # Modern name of each location, indexed by location id - num_merchants
+        self.location_names = np.array([model.locid_to_mname[l.grid_id] for l in self.locations], dtype=object)
+        self.location_degrees = np.array([l.get_node_degree() for l in self.locations])
+
+        # Agents included in the exported rows, as indices into merchants + locations
+        self.exported_agents = np.concatenate([np.arange(self.num_merchants) if self.collect_merchants else [],
+                                               np.arange(self.num_merchants, self.num_agents) if self.collect_locations else []]
+                                              ).astype(np.int64)
+
+        # Dynamic columns, one row per collected step
+        self.steps = []
+        self.last_step_kept = True
+        self.capacity = INITIAL_STEP_CAPACITY
+        self.product = np.zeros((self.capacity, self.num_agents, num_products), dtype=np.int64)
+        self.stock = np.zeros((self.capacity, self.num_merchants, num_products), dtype=np.int64)
+        self.demand = np.zeros((self.capacity, self.num_merchants, num_products), dtype=np.int64)
+        self.location_index = np.zeros((self.capacity, self.num_merchants), dtype=np.int64)
+        self.num_trades = np.zeros((self.capacity, self.num_merchants), dtype=np.int64)
+        self.node_degree = np.zeros((self.capacity, self.num_merchants), dtype=np.int64)
+
+    def grow(self):
+        '''Double the number of steps that there is space for.'''
+        for name in ['product', 'stock', 'demand', 'location_index', 'num_trades', 'node_degree']:
+            old = getattr(self, name)
+            new = np.zeros((2 * self.capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.capacity] = old
+            setattr(self, name, new)
+        self.capacity *= 2
+
+    def should_keep_step(self, step):
+        '''Returns True if this step should be kept once later steps are collected.'''
+        if self.collection_steps is not None:
+            return step in self.collection_steps
+        if self.collection_period == FINAL_STEP_ONLY:
+            return False
+        return step % self.collection_period == 0
+
+    def collect(self, model):
+        '''Record the current values for all agents, overwriting the previous 
+           collection if that step is not being kept.'''
+        if not self.last_step_kept:
+            self.steps.pop()
+            self.model_vars[f"{SUM_PRODUCT_REPORTER}"].pop()
+        row = len(self.steps)
+        if row == self.capacity:
+            self.grow()
+        schedule = model.schedule
+        self.steps.append(schedule.steps)
+        self.last_step_kept = self.should_keep_step(schedule.steps)
+        self.product[row, self.num_merchants:] = model.get_deposited_product()
+        self.model_vars[f"{SUM_PRODUCT_REPORTER}"].append(int(self.product[row, self.num_merchants:].sum()))
+        if not self.collect_merchants:
+            return
+        
+        if model.step_engine == ARRAY_ENGINE:
+            # The array engine already stores everything as arrays
+            self.product[row, :self.num_merchants] = schedule.product
+            self.stock[row] = schedule.stock
+            self.demand[row] = schedule.demand
+            self.location_index[row] = schedule.location_index
+            self.num_trades[row] = schedule.num_trades
+        else:
+            self.product[row, :self.num_merchants] = [a.product for a in self.merchants]
+            self.stock[row] = [a.stock for a in self.merchants]
+            self.demand[row] = [a.demand for a in self.merchants]
+            self.location_index[row] = model.location_membership.location_index
+            self.num_trades[row] = [a.num_trades for a in self.merchants]
+        self.node_degree[row] = [len(a.known_traders) for a in self.merchants]
+
+    ################################################################################
+    ### Checkpoints
+
+    def get_state(self):
+        '''Return everything collected so far, for a checkpoint.'''
+        rows = len(self.steps)
+        return {'steps': list(self.steps),
+                'model_vars': {name: list(values) for name, values in self.model_vars.items()},
+                'last_step_kept': self.last_step_kept,
+                'arrays': {name: getattr(self, name)[:rows].copy() 
+                           for name in ['product', 'stock', 'demand', 'location_index', 'num_trades', 'node_degree']}}
+
+    def set_state(self, state):
+        '''Replace everything collected so far with a state returned by get_state.'''
+        self.steps = list(state['steps'])
+        self.model_vars = {name: list(values) for name, values in state['model_vars'].items()}
+        self.last_step_kept = state['last_step_kept']
+        rows = len(self.steps)
+        while self.capacity < rows:
+            self.grow()
+        for name, values in state['arrays'].items():
+            getattr(self, name)[:rows] = values
+
+    ################################################################################
+    ### Export
+
+    def get_step_columns(self, rows):
+        '''Return a dictionary of column name to a flat array of values, for the given
+           collected rows (indices into self.steps), with the collected agents in schedule order.'''
+        rows = np.asarray(rows, dtype=np.int64)
+        num_rows = len(rows)
+        num_merchants = self.num_merchants
+        merchant = np.zeros(self.num_agents, dtype=bool)
+        merchant[:num_merchants] = True
+        is_merchant = np.tile(merchant, num_rows)
+
+        def merchant_column(values, location_values):
+            '''Combine (rows x merchants) values with a value for each location'''
+            column = np.empty((num_rows, self.num_agents), dtype=object)
+            column[:, :num_merchants] = values
+            column[:, num_merchants:] = location_values
+            return column.ravel()
+
+        columns = {}
+        columns["agent_category"] = np.tile(self.static["agent_category"], num_rows)
+        columns["agent_type"] = np.tile(self.static["agent_type"], num_rows)
+        columns["agent_location"] = merchant_column(self.location_names[self.location_index[rows]],
+                                                    self.location_names)
+        columns["agent_stable_id"] = np.tile(self.static["agent_stable_id"], num_rows)
+        columns["latin_name"] = np.tile(self.static["latin_name"], num_rows)
+        columns["modern_name"] = np.tile(self.static["modern_name"], num_rows)
+        for prod in Product:
+            p = prod.value
+            columns[f"{prod.name} Product"] = self.product[rows, :, p].ravel()
+            columns[f"{prod.name} Stock"] = merchant_column(self.stock[rows, :, p], "NA")
+            columns[f"{prod.name} Demand"] = merchant_column(self.demand[rows, :, p], "NA")
+        columns["num_trades"] = merchant_column(self.num_trades[rows], "NA")
+        node_degree = np.empty((num_rows, self.num_agents), dtype=np.int64)
+        node_degree[:, :num_merchants] = self.node_degree[rows]
+        node_degree[:, num_merchants:] = self.location_degrees
+        columns["node_degree"] = node_degree.ravel()
+        if len(self.exported_agents) < self.num_agents:
+            keep = (np.arange(num_rows)[:, None] * self.num_agents + self.exported_agents).ravel()
+            columns = {name: values[keep] for name, values in columns.items()}
+        return columns
+
+    def get_agent_vars_dataframe(self):
+        '''Return a DataFrame of all agent values, indexed by Step and AgentID,
+           in the same form as mesa.DataCollector.get_agent_vars_dataframe.'''
+        rows = np.arange(len(self.steps))
+        columns = self.get_step_columns(rows)
+        num_exported = len(self.exported_agents)
+        index = pd.MultiIndex.from_arrays([np.repeat(self.steps, num_exported),
+                                           np.tile(self.agent_ids[self.exported_agents], len(rows))],
+                                          names=["Step", "AgentID"])
+        return pd.DataFrame(columns, index=index)
+
+    def get_model_vars_dataframe(self):
+        '''Return a DataFrame of the model variables, indexed by the model tick.'''
+        return pd.DataFrame(self.model_vars, index=self.steps)
+
+    def get_batch_run_dataframe(self, run_id, iteration, params):
+        '''Return a DataFrame of all collected rows in the layout written by mesa.batch_run:
+           RunId, iteration, Step, one column per model parameter, the model variables,
+           AgentID, and then the agent variables.'''
+        agent_df = self.get_agent_vars_dataframe().reset_index()
+        model_df = self.get_model_vars_dataframe()
+        df = pd.DataFrame({"RunId": run_id, "iteration": iteration, "Step": agent_df["Step"]})
+        for param, value in params.items():
+            df[param] = [value] * len(df)
+        for var in self.model_vars:
+            df[var] = model_df[var].reindex(agent_df["Step"]).to_numpy()
+        return pd.concat([df, agent_df.drop(columns="Step")], axis=1)
+
+    @property
+    def _agent_records(self):
+        '''Agent records in the form used by mesa.DataCollector (and read by
+           mesa.batch_run): a mapping of step to a list of (step, agent id, *values) tuples.
+           Records are only built for the steps that are asked for.'''
+        return AgentRecords(self)
+
+
+class AgentRecords(Mapping):
+    """A read-only mapping of step to the list of agent record tuples for that step."""
+    def __init__(self, collector):
+        self.collector = collector
+        self.rows = {step: row for row, step in enumerate(collector.steps)}
+
+    def __getitem__(self, step):
+        row = self.rows[step]
+        columns = self.collector.get_step_columns([row])
+        values = [columns[name].tolist() for name in self.collector.agent_reporters]
+        ids = self.collector.agent_ids[self.collector.exported_agents].tolist()
+        return [(step, agent_id, *agent_values) for agent_id, *agent_values in zip(ids, *values)]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
@@ -0,0 +1,81 @@
+import numpy as np
+
+
+class LocationMembership():
+    """The location of every merchant, and the merchants at every location, as arrays.
+
+    location_index[m] is the index of merchant m's location (its location id - num_merchants).
+    The merchants at location l are members[l, :counts[l]], and position[m] is merchant m's
+    column in the row of its location. A move swaps the last merchant at the old location
+    into the mover's place, so it takes a few array writes however many merchants are at
+    either location. Rows start in order of merchant id, and double in length when a location
+    fills up.
+
+    Args:
+        location_index (array of ints): the location index of each merchant, in order of merchant id
+        num_locations (int): number of locations
+    """
+    def __init__(self, location_index, num_locations):
+        self.location_index = np.array(location_index, dtype=np.int64)
+        self.counts = np.bincount(self.location_index, minlength=num_locations).astype(np.int64)
+        self.members = np.full((num_locations, max(1, self.counts.max(initial=0))), -1, dtype=np.int64)
+        self.position = np.zeros(len(self.location_index), dtype=np.int64)
+
+        by_location = np.argsort(self.location_index, kind='stable')
+        location_ptr = np.concatenate(([0], np.cumsum(self.counts)))
+        sorted_locations = self.location_index[by_location]
+        positions = np.arange(len(by_location)) - location_ptr[sorted_locations]
+        self.members[sorted_locations, positions] = by_location
+        self.position[by_location] = positions
+
+    def get_members(self, location):
+        '''Return an array of the ids of the merchants at the location index. This is a view,
+           so it must be copied if it is kept while merchants move.'''
+        return self.members[location, :self.counts[location]]
+
+    def get_count(self, location):
+        '''Return the number of merchants at the location index.'''
+        return int(self.counts[location])
+
+    def move(self, merchant, new_location):
+        '''Move the merchant to the location index `new_location`.'''
+        old_location = self.location_index[merchant]
+        if old_location == new_location:
+            return
+        # Fill the merchant's place with the last merchant at the old location
+        slot = self.position[merchant]
+        last = self.counts[old_location] - 1
+        replacement = self.members[old_location, last]
+        self.members[old_location, slot] = replacement
+        self.position[replacement] = slot
+        self.members[old_location, last] = -1
+        self.counts[old_location] = last
+
+        end = self.counts[new_location]
+        if end == self.members.shape[1]:
+            self.members = np.pad(self.members, ((0, 0), (0, self.members.shape[1])), constant_values=-1)
+        self.members[new_location, end] = merchant
+        self.position[merchant] = end
+        self.counts[new_location] = end + 1
+        self.location_index[merchant] = new_location
+
+    def move_many(self, merchants, new_locations):
+        '''Move each merchant to the matching location index, in order.'''
+        for merchant, new_location in zip(merchants.tolist(), new_locations.tolist()):
+            self.move(merchant, new_location)
+
+    ################################################################################
+    ### Checkpoints
+
+    def get_state(self):
+        return {'location_index': self.location_index.copy(),
+                'counts': self.counts.copy(),
+                'members': self.members.copy(),
+                'position': self.position.copy()}
+
+    def set_state(self, state):
+        # location_index is written in place, as the array engine shares it
+        self.location_index[:] = state['location_index']
+        self.counts[:] = state['counts']
+        self.members = state['members'].copy()
+        self.position[:] = state['position']
@@ -0,0 +1,90 @@
+from .constants import *
+import numpy as np
+import pandas as pd
+
+
+class LocationStatistics():
+    """Running statistics of each location's share of the deposited product, across
+    the runs of one cell of the parameter grid. A location's share of a product is its
+    deposited_product divided by the total deposited at all locations.
+
+    Each run is added as it finishes, so the per-agent rows never need to be kept:
+    - the mean and variance are updated with Welford's algorithm
+    - quantiles are estimated from a fixed histogram of `num_bins` equal-width bins
+      in [0, 1], ie with a resolution of 1 / num_bins. They are also kept
+      between the smallest and largest share seen, so a share that is the same in
+      every run is given exactly
+
+    Args:
+        location_names (list of strings): modern name of each location, in schedule order
+        num_bins (int): number of histogram bins used for the quantile estimates
+    """
+    def __init__(self, location_names, num_bins=SHARE_HISTOGRAM_BINS):
+        self.location_names = np.array(location_names, dtype=object)
+        self.num_bins = num_bins
+        shape = (len(location_names), len(Product))
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.minimum = np.full(shape, np.inf)
+        self.maximum = np.full(shape, -np.inf)
+        self.histogram = np.zeros(shape + (num_bins,), dtype=np.int64)
+
+    @classmethod
+    def from_model(cls, model, num_bins=SHARE_HISTOGRAM_BINS):
+        '''Return empty statistics for the locations of the given model.'''
+        return cls([model.locid_to_mname[l.grid_id] for l in model.schedule.locations], num_bins)
+
+    def add_model(self, model):
+        '''Add the current deposits of the given model as one run.'''
+        self.add_run(model.get_deposited_product())
+
+    def add_run(self, deposited_product):
+        '''Add one run, given its (locations x products) array of deposited product.'''
+        deposited_product = np.asarray(deposited_product, dtype=float)
+        total = deposited_product.sum(axis=0)
+        share = np.divide(deposited_product, total, out=np.zeros_like(deposited_product), where=total > 0)
+
+        self.count += 1
+        delta = share - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (share - self.mean)
+        np.minimum(self.minimum, share, out=self.minimum)
+        np.maximum(self.maximum, share, out=self.maximum)
+
+        # A share of exactly 1 goes in the last bin
+        bins = np.minimum((share * self.num_bins).astype(np.int64), self.num_bins - 1)
+        flat_bins = np.arange(bins.size) * self.num_bins + bins.ravel()
+        self.histogram.reshape(-1)[flat_bins] += 1
+
+    def get_variance(self):
+        '''Return the (locations x products) sample variance of the shares, or nan if fewer than 2 runs were added.'''
+        if self.count < 2:
+            return np.full(self.mean.shape, np.nan)
+        return self.m2 / (self.count - 1)
+
+    def get_quantile(self, q):
+        '''Return the (locations x products) estimate of the q-th quantile of the shares,
+        interpolating linearly within the histogram bin that contains it.'''
+        cumulative = np.cumsum(self.histogram, axis=-1)
+        target = q * self.count
+        # First bin whose cumulative count reaches the target
+        bins = np.minimum((cumulative < target).sum(axis=-1), self.num_bins - 1)
+        in_bin = np.take_along_axis(self.histogram, bins[..., None], axis=-1)[..., 0]
+        below = np.take_along_axis(cumulative, bins[..., None], axis=-1)[..., 0] - in_bin
+        fraction = np.divide(target - below, in_bin, out=np.zeros(bins.shape), where=in_bin > 0)
+        quantile = (bins + np.clip(fraction, 0, 1)) / self.num_bins
+        return np.clip(quantile, self.minimum, self.maximum)
+
+    def get_summary_dataframe(self, quantiles=SUMMARY_QUANTILES):
+        '''Return a DataFrame with one row per location and product type, with the number
+        of runs, and the mean, standard deviation and quantiles of the location's share.'''
+        num_locations, num_products = self.mean.shape
+        df = pd.DataFrame({'modern_name': np.repeat(self.location_names, num_products),
+                           'product_type': np.tile([f"{prod.name} Product" for prod in Product], num_locations),
+                           'runs': self.count,
+                           'share_mean': self.mean.ravel(),
+                           'share_std': np.sqrt(self.get_variance()).ravel()})
+        for q in quantiles:
+            df[f'share_q{round(q * 100)}'] = self.get_quantile(q).ravel()
+        return df
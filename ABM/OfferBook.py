@@ -0,0 +1,89 @@
+from .constants import *
+import numpy as np
+import pandas as pd
+
+
+class OfferBook():
+    """The buy offers made to each merchant in the current step.
+
+    Only the best offer for each (seller, product type) is kept, in flat arrays of the
+    highest price and the buyer who offered it. The first offer made wins ties, as
+    with max() over the offers in the order they were made. So making an offer does
+    not create any objects, and the book is cleared in place at the start of each step.
+
+    Args:
+        num_merchants (int): number of merchants, who are the sellers
+        log_offers (bool): if True, also keep every offer made, for debugging (see get_offer_log_dataframe)
+    """
+    def __init__(self, num_merchants, log_offers=LOG_OFFERS):
+        self.num_products = len(Product)
+        self.best_price = np.full(num_merchants * self.num_products, -np.inf)
+        self.best_buyer = np.full(num_merchants * self.num_products, -1, dtype=np.int64)
+        self.log_offers = log_offers
+        # (step, buyers, sellers, product types, prices), as single values or arrays of offers
+        self.offer_log = []
+
+    def clear(self):
+        '''Remove all offers.'''
+        self.best_price.fill(-np.inf)
+        self.best_buyer.fill(-1)
+
+    def add_offer(self, buyer, seller, product_type, price, step=None):
+        '''Add an offer from `buyer` to buy one unit of `product_type` from `seller` at `price`.'''
+        key = seller * self.num_products + product_type
+        if price > self.best_price[key]:
+            self.best_price[key] = price
+            self.best_buyer[key] = buyer
+        if self.log_offers:
+            self.offer_log.append((step, buyer, seller, product_type, price))
+
+    def add_offers(self, buyers, sellers, product_types, prices, step=None):
+        '''Add arrays of offers, given in the order they were made, with a scatter-max of
+           the prices onto each (seller, product type). Same as calling add_offer for each.'''
+        keys = sellers * self.num_products + product_types
+        previous_price = self.best_price[keys]
+        np.maximum.at(self.best_price, keys, prices)
+        # The first offer at the best price wins, unless an earlier offer was already at that price
+        best = np.flatnonzero((prices == self.best_price[keys]) & (prices > previous_price))
+        best_keys, first = np.unique(keys[best], return_index=True)
+        self.best_buyer[best_keys] = buyers[best[first]]
+        if self.log_offers:
+            self.offer_log.append((step, buyers, sellers, product_types, prices))
+
+    def get_best_offer(self, seller, product_type):
+        '''Return the (buyer, price) of the best offer made to `seller` for `product_type`,
+           or None if there is no offer.'''
+        key = seller * self.num_products + product_type
+        buyer = self.best_buyer[key]
+        if buyer < 0:
+            return None
+        return int(buyer), float(self.best_price[key])
+
+    def get_best_offers(self):
+        '''Return (merchants x products) arrays of the best price and best buyer.
+           Without an offer, the price is -inf and the buyer is -1.'''
+        return self.best_price.reshape(-1, self.num_products), self.best_buyer.reshape(-1, self.num_products)
+
+    def get_offer_log_dataframe(self):
+        '''Return a DataFrame of every offer logged, in the order they were made.'''
+        columns = ['step', 'buyer', 'seller', 'product_type', 'price']
+        if not self.offer_log:
+            return pd.DataFrame(columns=columns)
+        counts = [np.size(entry[1]) for entry in self.offer_log]
+        data = {'step': np.repeat([entry[0] for entry in self.offer_log], counts)}
+        for i, column in enumerate(columns[1:], start=1):
+            data[column] = np.concatenate([np.atleast_1d(entry[i]) for entry in self.offer_log])
+        return pd.DataFrame(data)
+
+    ################################################################################
+    ### Checkpoints
+
+    def get_state(self):
+        return {'best_price': self.best_price.copy(),
+                'best_buyer': self.best_buyer.copy(),
+                'offer_log': list(self.offer_log)}
+
+    def set_state(self, state):
+        self.best_price[:] = state['best_price']
+        self.best_buyer[:] = state['best_buyer']
+        self.offer_log = list(state['offer_log'])
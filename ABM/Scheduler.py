@@ -1,18 +1,42 @@
 from mesa.time import BaseScheduler
-from .constants import VERBOSE
+from .constants import VERBOSE, ACTIVATION_STREAM
 import random
 import numpy as np
 
 class MerchantSimultaneousActivation(BaseScheduler):
     """A scheduler to simulate the activation of the merchant agents.
 
-    This scheduler requires that each agent have 
+    This scheduler requires that each agent have an `agent_category` method. 
+    Merchants are kept in their own list, and only merchants are activated in 
+    each phase. Location agents are stored, but have no phase methods to run.
 
+    If `shuffle` is True, the merchants are activated in a new random order in 
+    every phase, using the model's activation random number stream. Otherwise,
+    they are activated in the order they were added.
     """
+    def __init__(self, model, shuffle=True):
+        super().__init__(model)
+        self.shuffle = shuffle
+        self.merchants = []
+        self.locations = []
+
+    def add(self, agent):
+        super().add(agent)
+        if agent.agent_category() == 'merchant':
+            self.merchants.append(agent)
+        else:
+            self.locations.append(agent)
+
+    def remove(self, agent):
+        super().remove(agent)
+        if agent.agent_category() == 'merchant':
+            self.merchants.remove(agent)
+        else:
+            self.locations.remove(agent)
 
     def step(self) -> None:
-        """Step all agents"""
-        # What must be done for each agent:
+        """Step all merchants, one phase at a time"""
+        # What must be done for each merchant:
         # self.reset()
         # self.determine_demand()
         # self.discard_part_of_stock()
@@ -20,52 +44,93 @@ class MerchantSimultaneousActivation(BaseScheduler):
         # self.update_max_stock_size()
         # self.make_buy_offers()
         # self.process_offers()
-        for agent_key in self.random_order_agent_keys():
-            self._agents[agent_key].reset()
+        self.model.offer_book.clear()
+        for agent in self.phase_agents():
+            agent.reset()
         
         if VERBOSE:
             print(f"\n\n\n Step {self.steps}")
             print("****** \nDemand (after update)")
-        for agent_key in self.random_order_agent_keys():
-            self._agents[agent_key].determine_demand()
+        for agent in self.phase_agents():
+            agent.determine_demand()
         
         if VERBOSE:
             print("\n****** \nDiscard stock")
-        for agent_key in self.random_order_agent_keys():
-            self._agents[agent_key].discard_part_of_stock()
+        for agent in self.phase_agents():
+            agent.discard_part_of_stock()
 
         if VERBOSE:
             print("\n****** \nProduct (amount of product after production)")
-        for agent_key in self.random_order_agent_keys():
-            self._agents[agent_key].get_newly_produced_product()
+        for agent in self.phase_agents():
+            agent.get_newly_produced_product()
 
 
         if VERBOSE:
             print("\n****** \nAfter updating max_s_s and price: ")        
-        for agent_key in self.random_order_agent_keys():
-            self._agents[agent_key].update_price_and_max_s_s()
+        self.model.update_neighbour_averages()
+        for agent in self.phase_agents():
+            agent.update_price_and_max_s_s()
 
         
         if VERBOSE:
             print("\n****** Making buy offers")
-        for agent_key in self.random_order_agent_keys():
-            self._agents[agent_key].make_buy_offers()
+        for agent in self.phase_agents():
+            agent.make_buy_offers()
 
 
         if VERBOSE:
             print("\n****** Processing buy offers")        
-        for agent_key in self.random_order_agent_keys():
-            self._agents[agent_key].process_offers()
+        for agent in self.phase_agents():
+            agent.process_offers()
 
         if VERBOSE:
             print("\n****** Potentially moving locations")        
-        for agent_key in self.random_order_agent_keys():
-            self._agents[agent_key].move()
+        for agent in self.phase_agents():
+            agent.move()
             
         self.steps += 1
         self.time += 1
         
-    def random_order_agent_keys(self):
-        keys = list(self._agents.keys())
-        random.shuffle(list(self._agents.keys()))
-        return keys
\ No newline at end of file
+    def phase_agents(self):
+        '''Return the merchants in the order they should be activated for one phase.'''
+        if not self.shuffle:
+            return self.merchants
+        agents = list(self.merchants)
+        self.model.random_streams[ACTIVATION_STREAM].shuffle(agents)
+        return agents
+
+    ################################################################################
+    ### Checkpoints
+
+    def get_state(self):
+        '''Return the step count and the state of every merchant and location, with one
+           row per agent in schedule order. expected_price and internal_demand are not
+           included, as they are recalculated at the start of every step. Offers are kept
+           in the model's offer book, and the merchants at each location in its location membership.'''
+        return {'steps': self.steps,
+                'time': self.time,
+                'product': np.array([list(a.product) for a in self.merchants]),
+                'stock': np.array([list(a.stock) for a in self.merchants]),
+                'demand': np.array([list(a.demand) for a in self.merchants]),
+                # None for every product until the first step
+                'max_stock_size': np.array([list(a.max_stock_size) for a in self.merchants]),
+                'num_trades': np.array([a.num_trades for a in self.merchants]),
+                'time_since_trade': np.array([a.time_since_trade for a in self.merchants]),
+                'location_id': np.array([a.location_id for a in self.merchants]),
+                'deposited_product': np.array([list(l.deposited_product) for l in self.locations])}
+
+    def set_state(self, state, restore_random=True):
+        '''Restore a state returned by get_state. `restore_random` is ignored here, as 
+           this scheduler draws from the model's random number streams.'''
+        self.steps = state['steps']
+        self.time = state['time']
+        for i, agent in enumerate(self.merchants):
+            agent.product = state['product'][i].tolist()
+            agent.stock = state['stock'][i].tolist()
+            agent.demand = state['demand'][i].tolist()
+            agent.max_stock_size = state['max_stock_size'][i].tolist()
+            agent.num_trades = int(state['num_trades'][i])
+            agent.time_since_trade = int(state['time_since_trade'][i])
+            agent.location_id = int(state['location_id'][i])
+        for i, location in enumerate(self.locations):
+            location.deposited_product = state['deposited_product'][i].tolist()
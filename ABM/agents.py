@@ -3,6 +3,7 @@ import mesa
 import random
 from ABM.constants import *
 import networkx as nx
+import numpy as np
 
 ## Major differences from MERCURY model
 #  - demand as a vector: it doesn't make sense to have a demand that can be filled with any type of product.
@@ -10,17 +11,6 @@ import networkx as nx
 #  - trades per agent as opposed to per item: It is much more intutive to have trades be per agent. Agents are the ones who do the trading.
 # 
 
-class BuyOffer():
-    ''' Buy Offers are offers from the agent with unique_id, who wants to buy one
-        unit of product_type at the given price.'''
-    def __init__(self, unique_id, product_type, price):
-        self.unique_id = unique_id
-        self.product_type = product_type
-        self.price = price
-    def __repr__(self):
-        return (f"(Agent: {str(self.unique_id)}, "
-               f"product type: {self.product_type}, "
-               f"price: {self.price})")
 ################################################################################
 ##############
 # Location Agents
@@ -50,8 +40,11 @@ class LocationAgent(mesa.Agent):
         
         # A list of product amounts. Index 0 has the amount for the first product type, etc.
         self.deposited_product = [0] * len(Product)
-        # A list of agent_ids (ints) corresponding to agents currently at this location.
-        self.merchants = []
+ 
+    @property
+    def merchants(self):
+        '''An array of the agent_ids (ints) of the merchants currently at this location (see LocationMembership)'''
+        return self.model.location_membership.get_members(self.grid_id - self.model.num_merchants)
     
     def agent_category(self):
         return 'location'
@@ -71,12 +64,6 @@ class LocationAgent(mesa.Agent):
         '''Update the amount of deposited_product to be the given amount'''
         self.deposited_product[product_type] = amount
         
-    def remove_from_merchants(self, agent_id):
-        self.merchants.remove(agent_id)
-    
-    def add_to_merchants(self, agent_id):
-        self.merchants.append(agent_id)
-        
     def get_node_degree(self):
         return len(self.neighbours_dist)
 
@@ -126,18 +113,17 @@ class ProfitAgent(mesa.Agent):
         self.location_id = location_id
         self.distance_multiplier = distance_multiplier
         
-        # Initialized in the `reset` method
+        # Initialized in the `reset` method, and only rebuilt when the social network changes
         self.known_traders = []
+        self.known_traders_version = None
         
-        self.product = [0 for prod in Product]
+        self.product = [0] * len(Product)
         # stock vector
         self.stock = [0] * len(self.product)
         # max_stock_size vector, with values initialized later
         self.max_stock_size = [None] * len(self.product) 
         # from the MERCURY model: all demand is initialized as 0
         self.demand = [0] * len(self.product)
-        # A list of lists, where each inner list is a list of offers for one prod type
-        self.buy_offers = [[] for _ in range(len(list(Product)))]
         # Counter for the number of successfully executed trades
         self.num_trades = 0
         # Counter for number of timesteps since a successful trade
@@ -168,16 +154,13 @@ class ProfitAgent(mesa.Agent):
         return self.model.locid_to_mname[self.location_id]
     def get_location_agent(self) -> LocationAgent:
         '''Returns the location agent associated with the location id'''
-        return self.model.get_agent(self.location_id)
+        return self.model.get_location_agent(self.location_id)
 
     def get_known_traders(self):
         '''Returns MerchantAgent neighbor nodes.'''
         neighbors = self.model.social_network.neighbors(self.unique_id)
-        # gets unique ids of neighbor nodes
-        ids = [n for n in neighbors]
-        # get nodes from unique ids using grid
-        nodes = self.model.grid.get_cell_list_contents(ids)
-        return nodes
+        # get agents from the unique ids of neighbor nodes
+        return [self.model.merchant_agents[n] for n in neighbors]
     
     def get_product(self, product_type):
         return self.product[product_type]
@@ -212,18 +195,14 @@ class ProfitAgent(mesa.Agent):
         return avg_demand / (avg_supply + avg_demand) if avg_supply + avg_demand != 0 else avg_demand/0.00001
 
     def get_average_supply(self):
-        '''Get average supply of traders (including yourself)'''
-        product_vectors = [a.product for a in self.known_traders]
-        stock_vectors = [a.stock for a in self.known_traders]
-        supply_vectors = product_vectors + stock_vectors
-        supplies = [sum(items) for items in supply_vectors]
-        return (sum(supplies) + sum(self.product)) / (len(self.known_traders) + 1)
+        '''Get average supply of traders (including yourself).
+        This is calculated for all merchants at once by the model, at the start of the phase.'''
+        return float(self.model.average_supply[self.unique_id])
 
     def get_average_demand(self):
-        '''Get average demand of traders '''
-        demand_vectors = [a.demand for a in self.known_traders]
-        demands = [sum(demand) for demand in demand_vectors]
-        return sum(demands) / len(self.known_traders) if len(self.known_traders) > 0 else 0
+        '''Get average demand of traders.
+        This is calculated for all merchants at once by the model, at the start of the phase.'''
+        return float(self.model.average_demand[self.unique_id])
 
 
     ################################################################################
@@ -310,7 +289,7 @@ class ProfitAgent(mesa.Agent):
 
     def update_price(self):
         ''' Initialize the expected price attribute of this agent. This needs to 
-            be done before it is used when considering BuyOffers in advance()'''
+            be done before it is used when considering buy offers in advance()'''
         self.expected_price = self.calc_expected_price()
 
 
@@ -339,55 +318,60 @@ class ProfitAgent(mesa.Agent):
         return retval
     
     def make_offer(self, product_type):
-        ''' Requesting a trade means adding yourself to the Seller's trade_offers list.'''
+        ''' Requesting a trade means adding an offer to the model's offer book, which keeps
+            the best offer made to each seller.'''
         if VERBOSE:
             print(f"Agent {self.unique_id} is requesting a trade")
         
-        potential_traders_ids = [a.unique_id for a in self.known_traders]
+        # The candidates are the known traders, followed by the merchants at this location
+        # (see LocationMembership), so one index is drawn instead of building the list
+        num_known = len(self.known_traders)
+        num_candidates = num_known
         if self.model.experiment_params['location_trades']:
-            location_agent : LocationAgent = self.get_location_agent()
-            merchants = location_agent.merchants
-            potential_traders_ids.extend(merchants)
+            location_membership = self.model.location_membership
+            location = self.location_id - self.model.num_merchants
+            num_candidates += location_membership.get_count(location)
             
-        potential_seller_id = self.random.choice(potential_traders_ids)
-        potential_seller : ProfitAgent = self.model.get_agent(potential_seller_id)
+        choice = self.model.random_streams[OFFER_STREAM].randrange(num_candidates)
+        if choice < num_known:
+            potential_seller : ProfitAgent = self.known_traders[choice]
+        else:
+            potential_seller : ProfitAgent = self.model.merchant_agents[location_membership.members[location, choice - num_known]]
+        potential_seller_id = potential_seller.unique_id
         offer_price = self.get_buy_offer_price(potential_seller)
-        offer = BuyOffer(self.unique_id, product_type, offer_price)
-
-        potential_seller.buy_offers[product_type] += [offer]
+        self.model.offer_book.add_offer(self.unique_id, potential_seller_id, product_type, offer_price, 
+                                        self.model.schedule.steps)
         if VERBOSE:
-            print(f"Offer of {offer} made to Agent {potential_seller.unique_id}")
+            print(f"Offer of {offer_price} for product type {product_type} made to Agent {potential_seller.unique_id}")
 
     def get_buy_offer_price(self, potential_seller):
         ''' Return the price that will be passed into the buy offer.
             This method will be overloaded in other agent types'''
-        source_loc_agent :LocationAgent = self.get_location_agent()
-        target_loc_agent = potential_seller.get_location_agent()
-        source_name = source_loc_agent.m_name
-        target_name = target_loc_agent.m_name
-        try:
-            shortest_path_len = nx.shortest_path_length(self.model.spatial_network,
-                                            source=source_name,
-                                            target=target_name, 
-                                            weight='weight')
-            # Transport cost needs to be between 0 and 1. 
-            # It is  the proportion that this distance is (multiplied by
-            # the multiplier) out of the total spatial network.
-            transport_cost = (self.distance_multiplier * shortest_path_len) / self.model.total_spatial_cost
-            return self.expected_price - transport_cost
-        except:
+        shortest_path_len = self.model.get_spatial_distance(self.location_id, potential_seller.location_id)
+        if shortest_path_len == np.inf:
+            # There is no path between the two locations
             return 0
+        # Transport cost needs to be between 0 and 1. 
+        # It is  the proportion that this distance is (multiplied by
+        # the multiplier) out of the total spatial network.
+        transport_cost = (self.distance_multiplier * shortest_path_len) / self.model.total_spatial_cost
+        return self.expected_price - transport_cost
         
     ###### Process offers 
     def process_offers(self):
         ''' Consider all trade offers for each product type. '''
         if VERBOSE:
-            print(f"Agent {self.unique_id}, offers: {self.buy_offers}")
+            print(f"Agent {self.unique_id}, best offers: {[self.get_best_offer(prod.value) for prod in Product]}")
         for prod in Product:
             product_type = prod.value 
             self.process_offers_for_product_type(product_type)
     
 
+    def get_best_offer(self, product_type):
+        '''Return the (buyer id, price) of the highest offer made to this agent for
+           this product type, or None if there are no offers.'''
+        return self.model.offer_book.get_best_offer(self.unique_id, product_type)
+
     def process_offers_for_product_type(self, product_type):
         '''Accept a trade offer if the price offered is higher than your expected price'''
         trade_executed_flag = False
@@ -404,17 +388,16 @@ class ProfitAgent(mesa.Agent):
         # Find the highest trade offer in self.trade_offers
         if VERBOSE:
             print("Product {product_type}: There is available product to sell, checking offers...")
-        if self.buy_offers[product_type]:
-            # Get the maximum-price trade offer in this agent's trade_offers list.
-            highest_offer : BuyOffer = max(self.buy_offers[product_type], key=lambda offer: offer.price)
+        highest_offer = self.get_best_offer(product_type)
+        if highest_offer is not None:
             # Check if offer price is larger than the expected price
-            offer_price = highest_offer.price
+            buyer_id, offer_price = highest_offer
             if VERBOSE:
                 print(f"offer price: {offer_price}, expected price: {self.expected_price}")
             if offer_price > self.expected_price:
                 # Execute the trade.
                 trade_executed_flag = True
-                self.execute_trade_away(highest_offer.unique_id, product_type)
+                self.execute_trade_away(buyer_id, product_type)
             
         if not trade_executed_flag:
             # If no agent was chosen to sell to, then reset as if no trade.
@@ -437,7 +420,7 @@ class ProfitAgent(mesa.Agent):
         self.set_product(product_type, self.product[product_type] - 1)
         
         # The buyer must decide whether to put item in stock or sell to consumer immediately.
-        buyer : ProfitAgent = self.model.grid.get_cell_list_contents([buyer_id])[0]
+        buyer : ProfitAgent = self.model.merchant_agents[buyer_id]
         
         if buyer.demand[product_type] > 0:
             if VERBOSE:
@@ -466,32 +449,28 @@ class ProfitAgent(mesa.Agent):
         
         if no_trade_tolerance >= 0 and self.time_since_trade >= no_trade_tolerance:
             # If the time limit is reached, then there is some percent chance of moving.
-            coin = random.random()
+            coin = self.model.random_streams[MOVEMENT_STREAM].random()
             if coin > 0.8:
                 self.move_to_neighbour()
 
     def move_to_neighbour(self):
-        '''Move this agent to a randomly-chosen neighbour.'''
+        '''Move this agent to a randomly-chosen neighbour. Agents at a location without
+           neighbours stay where they are.'''
         old_location_agent : LocationAgent = self.get_location_agent()
         neighbours = old_location_agent.neighbours_dist
+        if not neighbours:
+            return
         
         # Choose  neighbour in the dictionary
-        new_location_id, dist = random.choice(list(neighbours.items()))
-        
-        # Update intralayer edges
-        self.model.update_edges(self.unique_id, self.location_id, new_location_id, color=INTERLAYER_COLOR)
+        new_location_id, dist = self.model.random_streams[MOVEMENT_STREAM].choice(list(neighbours.items()))
                 
-        # Update location id
+        # Update location id, and the merchants at each location
         self.location_id = new_location_id
-        
-        # Update locations
-        old_location_agent.remove_from_merchants(self.unique_id)
-        new_location_agent : LocationAgent = self.get_location_agent()
-        new_location_agent.add_to_merchants(self.unique_id)
-        
-        
+        self.model.location_membership.move(self.unique_id, new_location_id - self.model.num_merchants)
+    
     
     def reset(self):
         '''Reset variables related to each step'''
-        self.known_traders = self.get_known_traders()
-        self.buy_offers = [[] for _ in range(len(list(Product)))]
+        if self.known_traders_version != self.model.social_network_version:
+            self.known_traders = self.get_known_traders()
+            self.known_traders_version = self.model.social_network_version
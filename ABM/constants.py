@@ -14,6 +14,8 @@ ITINERARIES = 'itineraries'
 module_path = os.path.dirname(os.path.realpath(__file__))
 all_itineraries_dir = os.path.join(module_path, '../itineraries/itineraries-files')
 orbis_britain_file = os.path.join(module_path, '../orbis/orbis_sites_brittania.csv')
+orbis_routes_file = os.path.join(module_path, '../orbis/orbis_routes_topo_o.json')
+all_itineraries_file = os.path.join(module_path, '../itineraries/all-itineraries-filtered.csv')
 
 def get_num_locations(spatial_network_type):
     return ORBIS_NUM_LOCATIONS if spatial_network_type==ORBIS else ITER_NUM_LOCATIONS
@@ -21,10 +23,46 @@ def get_num_locations(spatial_network_type):
 def get_spatial_dir(spatial_network_type):
     return orbis_britain_file if spatial_network_type == ORBIS else all_itineraries_dir
 
+def get_spatial_source_files(spatial_network_type):
+    '''Return the data files that the spatial network is built from.'''
+    return [orbis_britain_file, orbis_routes_file] if spatial_network_type == ORBIS else [all_itineraries_file]
+
 ## Social Networks
 COMPLETE_GRAPH = 'complete'
 BA_GRAPH = 'ba'
 WATTS_GRAPH = 'watts-strogatz'
+# Keyword arguments for the networkx generator of each social network type
+SOCIAL_NETWORK_GENERATOR_PARAMS = {COMPLETE_GRAPH: {},
+                                   BA_GRAPH: {'m': 5},
+                                   WATTS_GRAPH: {'k': 5, 'p': 0.5}}
+
+## Step engines
+AGENT_ENGINE = 'agent'
+ARRAY_ENGINE = 'array'
+
+## Activation orders
+SHUFFLED_ORDER = 'shuffled'
+FIXED_ORDER = 'fixed'
+
+## Data collection
+FINAL_STEP_ONLY = -1
+COLLECT_BOTH = 'both'
+COLLECT_LOCATIONS = 'locations'
+COLLECT_MERCHANTS = 'merchants'
+
+## Random number streams, each derived from the model's seed.
+# The order of this list decides which stream gets which part of the seed, so only add to the end.
+SOCIAL_NETWORK_STREAM = 'social network'
+PLACEMENT_STREAM = 'placement'
+ACTIVATION_STREAM = 'activation'
+OFFER_STREAM = 'offers'
+MOVEMENT_STREAM = 'movement'
+RANDOM_STREAMS = [SOCIAL_NETWORK_STREAM, PLACEMENT_STREAM, ACTIVATION_STREAM, OFFER_STREAM, MOVEMENT_STREAM]
+
+## Location statistics
+# Number of equal-width bins in [0, 1] used to estimate quantiles of location shares
+SHARE_HISTOGRAM_BINS = 1000
+SUMMARY_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
 
 ## Producer criteria
 NODE_DEGREE = "node degree"
@@ -44,6 +82,17 @@ PROPORTION_GENERALIST  = 0
 PROPORTION_SPECIALIST  = 0
 NO_TRADE_TOLERANCE     = -1
 LOCATION_TRADES        = False
+STEP_ENGINE            = AGENT_ENGINE
+ACTIVATION_ORDER       = SHUFFLED_ORDER
+COLLECTION_PERIOD      = 1
+COLLECTION_STEPS       = None
+COLLECTED_AGENTS       = COLLECT_BOTH
+SOCIAL_NETWORK_SEED    = 0
+PLACEMENT_SEED         = None
+SEED                   = None
+CONVERGENCE_TOLERANCE  = None
+CONVERGENCE_WINDOW     = 20
+LOG_OFFERS             = False
 
 ## Types
 
@@ -1,4 +1,4 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 import random
 from itineraries.create_graphs_from_csv import get_locations_and_distances_edgebunches_from_all_itin
 from orbis.create_orbis_graphs import get_info_from_orbis_style_file
@@ -10,7 +10,96 @@ from .constants import *
 from .reporters import *
 # from mesa.space import ProductionNetworkGrid
 from .Scheduler import MerchantSimultaneousActivation
-import pickle, os
+from .ArrayScheduler import ArraySimultaneousActivation
+from .ColumnarDataCollector import ColumnarDataCollector
+from .OfferBook import OfferBook
+from .LocationMembership import LocationMembership
+import numpy as np
+from scipy.sparse import csr_array
+import pickle, os, time, hashlib
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows. Files are still written atomically there, 
+    # but two processes may both create the same file.
+    fcntl = None
+
+################################################################################
+# Helpers
+
+def write_atomically(filename, write):
+    ''' Call write(f) with a binary file object, and move the result to filename. 
+    The data is written to a temporary file first and then moved into place, 
+    so that other processes never read a partially written file.'''
+    temp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(temp_filename, 'wb') as f:
+        write(f)
+    os.replace(temp_filename, filename)
+
+def dump_pickle_atomically(obj, filename):
+    ''' Pickle obj to filename atomically (see write_atomically).'''
+    write_atomically(filename, lambda f: pickle.dump(obj, f))
+
+@contextmanager
+def file_lock(filename):
+    ''' Hold an exclusive lock on filename + ".lock" while in the with block.
+    The lock file is left in place, as removing it could let a process that is waiting
+    on the old file and one that opens a new file both hold the lock (see .gitignore).'''
+    with open(f'{filename}.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+def read_or_create_file(filename, read, create, write):
+    ''' Return read(filename), first creating the file if it does not exist.
+    The file is created by write(f, create()) while holding a lock, so that when
+    several processes need the same file, only one of them creates it.'''
+    if not os.path.isfile(filename):
+        folder = os.path.dirname(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        with file_lock(filename):
+            # Another process may have created it while we waited for the lock
+            if not os.path.isfile(filename):
+                data = create()
+                write_atomically(filename, lambda f: write(f, data))
+    return read(filename)
+
+# Increase when the layout of compiled spatial network files changes, so files in the previous layout are recompiled
+COMPILED_SPATIAL_NETWORK_VERSION = 1
+
+def get_stream_seed(seed_sequence):
+    ''' Return an integer seed from a numpy SeedSequence, for generators that need an int.'''
+    return int(seed_sequence.generate_state(1, np.uint64)[0])
+
+# Increase when the layout of checkpoints changes, so old checkpoints are not loaded
+CHECKPOINT_VERSION = 5
+# Parameters that can differ between a checkpoint and a model forked from it
+FORKABLE_PARAMS = ['distance_multiplier', 'discard_fraction', 'no_trade_tolerance', 'location_trades',
+                   'collection_period', 'collection_steps', 'collected_agents', 'seed',
+                   'convergence_tolerance', 'convergence_window', 'log_offers']
+COLLECTION_PARAMS = ['collection_period', 'collection_steps', 'collected_agents']
+
+def load_checkpoint(filename):
+    ''' Return the checkpoint saved in filename by MerchantModel.save_checkpoint.'''
+    with open(filename, 'rb') as f:
+        checkpoint = pickle.load(f)
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"The checkpoint {filename} was saved in an older layout, and cannot be loaded")
+    return checkpoint
+
+def hash_files(filenames):
+    ''' Return a hex digest of the contents of the given files, in order.'''
+    digest = hashlib.sha256()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
 
 ################################################################################
 # Model
@@ -21,6 +110,24 @@ class MerchantModel(mesa.Model):
         - spatial_network_type (string)
         - social_network_type (string)
         - producer_critera (string): either 'node_degree' or 'random', determines how to choose producer  locations
+        - step_engine (string): AGENT_ENGINE steps each agent object in turn, ARRAY_ENGINE steps all merchants at once with numpy arrays
+        - activation_order (string): SHUFFLED_ORDER activates merchants in a new random order each phase, FIXED_ORDER in order of id
+        - collection_period (int): collect agent data every k steps. FINAL_STEP_ONLY (-1) keeps only the latest step.
+        - collection_steps (list of ints): if given, collect only these steps (and the latest step), ignoring collection_period
+        - collected_agents (string): COLLECT_BOTH, COLLECT_LOCATIONS or COLLECT_MERCHANTS, the agents that data is collected for
+        - social_network_seed (int): seed for generating the social network. Networks are cached by type, size and seed.
+          If None, the seed is taken from the social network stream of `seed`, so each run has its own network.
+        - placement_seed (int): seed for the random choices made while building the model, ie the producer
+          locations (with producer_criteria RANDOM) and each specialist's item. If None, the seed is taken
+          from the placement stream of `seed`.
+        - seed (int): seed for every random choice in the run. Independent streams are derived from it for the
+          social network, placement, activation order, offers and movement (see RANDOM_STREAMS). 
+          If None, a new seed is chosen, and saved as self.seed.
+        - convergence_tolerance (float): if given, the run stops once the share of the deposited product at each
+          location (see has_converged) has changed by less than this over the last convergence_window steps.
+          The step it stopped at is saved as self.stop_step. If None, the run never stops by itself.
+        - convergence_window (int): number of steps that the share of the deposited product is compared over
+        - log_offers (bool): if True, every buy offer is kept in self.offer_book, for debugging (see OfferBook)
         Params combined into self.experiment_params
         - distance_multiplier (float): amount to multiply distance by
         - discard_fraction (float): fraction of stock to discard
@@ -42,13 +149,29 @@ class MerchantModel(mesa.Model):
                  proportion_generalist=PROPORTION_GENERALIST,
                  proportion_specialist=PROPORTION_SPECIALIST,
                  no_trade_tolerance=NO_TRADE_TOLERANCE,
-                 location_trades=LOCATION_TRADES
+                 location_trades=LOCATION_TRADES,
+                 step_engine=STEP_ENGINE,
+                 activation_order=ACTIVATION_ORDER,
+                 collection_period=COLLECTION_PERIOD,
+                 collection_steps=COLLECTION_STEPS,
+                 collected_agents=COLLECTED_AGENTS,
+                 social_network_seed=SOCIAL_NETWORK_SEED,
+                 placement_seed=PLACEMENT_SEED,
+                 seed=SEED,
+                 convergence_tolerance=CONVERGENCE_TOLERANCE,
+                 convergence_window=CONVERGENCE_WINDOW,
+                 log_offers=LOG_OFFERS
                  ):
+        # Arguments the model was built with, saved in checkpoints so the model can be rebuilt
+        self.init_params = {name: value for name, value in locals().items() if name not in ['self', '__class__']}
+        construction_start = time.perf_counter()
         
         self.num_merchants = num_merchants
         self.num_locations = num_locations
         self.spatial_network_type = spatial_network_type
         self.social_network_type = social_network_type
+        self.step_engine = step_engine
+        self.activation_order = activation_order
         
         if proportion_profit + proportion_generalist + proportion_specialist > 1:
             raise ValueError(f"Agent type proportions add up to more than 1, with \n \
@@ -71,9 +194,35 @@ class MerchantModel(mesa.Model):
             self.first_location = (self.num_merchants // 100 + 1) * 100
         else:
             self.first_location = 500
-        self.interlayer_edges = []
 
         self.all_modern = []
+        # Hash of the files the spatial network is compiled from, set in create_spatial_network
+        self.spatial_source_hash = None
+
+        # Lookup tables from id to agent. merchant_agents is indexed by unique_id,
+        # and location_agents by location id - num_merchants.
+        self.merchant_agents = [None] * num_merchants
+        self.location_agents = []
+
+        ##################
+        # Random number streams, so that a run only depends on its seed
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.init_params['seed'] = self.seed
+        self.reset_randomizer(self.seed)
+        self.seed_sequences = dict(zip(RANDOM_STREAMS, np.random.SeedSequence(self.seed).spawn(len(RANDOM_STREAMS))))
+        self.random_streams = {name: random.Random(get_stream_seed(seed_sequence)) 
+                               for name, seed_sequence in self.seed_sequences.items()}
+        if social_network_seed is None:
+            social_network_seed = get_stream_seed(self.seed_sequences[SOCIAL_NETWORK_STREAM])
+        self.social_network_seed = social_network_seed
+        # So that a model rebuilt with another seed (see from_checkpoint) has the same social network
+        self.init_params['social_network_seed'] = social_network_seed
+        if placement_seed is None:
+            placement_seed = get_stream_seed(self.seed_sequences[PLACEMENT_STREAM])
+        self.placement_seed = placement_seed
+        # And the same producers and specialist items
+        self.init_params['placement_seed'] = placement_seed
+        self.random_streams[PLACEMENT_STREAM] = random.Random(placement_seed)
 
         ##################
         # Global Model Params
@@ -83,78 +232,294 @@ class MerchantModel(mesa.Model):
         ##################
         # Network Creation - Create networks, then create and place the agents.
         self.social_network = self.create_social_network(load_social_net=True)
+        self.social_network_version = 0
+        self.social_adjacency = self.create_social_adjacency()
+        self.social_degree = np.asarray(self.social_adjacency.sum(axis=1)).ravel()
         
         self.spatial_network = self.create_spatial_network()
-        self.G = nx.disjoint_union(self.social_network, self.spatial_network)
+        self.spatial_distances = self.create_spatial_distance_table(load_distances=True)
+        self.G = self.create_combined_network()
 
         self.grid = mesa.space.NetworkGrid(self.G)
-        self.schedule = MerchantSimultaneousActivation(self)
+        shuffle = self.activation_order == SHUFFLED_ORDER
+        if self.step_engine == AGENT_ENGINE:
+            self.schedule = MerchantSimultaneousActivation(self, shuffle=shuffle)
+        elif self.step_engine == ARRAY_ENGINE:
+            self.schedule = ArraySimultaneousActivation(self, shuffle=shuffle)
+        else:
+            raise NotImplementedError(f"The step engine {self.step_engine} has not been implemented")
         
+        # The best buy offer made to each merchant, for each product type
+        self.offer_book = OfferBook(num_merchants, log_offers)
+
         # Part 2: Create and place the agents
         self.locid_to_mname = {} # dictionary to connect grid id to latin name, for use in setting production locations
         self.producer_types = self.set_producers(producer_criteria=producer_criteria)
         self.init_all_agents()
+        if self.step_engine == ARRAY_ENGINE:
+            self.schedule.bind_agent_arrays()
         
-        self.datacollector = mesa.DataCollector(
-            model_reporters = {f"{SUM_PRODUCT_REPORTER}": get_product_at_sites},
-            agent_reporters = self.get_agent_reporters()
-        )
+        self.datacollector = ColumnarDataCollector(self, 
+                                                   collection_period=collection_period,
+                                                   collection_steps=collection_steps,
+                                                   collected_agents=collected_agents)
+        self.update_neighbour_averages()
         self.running = True
         self.datacollector.collect(self)
 
+        # Early stopping, see has_converged
+        self.convergence_tolerance = convergence_tolerance
+        self.convergence_window = convergence_window
+        self.share_history = deque(maxlen=convergence_window + 1)
+        self.stop_step = None
+        
+        # Time taken to build the model, in seconds
+        self.construction_time = time.perf_counter() - construction_start
+        if VERBOSE:
+            print(f"Model constructed in {self.construction_time:.3f} seconds")
+
 
 
     def step(self):
         self.schedule.step()
         self.datacollector.collect(self)
+        if self.convergence_tolerance is not None and self.has_converged():
+            self.running = False
+            self.stop_step = self.schedule.steps
+
+    def has_converged(self):
+        ''' Record the share of all deposited product that is at each location, for each product 
+            type, and return True if the shares have moved by less than convergence_tolerance 
+            (as a total variation distance) since convergence_window steps ago.
+            Returns False until product has been deposited for the whole window.'''
+        deposited = self.get_deposited_product()
+        total = deposited.sum()
+        self.share_history.append(deposited / total if total > 0 else None)
+        if len(self.share_history) <= self.convergence_window or self.share_history[0] is None:
+            return False
+        change = 0.5 * np.abs(self.share_history[-1] - self.share_history[0]).sum()
+        return change < self.convergence_tolerance
         
     
+    ###############################
+    # Checkpoints
+
+    def get_checkpoint(self):
+        ''' Return the complete state of the model between steps: the arguments it was built with,
+            the agents' vectors, location deposits, offers, step count, random number generator
+            states, and the data collected so far.'''
+        return {'version': CHECKPOINT_VERSION,
+                'init_params': dict(self.init_params),
+                'running': self.running,
+                'schedule': self.schedule.get_state(),
+                'random': {'model': self.random.getstate(),
+                           'streams': {name: stream.getstate() for name, stream in self.random_streams.items()}},
+                'datacollector': self.datacollector.get_state(),
+                'offer_book': self.offer_book.get_state(),
+                'location_membership': self.location_membership.get_state(),
+                'share_history': list(self.share_history),
+                'stop_step': self.stop_step}
+
+    def save_checkpoint(self, filename):
+        ''' Save the checkpoint of the model (see get_checkpoint) to filename.'''
+        folder = os.path.dirname(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        dump_pickle_atomically(self.get_checkpoint(), filename)
+
+    def restore_checkpoint(self, checkpoint, restore_random=True, restore_data=True):
+        ''' Set the state of this model to the checkpoint, which must come from a model with 
+            the same agents and networks. If `restore_random` is False, the random number 
+            generators are not restored. If `restore_data` is False, the collected data is not
+            restored, and the checkpoint's step is collected as the first step instead.'''
+        self.running = checkpoint['running']
+        self.offer_book.set_state(checkpoint['offer_book'])
+        self.location_membership.set_state(checkpoint['location_membership'])
+        self.share_history.extend(checkpoint['share_history'])
+        self.stop_step = checkpoint['stop_step']
+        self.schedule.set_state(checkpoint['schedule'], restore_random)
+        if restore_random:
+            self.random.setstate(checkpoint['random']['model'])
+            for name, stream_state in checkpoint['random']['streams'].items():
+                self.random_streams[name].setstate(stream_state)
+        self.update_neighbour_averages()
+        if restore_data:
+            self.datacollector.set_state(checkpoint['datacollector'])
+        else:
+            self.datacollector = ColumnarDataCollector(self, **{name: self.init_params[name] for name in COLLECTION_PARAMS})
+            self.datacollector.collect(self)
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint, **changes):
+        ''' Return a new model in the state of the checkpoint. To fork a variant from a shared 
+            burn-in, pass new values for any of FORKABLE_PARAMS. With a new seed, the random
+            number streams start from that seed instead of the checkpoint's state. If the collection
+            params change, data is collected from the checkpoint's step onwards.'''
+        not_forkable = set(changes) - set(FORKABLE_PARAMS)
+        if not_forkable:
+            raise ValueError(f"A model forked from a checkpoint cannot change {sorted(not_forkable)}")
+        params = {**checkpoint['init_params'], **changes}
+        model = cls(**params)
+        same = lambda name: params[name] == checkpoint['init_params'][name]
+        model.restore_checkpoint(checkpoint, 
+                                 restore_random=same('seed'),
+                                 restore_data=all(same(name) for name in COLLECTION_PARAMS))
+        if not all(same(name) for name in changes):
+            # A forked variant is a new run, so it does not keep the burn-in's early stop
+            model.running = True
+            model.stop_step = None
+        return model
+
     ###############################
     # Helper functions
 
-    def update_edges(self, start, old_end, new_end, color):
-        ''' Update the given edges in the graph, ie remove the (start, old_end) edge
-            and add the (start, new_end) edge. '''
-        self.G.remove_edge(start, old_end)
-        self.G.add_edge(start, new_end, color=color)
+    def get_interlayer_edges(self):
+        ''' Return a list of (merchant id, location id) edges from each merchant to its current location.
+            These are built when asked for, as moves only update self.location_membership.'''
+        location_ids = self.location_membership.location_index + self.num_merchants
+        return list(zip(range(self.num_merchants), location_ids.tolist()))
+
+    def get_graph_with_interlayer_edges(self):
+        ''' Return a copy of the combined graph G with an edge from each merchant to its 
+            current location, for visualisations and exports.'''
+        graph = self.G.copy()
+        graph.add_edges_from(self.get_interlayer_edges(), color=INTERLAYER_COLOR, type='interlayer')
+        return graph
+
+    def get_deposited_product(self):
+        ''' Returns a (locations x products) array of the product deposited at each location, 
+            with locations in schedule order.'''
+        if self.step_engine == ARRAY_ENGINE:
+            return self.schedule.deposited_product
+        return np.array([l.deposited_product for l in self.schedule.locations], dtype=np.int64)
 
     def get_agent_by_id(self, agent_id):
         ''' Returns the agent with the given agent_id'''
-        return self.schedule.agents[agent_id]
+        return self.get_agent(agent_id)
+    
+    def get_spatial_distance(self, source_location_id, target_location_id):
+        ''' Return the shortest path length between two location ids, using the
+            precomputed distance table. Disconnected pairs have a distance of inf.'''
+        return self.spatial_distances[source_location_id - self.num_merchants,
+                                      target_location_id - self.num_merchants]
+    
+    def invalidate_known_traders(self):
+        ''' Must be called after any change to self.social_network. Rebuilds the social
+            adjacency matrix, and makes every merchant rebuild its list of known traders
+            at the start of its next step.'''
+        self.social_adjacency = self.create_social_adjacency()
+        self.social_degree = np.asarray(self.social_adjacency.sum(axis=1)).ravel()
+        self.social_network_version += 1
+
+    def update_neighbour_averages(self):
+        ''' Compute the average supply and demand of every merchant's known traders
+            from the merchants' current vectors. This is done once per phase, and used
+            by every merchant's get_average_supply and get_average_demand.'''
+        merchants = self.schedule.merchants
+        own_product = np.array([sum(a.product) for a in merchants])
+        supply = own_product + np.array([sum(a.stock) for a in merchants])
+        demand = np.array([sum(a.demand) for a in merchants])
+        self.average_supply, self.average_demand = self.calc_neighbour_averages(own_product, supply, demand)
+
+    def calc_neighbour_averages(self, own_product, supply, demand):
+        ''' Return arrays of the average supply (including the merchant's own product)
+            and average demand of each merchant's known traders, given arrays of the
+            total product, supply and demand of every merchant.'''
+        avg_supply = (self.social_adjacency @ supply + own_product) / (self.social_degree + 1)
+        avg_demand = np.divide(self.social_adjacency @ demand, self.social_degree,
+                               out=np.zeros(self.num_merchants), where=self.social_degree > 0)
+        return avg_supply, avg_demand
     
     def get_agent(self, id):
-        '''Return the agent associated with this id'''
-        agents_list = self.grid.get_cell_list_contents([id])
-        return agents_list[0] if agents_list else None
+        '''Return the agent associated with this id, using the lookup tables
+           filled in by init_all_agents'''
+        if 0 <= id < self.num_merchants:
+            return self.merchant_agents[id]
+        return self.get_location_agent(id)
+
+    def get_location_agent(self, location_id):
+        '''Return the location agent with this location (grid) id'''
+        index = location_id - self.num_merchants
+        if 0 <= index < len(self.location_agents):
+            return self.location_agents[index]
+        return None
     
     
     
     ### NETWORKS
     def create_new_social_net(self):
+        ''' Generate a new social network from social_network_seed.'''
         n = self.num_merchants
+        if self.social_network_type not in SOCIAL_NETWORK_GENERATOR_PARAMS:
+            raise NotImplementedError(f"The social network type {self.social_network_type} has not been implemented")
+        params = SOCIAL_NETWORK_GENERATOR_PARAMS[self.social_network_type]
         if self.social_network_type == COMPLETE_GRAPH:
             g = nx.complete_graph(n)
         elif self.social_network_type == BA_GRAPH:
-            g = nx.barabasi_albert_graph(n=n, m=5)
+            g = nx.barabasi_albert_graph(n=n, seed=self.social_network_seed, **params)
         elif self.social_network_type == WATTS_GRAPH:
-            g = nx.watts_strogatz_graph(n, k=5, p=0.5)
-        else:
-            raise NotImplementedError(f"The social network type {self.social_network_type} has not been implemented")
+            g = nx.watts_strogatz_graph(n, seed=self.social_network_seed, **params)
         return g
     
+    def create_social_adjacency(self):
+        ''' Return the social network as a CSR adjacency matrix, where row i has a 1 
+            in the column of each known trader of merchant i.'''
+        edges = np.fromiter((node for edge in self.social_network.edges() for node in edge), 
+                            dtype=np.int64).reshape(-1, 2)
+        rows = np.concatenate((edges[:, 0], edges[:, 1]))
+        cols = np.concatenate((edges[:, 1], edges[:, 0]))
+        adjacency = csr_array((np.ones(len(rows)), (rows, cols)), 
+                              shape=(self.num_merchants, self.num_merchants))
+        adjacency.sort_indices()
+        return adjacency
+
+    def get_social_network_filename(self):
+        ''' Return the cache file for the social network. The filename contains a hash of 
+        everything the generator uses, so that any change gives a different file.'''
+        key = repr((self.social_network_type, 
+                    self.num_merchants, 
+                    sorted(SOCIAL_NETWORK_GENERATOR_PARAMS.get(self.social_network_type, {}).items()),
+                    self.social_network_seed))
+        key_hash = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return f'social_networks/{self.social_network_type}_{self.num_merchants}_{key_hash}.npy'
+
+    def create_social_network_edges(self):
+        ''' Generate a new social network and return its edges as an (edges x 2) array.'''
+        g = self.create_new_social_net()
+        return np.array(list(g.edges()), dtype=np.int32).reshape(-1, 2)
+
     def create_social_network(self, load_social_net=True):
-        ''' Create a social network, or load it from a file'''
-        # Attempt to open from file, if file exists:
-        filename = f'social_networks/{self.spatial_network_type}_{self.social_network_type}_{self.num_merchants}.pickle'
+        ''' Create a social network, or load it from a file. The file only stores the
+        edge array, and is created once (by one process) and read-only after that.'''
         if load_social_net == True:
-            try:
-                g = pickle.load(open(filename, 'rb'))
-                return g
-            except:
-                return self.create_new_social_net()
+            edges = read_or_create_file(self.get_social_network_filename(),
+                                        read=lambda filename: np.load(filename, mmap_mode='r'),
+                                        create=self.create_social_network_edges,
+                                        write=np.save)
         else:
-            return self.create_new_social_net()
+            edges = self.create_social_network_edges()
+        # The graph is always built from the edge array, so that neighbour order
+        # is the same whether the network was just generated or loaded.
+        g = nx.Graph()
+        g.add_nodes_from(range(self.num_merchants))
+        g.add_edges_from(edges.tolist())
+        return g
         
+    def create_combined_network(self):
+        ''' Return one graph with the nodes of both layers, used by the grid. Merchant
+        nodes keep their ids (0 to num_merchants - 1), and the i-th spatial node becomes 
+        node num_merchants + i, which is that location's grid id.
+        Only the spatial edges are added, with a type of 'spatial'. The social edges stay in 
+        self.social_network, so that they are not copied for every model, and the interlayer
+        edges are added by get_graph_with_interlayer_edges.'''
+        graph = nx.Graph()
+        graph.add_nodes_from(self.social_network.nodes(data=True))
+        location_ids = {node: self.num_merchants + i for i, node in enumerate(self.spatial_network)}
+        graph.add_nodes_from((location_ids[node], data) for node, data in self.spatial_network.nodes(data=True))
+        graph.add_edges_from((location_ids[u], location_ids[v], {**data, 'type': 'spatial'}) 
+                             for u, v, data in self.spatial_network.edges(data=True))
+        return graph
+
     def create_spatial_network_from_num_locations(self):
         ''' Return a graph created with num_locations number of nodes.
         This is just for testing and to demonstrate how the model works.'''
@@ -165,9 +530,10 @@ class MerchantModel(mesa.Model):
         graph.add_edges_from(edges_list, color=LOCATION_COLOR,weight=5)
         return graph
 
-    def create_spatial_network(self):
-        ''' Create the spatial network from the appropriate CSV files'''
-        graph = nx.Graph()
+    def compile_spatial_network(self):
+        ''' Read the spatial network from the appropriate CSV files, and return a dictionary of 
+        everything needed to build it: the nodes in order with their latin names, the weighted 
+        edges as (node index, node index, cost), the total cost of all edges, and the lists of all latin and modern names.'''
         spatial_dir = get_spatial_dir(self.spatial_network_type)  
         
         if self.spatial_network_type == ORBIS:
@@ -180,23 +546,91 @@ class MerchantModel(mesa.Model):
             raise NotImplementedError("Spatial network type not supported")
         
         total_cost = 0
+        nodes = {}
         for bunch in edgebunches:
             u, v, cost = bunch
             total_cost += cost
             # print(u,v)
-            if u not in graph:
-                graph.add_node(u, m_name=u, l_name=modern_to_latin[u])
-            if v not in graph:
-                graph.add_node(v, m_name=v, l_name=modern_to_latin[v])
+            if u not in nodes:
+                nodes[u] = modern_to_latin[u]
+            if v not in nodes:
+                nodes[v] = modern_to_latin[v]
+        # Edges refer to nodes by index, so that names which do not compare equal to 
+        # themselves (nan) are still the same node after the dictionary is unpickled
+        node_index = {node: i for i, node in enumerate(nodes)}
+        return {'nodes': list(nodes.keys()),
+                'latin_names': list(nodes.values()),
+                'edges': [(node_index[u], node_index[v], cost) for u, v, cost in edgebunches],
+                'total_cost': total_cost,
+                # Do not rely on these lists for order! Only for content (ie sets) or length.
+                'all_latin': list(modern_to_latin.values()),
+                'all_modern': list(modern_to_latin.keys())}
+
+    def load_compiled_spatial_network(self, load_compiled=True):
+        ''' Return the compiled spatial network (see compile_spatial_network), loading it from a file 
+        if the file was compiled from the current source files. Otherwise compile it and save it.
+        The hash of the source files is also stored in self.spatial_source_hash.'''
+        filename = f'spatial_networks/{self.spatial_network_type}_COMPILED.pickle'
+        self.spatial_source_hash = f'{COMPILED_SPATIAL_NETWORK_VERSION}-' + hash_files(get_spatial_source_files(self.spatial_network_type))
+        if load_compiled and os.path.isfile(filename):
+            data = pickle.load(open(filename, 'rb'))
+            if data['source_hash'] == self.spatial_source_hash:
+                return data
+        data = self.compile_spatial_network()
+        data['source_hash'] = self.spatial_source_hash
+        if not os.path.exists(filename.split('/')[0]):
+            os.makedirs(filename.split('/')[0])
+        dump_pickle_atomically(data, filename)
+        return data
+
+    def create_spatial_network(self):
+        ''' Create the spatial network from the compiled version of the appropriate CSV files'''
+        graph = nx.Graph()
+        data = self.load_compiled_spatial_network()
+        nodes = data['nodes']
+        graph.add_nodes_from((node, {'m_name': node, 'l_name': l_name}) 
+                             for node, l_name in zip(nodes, data['latin_names']))
         # Do not rely on these lists for order! Only for content (ie sets) or length.
-        self.all_latin = list(modern_to_latin.values())
-        self.all_modern = list(modern_to_latin.keys())
-        graph.add_weighted_edges_from(edgebunches)
+        # A nan name is replaced by the nan node, as it was the same object before pickling.
+        nan_nodes = [node for node in nodes if node != node]
+        self.all_latin = data['all_latin']
+        self.all_modern = [nan_nodes[0] if name != name and nan_nodes else name for name in data['all_modern']]
+        graph.add_weighted_edges_from((nodes[u], nodes[v], cost) for u, v, cost in data['edges'])
         
         # add a model attribute that has the total cost of the spatial network
-        self.total_spatial_cost = total_cost
+        self.total_spatial_cost = data['total_cost']
         return graph
     
+    def create_new_spatial_distance_table(self):
+        ''' Return a numpy array of all-pairs shortest path lengths in the spatial network.
+        Row/column i is the i-th node of the spatial network, which is the location
+        with location id num_merchants + i. Pairs with no path have a distance of inf.'''
+        nodes = list(self.spatial_network)
+        node_to_index = {node: i for i, node in enumerate(nodes)}
+        distances = np.full((len(nodes), len(nodes)), np.inf)
+        for source, lengths in nx.all_pairs_dijkstra_path_length(self.spatial_network, weight='weight'):
+            for target, length in lengths.items():
+                distances[node_to_index[source], node_to_index[target]] = length
+        return distances
+
+    def create_spatial_distance_table(self, load_distances=True):
+        ''' Create the all-pairs distance table for the spatial network, or load it from a file.
+        The file stores the hash of the spatial network's source files and the node order, 
+        so a stale table is recomputed rather than used.'''
+        filename = f'spatial_networks/{self.spatial_network_type}_DISTANCES.pickle'
+        nodes = list(self.spatial_network)
+        if load_distances and os.path.isfile(filename):
+            data = pickle.load(open(filename, 'rb'))
+            # Compare as strings, since nan names do not compare equal to themselves
+            if (data.get('source_hash') == self.spatial_source_hash 
+                and [str(n) for n in data['nodes']] == [str(n) for n in nodes]):
+                return data['distances']
+        distances = self.create_new_spatial_distance_table()
+        if not os.path.exists(filename.split('/')[0]):
+            os.makedirs(filename.split('/')[0])
+        dump_pickle_atomically({'source_hash': self.spatial_source_hash, 'nodes': nodes, 'distances': distances}, filename)
+        return distances
+
     def normalize_costs(self, cost_dict, cost_list):
         '''Normalize the costs in a cost dictionary, where the the first layer has
         location1, second has location2 to cost. Cost_list has all costs.
@@ -213,76 +647,43 @@ class MerchantModel(mesa.Model):
     ### AGENTS
     
     def init_all_agents(self):
-        '''Initialize merchant agents, which returns a dictionary of location id to ids of merchants at the location.
-        Then initialize the location agents using that dictionary.'''
-        loc_to_merchants = self.init_merchant_agents()
-        self.init_location_agents(loc_to_merchants)
+        '''Initialize merchant agents, then record which merchants are at each location
+        in self.location_membership, and initialize the location agents.'''
+        self.init_merchant_agents()
+        self.location_membership = LocationMembership([a.location_id - self.num_merchants for a in self.merchant_agents],
+                                                      min(self.num_locations, len(self.all_modern)))
+        self.init_location_agents()
 
     def init_merchant_agents(self):
         ''' Create and place all merchant agents, choosing random location ids. 
             The first ones created will be profit maximizing, then generalists, then specialists.
-            Also add interlayer edges between merchants and locations.
-            Return a dictionary of location id to merchant agent id at the location for use in initializing locations.'''
-        filename_graph = f'social_networks/{self.spatial_network_type}_{self.social_network_type}_{self.num_merchants}.pickle'
-        filename_data = f'social_networks/{self.spatial_network_type}_{self.social_network_type}_{self.num_merchants}_AGENT_INFO.pickle'
-        if os.path.isfile(filename_data):
-            # If the file exists, then read info from it
-            data = pickle.load(open(filename_data, 'rb'))
-            location_ids = data['location_ids']
-            for agent_id in range(self.num_merchants):
-                location_id = location_ids[agent_id]
-                agent = self.create_correct_type_of_merchant(agent_id, location_id)
-                self.schedule.add(agent)
-                # assuming self.G was already properly loaded during the network init step
-                self.grid.place_agent(agent, list(self.G)[agent_id])
-            self.interlayer_edges = data['interlayer_edges']
-            loc_to_merchants = data['loc_to_merchants']
-            
-            nx.set_node_attributes(self.social_network,
-                                   data['node_attr'], 
-                                   )
+            Return a dictionary of location id to merchant agent id at the location.
+            Placement is deterministic, so this is not cached to a file.'''
+        loc_to_merchants = defaultdict(list)
+        location_id = self.num_merchants
+        node_attr = {} 
+        for agent_id in range(self.num_merchants):
+            location_id = self.decide_location_id(location_id, loc_to_merchants)
+            loc_to_merchants[location_id] += [agent_id]
+
+            # To go from a merchant agent... need to go from location_id to the location agent...?
+            # To get the location agent, need to index at location_id - self.num_merchants
+            l_name, m_name = self.get_location_name(location_id)
+            node_attr[agent_id] = {'label': f'{m_name},\nagent {agent_id}',
+                                   'title': f'{agent_id}',
+                                   'group': f'{location_id}',
+                                   'm_name': m_name,
+                                   'l_name': l_name} # for updating nodes in graph
+
+            agent = self.create_correct_type_of_merchant(agent_id, location_id)
+
+            self.schedule.add(agent)
+            self.merchant_agents[agent_id] = agent
+            self.grid.place_agent(agent, agent_id)
+
+        nx.set_node_attributes(self.social_network,
+                               node_attr)
 
-        else:
-            # Otherwise, create the info and save to file.
-            loc_to_merchants = defaultdict(list)
-            location_id = self.num_merchants
-            location_ids = []
-            node_attr = {} 
-            for agent_id in range(self.num_merchants):
-                location_id = self.decide_location_id(location_id, loc_to_merchants)
-                location_ids.append(location_id)
-                loc_to_merchants[location_id] += [agent_id]
-                
-                # To go from a merchant agent... need to go from location_id to the location agent...?
-                # To get the location agent, need to index at location_id - self.num_merchants
-                l_name, m_name = self.get_location_name(location_id)
-                node_attr[agent_id] = {'label': f'{m_name},\nagent {agent_id}',
-                                       'title': f'{agent_id}',
-                                       'group': f'{location_id}',
-                                       'm_name': m_name,
-                                       'l_name': l_name} # for updating nodes in graph
-                
-                agent = self.create_correct_type_of_merchant(agent_id, location_id)
-                
-                self.schedule.add(agent)
-                self.grid.place_agent(agent, list(self.G)[agent_id])
-                self.interlayer_edges.append((agent_id, location_id))
-            
-            nx.set_node_attributes(self.social_network,
-                                   node_attr)
-
-            ## Save to file
-            data = {
-                    'interlayer_edges': self.interlayer_edges,
-                    'loc_to_merchants': loc_to_merchants,
-                    'node_attr': node_attr,
-                    'location_ids': location_ids,
-                    }
-            if not os.path.exists(filename_data.split('/')[0]):
-                os.makedirs(filename_data.split('/')[0]) 
-            pickle.dump(data, open(filename_data, 'wb'))
-        
-        pickle.dump(self.social_network, open(f'{filename_graph}', 'wb'))
         return loc_to_merchants
 
     def decide_location_id(self, start_loc, loc_to_merchants):
@@ -326,10 +727,10 @@ class MerchantModel(mesa.Model):
         l_name = node_data['l_name']
         return l_name, modern_name
     
-    def init_location_agents(self, loc_to_merchants):
+    def init_location_agents(self):
         ''' Create all location agents. First, specify which IDs should be producers.
             Then create the agent and add it appropriately to the schedule and grid. 
-            Use the loc_to_merchants dictionary of locations to a list of merchants at the location.
+            The merchants at each location are kept in self.location_membership.
             
             Make sure that there is only ONE location agent created per location!'''
         
@@ -359,9 +760,9 @@ class MerchantModel(mesa.Model):
                         neighbours[key] = None
 
             location_agent = LocationAgent(grid_id, stable_id, self, producer_type, l_name, m_name, neighbours)
-            location_agent.merchants = loc_to_merchants[grid_id]
             self.schedule.add(location_agent)
-            self.grid.place_agent(location_agent, list(self.G)[grid_id])
+            self.location_agents.append(location_agent)
+            self.grid.place_agent(location_agent, grid_id)
         nx.set_node_attributes(self.spatial_network,
                                 node_attr)
     
@@ -370,11 +771,8 @@ class MerchantModel(mesa.Model):
         if producer_criteria == NODE_DEGREE:
             producer_mnames = ['London', 'York', 'Winchester']
         elif producer_criteria == RANDOM:
-            # select 3 names from random from self.all_modern
-            producer_mnames = []
-            producer_mnames.append(random.choice(self.all_modern))
-            producer_mnames.append(random.choice(list(set(self.all_modern) - set(producer_mnames))))
-            producer_mnames.append(random.choice(list(set(self.all_modern) - set(producer_mnames))))
+            # select 3 different names at random from self.all_modern, in a fixed order so the choice only depends on the seed
+            producer_mnames = self.random_streams[PLACEMENT_STREAM].sample(list(dict.fromkeys(self.all_modern)), 3)
         producer_types = {producer_mnames[0]: ProducerType.PRODUCT_A, 
                           producer_mnames[1]: ProducerType.PRODUCT_B, 
                           producer_mnames[2]: ProducerType.PRODUCT_C
@@ -388,41 +786,3 @@ class MerchantModel(mesa.Model):
             return self.producer_types[m_name]
         else:
             return ProducerType.NO_PRODUCT
-        
-    ### REPORTERS
-        
-    def get_agent_reporters(self):
-        ''' Returns a dictionary of agent reporters for every product type currently in use'''
-        reporters = {}
-        reporters[f"agent_category"] = lambda a: get_agent_category(a)
-        reporters[f"agent_type"] = lambda a: get_agent_type(a)
-        reporters[f"agent_location"] = lambda a: get_agent_location(a)
-        reporters[f"agent_stable_id"] = lambda a: get_agent_stable_id(a)
-        reporters[f"latin_name"] = lambda a: get_agent_latin_name(a)
-        reporters[f"modern_name"] = lambda a: get_agent_modern_name(a)
-        
-        for prod in Product:
-            prod_type = prod.value
-            if prod_type == 0:
-                reporters[f"{prod.name} Product"] = lambda a: get_agent_product(0, a)
-                reporters[f"{prod.name} Stock"] = lambda a: get_agent_stock(0, a)
-                reporters[f"{prod.name} Demand"] = lambda a: get_agent_demand(0, a)
-            elif prod_type == 1:
-                reporters[f"{prod.name} Product"] = lambda a: get_agent_product(1, a)
-                reporters[f"{prod.name} Stock"] = lambda a: get_agent_stock(1, a)
-                reporters[f"{prod.name} Demand"] = lambda a: get_agent_demand(1, a)
-            elif prod_type == 2:
-                reporters[f"{prod.name} Product"] = lambda a: get_agent_product(2, a)
-                reporters[f"{prod.name} Stock"] = lambda a: get_agent_stock(2, a)
-                reporters[f"{prod.name} Demand"] = lambda a: get_agent_demand(2, a)
-            elif prod_type == 3:
-                reporters[f"{prod.name} Product"] = lambda a: get_agent_product(3, a)
-                reporters[f"{prod.name} Stock"] = lambda a: get_agent_stock(3, a)
-                reporters[f"{prod.name} Demand"] = lambda a: get_agent_demand(3, a)
-            else:
-                raise NotImplementedError("Need to add a reporter for an additional product type")
-        
-        reporters[f"num_trades"] = lambda a: get_agent_num_trades(a)
-        reporters[f"node_degree"] = lambda a: get_node_degree(a)
-        
-        return reporters
@@ -1,4 +1,5 @@
-from ABM.model import LocationAgent, ProfitAgent, ProducerType
+from ABM.agents import LocationAgent, ProfitAgent
+from ABM.constants import ProducerType
 #########################
 ## Reporters
 ## 
@@ -17,18 +18,16 @@ def compute_avg_supply_demand_ratio(model):
 def get_product_at_sites(model):
     ''' Return the amount of product at all sites'''
     total = 0
-    for node in model.schedule.agents:
-        if type(node) is LocationAgent:
-            total += sum(node.deposited_product)
+    for node in model.schedule.locations:
+        total += sum(node.deposited_product)
     return total
 
 def get_avg_num_known_traders(model):
     total = 0
     count = 0
-    for node in model.schedule.agents:
-        if type(node) is not LocationAgent:
-            total += len(node.known_traders)
-            count += 1
+    for node in model.schedule.merchants:
+        total += len(node.known_traders)
+        count += 1
     return total / count
         
 ## Agent reporters
@@ -1,22 +1,50 @@
 from experiments.imports import *
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of rows of a results csv to read at a time
+CHUNK_SIZE = 200_000
+
+def is_location_column(column):
+    '''Returns False for the merchant-only columns, which are always NA for locations.'''
+    return not (column.endswith(' Stock') or column.endswith(' Demand') or column == 'num_trades')
 ###################################################
 #########
 ### CREATE CSVs
 #########
 ###################################################   
 
+def read_location_final_timestep_rows(path, chunksize=CHUNK_SIZE):
+    '''Read the csv at `path` in chunks of `chunksize` rows, and return a dataframe of the 
+    LOCATION rows at the final timestep of each iteration, in the same order as in the file.
+    Only the final rows seen so far are kept, so memory does not grow with the file size.
+    Merchant-only columns are not parsed.'''
+    final_rows = {}
+    for chunk in pd.read_csv(path, usecols=is_location_column, chunksize=chunksize):
+        chunk = chunk[chunk['agent_category'] == 'location']
+        chunk = chunk[chunk['Step'] == chunk.groupby('iteration')['Step'].transform('max')]
+        for iteration, rows in chunk.groupby('iteration', sort=False):
+            step = rows['Step'].iat[0]
+            if iteration not in final_rows or step > final_rows[iteration][0]:
+                final_rows[iteration] = (step, [rows])
+            elif step == final_rows[iteration][0]:
+                final_rows[iteration][1].append(rows)
+    frames = [rows for _, iteration_rows in final_rows.values() for rows in iteration_rows]
+    if not frames:
+        # No location rows (eg only merchants were collected), so only the header is kept
+        return pd.read_csv(path, usecols=is_location_column, nrows=0)
+    return pd.concat(frames).sort_index()
+
 def create_location_final_timestep_csv(csv_results_path, subfolder, filename, averaging=False):
     '''Takes a csv file, which has information for every agent at every timestep.
-    Creates a new csv file with only the final timestep information for LOCATIONs.
+    Creates a new csv file with only the final timestep information for LOCATIONs,
+    for each iteration. The file is streamed, so it can be larger than memory.
     Writes the new csvs to the outputs/final_step/csv folder.
     Optionally (if averaging=True), averages the values for each location.
     '''
     path = f'{csv_results_path}/{subfolder}/{filename}'
     if subfolder == '':
         path = f'{csv_results_path}/{filename}'
-    df = pd.read_csv(path)
-    final_timestep_df = df[df['Step'] == df['Step'].max()]
-    locations_df = final_timestep_df[final_timestep_df['agent_category']=='location'].copy()
+    locations_df = read_location_final_timestep_rows(path)
     
     if averaging:
         locations_df = locations_df.groupby(['modern_name']).mean()
@@ -24,15 +52,17 @@ def create_location_final_timestep_csv(csv_results_path, subfolder, filename, av
     
     save_path = f'outputs/final_step/csvs/{subfolder}'
     if not os.path.exists(save_path):
-        os.makedirs(save_path)    
+        os.makedirs(save_path, exist_ok=True)    
     locations_df.to_csv(f'{save_path}/{filename}')
 
-def create_final_csvs_for_folder(folder_path, overwrite=True):
-    '''Calls the create_location_final_timestep_csv function for every file in folder. 
+def create_final_csvs_for_folder(folder_path, overwrite=True, number_processes=None):
+    '''Calls the create_location_final_timestep_csv function for every file in folder,
+       using a pool of `number_processes` processes (None uses all cores). 
        Gets csvs from the outputs/csv_results folder.
        >>> create_final_csvs_for_folder('outputs/csv_results/dist_mult')
     '''
     subfolder = folder_path.split('outputs/csv_results/')[-1]
+    filenames = []
     for filename in os.listdir(folder_path):
         should_make = True
         if overwrite is False:
@@ -41,8 +71,14 @@ def create_final_csvs_for_folder(folder_path, overwrite=True):
                 os.makedirs(save_path) 
             should_make = filename not in os.listdir(save_path)
         if filename.endswith('.csv') and should_make:
-            # with multi-level subpath, need to just take the whole thing after the 'outputs/csv_results'
-            create_location_final_timestep_csv('outputs/csv_results', subfolder, filename)
+            filenames.append(filename)
+    
+    with ProcessPoolExecutor(max_workers=number_processes) as executor:
+        # with multi-level subpath, need to just take the whole thing after the 'outputs/csv_results'
+        futures = [executor.submit(create_location_final_timestep_csv, 'outputs/csv_results', subfolder, filename)
+                   for filename in filenames]
+        for future in futures:
+            future.result()
 
 
 ##############
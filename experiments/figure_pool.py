@@ -0,0 +1,78 @@
+import time, os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import matplotlib
+import pandas as pd
+import experiments.helper_functions as helper_functions
+
+# Renders batches of figures on a pool of processes. Figures are grouped by the table
+# they are drawn from, and each group is rendered by one worker, which reads the table
+# once. Functions that read the table through helper_functions.read_source_csv get a
+# copy of the preloaded table, and a job can also be given the table as an argument.
+
+
+class FigureJob():
+    """One figure (or set of figures) to render.
+    - func: a module-level plotting function (so it can be sent to another process)
+    - kwargs (dict): passed to func
+    - source (string): path of the csv the figure is drawn from, loaded once per worker batch
+    - source_arg (string): if given, the loaded table is also passed to func as this keyword argument
+    """
+    def __init__(self, func, kwargs, source, source_arg=None):
+        self.func = func
+        self.kwargs = kwargs
+        self.source = source
+        self.source_arg = source_arg
+
+    def get_name(self):
+        args = ', '.join(f'{key}={value}' for key, value in self.kwargs.items()
+                         if key not in ['file', 'csv', 'all_anova_file', 'anova_filepath'])
+        return f'{self.func.__name__}({args})'
+
+
+def use_headless_backend():
+    '''Use the non-interactive Agg backend, so workers never open windows.'''
+    matplotlib.use('Agg', force=True)
+
+def render_source_jobs(source, jobs):
+    '''Load `source` once and render every job that uses it.
+    Returns a list of (job name, seconds) for each job, with the load time listed first.
+    If `source` does not exist, nothing is preloaded, so each job fails (or not) as it would on its own.'''
+    if not os.path.exists(source):
+        return [(f'{job.get_name()} (source not found)', render_job(job, None)) for job in jobs]
+    start = time.perf_counter()
+    df = pd.read_csv(source)
+    timings = [(f'load {source}', time.perf_counter() - start)]
+    helper_functions.preloaded_sources[source] = df
+    try:
+        for job in jobs:
+            timings.append((job.get_name(), render_job(job, df)))
+    finally:
+        del helper_functions.preloaded_sources[source]
+    return timings
+
+def render_job(job, df):
+    '''Render one job, passing it the loaded table `df` if it takes one. Returns the seconds taken.'''
+    start = time.perf_counter()
+    kwargs = dict(job.kwargs)
+    if job.source_arg is not None and df is not None:
+        kwargs[job.source_arg] = df
+    job.func(**kwargs)
+    return time.perf_counter() - start
+
+def render_figures(jobs, number_processes=None):
+    '''Render all `jobs` (a list of FigureJobs) with the Agg backend on a pool of
+    `number_processes` processes (None uses all cores), one task per source table.
+    Prints the time taken for each figure, and returns a list of (job name, seconds).'''
+    jobs_by_source = defaultdict(list)
+    for job in jobs:
+        jobs_by_source[job.source].append(job)
+    timings = []
+    with ProcessPoolExecutor(max_workers=number_processes, initializer=use_headless_backend) as executor:
+        futures = [executor.submit(render_source_jobs, source, source_jobs)
+                   for source, source_jobs in jobs_by_source.items()]
+        for future in as_completed(futures):
+            for name, seconds in future.result():
+                print(f'{seconds:6.2f}s  {name}')
+                timings.append((name, seconds))
+    return timings
@@ -2,7 +2,8 @@ import sys
 sys.path.append("..")
 
 from experiments.imports import *
-from experiments.helper_functions import normalize, save_fig, pretty_name, set_xticks
+from experiments.helper_functions import normalize, save_fig, pretty_name, set_xticks, read_source_csv
+from experiments.figure_pool import FigureJob, render_figures
 
 # FILE INFO: Create figures that use ANOVA csv files.
 # - boxplots
@@ -14,7 +15,7 @@ from experiments.helper_functions import normalize, save_fig, pretty_name, set_x
 def create_boxplot_core_code(x, x_label, y, y_label, hue, legend_title, fig_title,
                              num_merchants, all_anova_file, df=None):
     if df is None:
-        df = pd.read_csv(all_anova_file)
+        df = read_source_csv(all_anova_file)
         df['product_ratios'] = df['product_amount'] / df['total_product_in_system']
         df = normalize(df, 'product_ratios')
         
@@ -40,17 +41,24 @@ def create_boxplot_core_code(x, x_label, y, y_label, hue, legend_title, fig_titl
     
    
 ## Code to create specific boxplots
-def create_boxplot_product_by_num_merchants(network, expr_var):
+def get_network_anova_file(network, main_folder_name='dist_mult'):
+    '''Return the path of the anova csv of one network (ie 'itin_ba') in an experiment folder.'''
+    return f'outputs/final_step/csvs/{main_folder_name}/{network}/anova_{network}.csv'
+
+def create_boxplot_product_by_num_merchants(network, expr_var, anova_filepath=None):
     '''Create a boxplot with the number of merchants on the X axis, and
     proportion of total product on the Y axis. The hue is the distance multiplier.
     `network` is a string, like 'itin_ba'.
-    - expr_var is the experiment variable (dist_mult or decison_strat)
+    - expr_var is the experiment variable (dist_mult or decison_strat), used for the save folder
+    - anova_filepath is the anova csv to plot. By default the network's dist_mult anova csv,
+    as the hue is the distance multiplier.
     '''
     ## VARIABLES
     x, x_label = 'num_merchants', 'Number of Merchants'
     y, y_label = 'product_ratios', 'Product Ratios'
     hue, legend_title = 'dist_mult', 'Distance Multiplier'
-    anova_filepath = f'outputs/final_step/csvs/dist_mult/{network}/anova_{network}.csv'
+    if anova_filepath is None:
+        anova_filepath = get_network_anova_file(network)
     
     fig_title = f'Product A in London ({pretty_name(network)})'
     create_boxplot_core_code(x, x_label, y, y_label, hue, legend_title, fig_title, 
@@ -114,27 +122,36 @@ def boxplot_prod_by_type_and_distmult(all_anova_file, num_merchants, network, ex
 
 ##### HEATMAPS
 
-def create_four_heatmaps(path, x_var, x_label, agg_type):
-    '''Runner function to create heatmaps for the 4 networks
-        create_four_heatmaps(path = 'outputs/final_step/csvs/decision_strats', 
-                         x_var='decision_strat',
-                         x_label='Decision Strategy')
-    '''
+def get_heatmap_range(x_var, agg_type):
+    '''Return the (vmin, vmax) colour scale used for heatmaps of `x_var` with `agg_type`'''
     if 'dist' in x_var:
         if 'var' in agg_type:
-            vmin, vmax = 0, 0.055
-        else:
-            vmin, vmax = 0.1, 0.95
+            return 0, 0.055
+        return 0.1, 0.95
     elif 'var' in agg_type:
-        vmin, vmax = 0, 0.15
-    else:
-        vmin, vmax = 0.09, 0.39
-    
+        return 0, 0.15
+    return 0.09, 0.39
+
+def get_heatmap_jobs(path, x_var, x_label, agg_type):
+    '''Return the figure jobs for the heatmaps of the 4 networks (see create_four_heatmaps).'''
+    vmin, vmax = get_heatmap_range(x_var, agg_type)
+    jobs = []
     for folder in os.listdir(path):
         if folder != '.DS_Store' and '.csv' not in folder and 'no_rewiring' not in folder:
             csv = f'{path}/{folder}/anova_{folder}.csv'
-            print(folder)
-            heatmap_prod_for_num_merchants_by_x(csv, 'A', x_var, x_label, vmin=vmin, vmax=vmax, agg_type=agg_type)
+            jobs.append(FigureJob(heatmap_prod_for_num_merchants_by_x, 
+                                  dict(csv=csv, prod_type='A', x_var=x_var, x_label=x_label, 
+                                       vmin=vmin, vmax=vmax, agg_type=agg_type),
+                                  source=csv))
+    return jobs
+
+def create_four_heatmaps(path, x_var, x_label, agg_type, number_processes=None):
+    '''Runner function to create heatmaps for the 4 networks, in parallel
+        create_four_heatmaps(path = 'outputs/final_step/csvs/decision_strats', 
+                         x_var='decision_strat',
+                         x_label='Decision Strategy')
+    '''
+    return render_figures(get_heatmap_jobs(path, x_var, x_label, agg_type), number_processes)
   
 def heatmap_prod_for_num_merchants_by_x(csv, prod_type='A',x_var='dist_mult', x_label='Distance Multiplier',
                                         vmin=0, vmax=1, agg_type='mean'):
@@ -160,7 +177,7 @@ def heatmap_prod_for_num_merchants_by_x(csv, prod_type='A',x_var='dist_mult', x_
         spatial = '??'
         social = '??'
     # Recall that the anova files have a product_amount, which by default is ProductA
-    df = pd.read_csv(csv)
+    df = read_source_csv(csv)
     # Add ratio column
     df['product_ratios'] = df['product_amount'] / df['total_product_in_system']
     # Normalize ratio column
@@ -185,7 +202,7 @@ def manipulate_all_anova_file(all_anova_file, num_merchants=200, network='itin_b
     Modify the csv file so that it is ready to be used in a boxplot with the types of product on 
     the x-axis, and differences in distance multipliers for the hue, and normalized product ratio for y-axis.
     Return a df.'''
-    df = pd.read_csv(all_anova_file)
+    df = read_source_csv(all_anova_file)
     df['product_ratios'] = df['product_amount'] / df['total_product_in_system']
     df['product_ratios_b'] = df['product_amount_b'] / df['total_product_in_system']
     df['product_ratios_c'] = df['product_amount_c'] / df['total_product_in_system']
@@ -206,19 +223,30 @@ def manipulate_all_anova_file(all_anova_file, num_merchants=200, network='itin_b
 def call_for_all_networks(func, num_merchants=200, 
                           all_anova_file='outputs/final_step/csvs/dist_mult/anova_all_networks.csv',
                           just_network=False,
-                          expr_var='dist_mult'):
-    '''pass in a function to call for all four spatial-social networks'''
+                          expr_var='dist_mult',
+                          number_processes=None):
+    '''pass in a function to call for all four spatial-social networks.
+    The figures are rendered in parallel.'''
+    jobs = []
     for network in ['itin_ba', 'itin_ws', 'orbis_ba', 'orbis_ws', None]:
         if just_network:
             if network is not None:
-                func(network, expr_var=expr_var)
+                # These functions read the per-network dist_mult anova files
+                source = get_network_anova_file(network)
+                jobs.append(FigureJob(func, dict(network=network, expr_var=expr_var, anova_filepath=source), 
+                                      source=source))
         else:
-            func(all_anova_file, num_merchants=num_merchants, network=network, expr_var=expr_var)
+            jobs.append(FigureJob(func, dict(all_anova_file=all_anova_file, num_merchants=num_merchants, 
+                                             network=network, expr_var=expr_var),
+                                  source=all_anova_file))
+    return render_figures(jobs, number_processes)
 
-def call_for_all_num_merchants(func, all_anova_file, expr_var):
-    '''call the function for all number of merchants'''
-    for n in [50,200,400]:
-        func(all_anova_file=all_anova_file, num_merchants=n, expr_var=expr_var)
+def call_for_all_num_merchants(func, all_anova_file, expr_var, number_processes=None):
+    '''call the function for all number of merchants. The figures are rendered in parallel.'''
+    jobs = [FigureJob(func, dict(all_anova_file=all_anova_file, num_merchants=n, expr_var=expr_var),
+                      source=all_anova_file)
+            for n in [50,200,400]]
+    return render_figures(jobs, number_processes)
         
 if __name__ == '__main__':
     all_anova_file = 'outputs/final_step/csvs/dist_mult/anova_all_networks.csv'
@@ -3,6 +3,16 @@ from experiments.imports import *
 
 # A file for formatting helper functions.
 
+## Reading source tables
+# Tables already loaded by the figure pool (see figure_pool.py), by file path
+preloaded_sources = {}
+
+def read_source_csv(path):
+    '''Return the table in the csv at `path`. If the figure pool has already loaded
+    it, return a copy of that instead of reading the file again.'''
+    if path in preloaded_sources:
+        return preloaded_sources[path].copy()
+    return pd.read_csv(path)
 
 
 ### From figures_anova_boxplot.py
@@ -20,8 +30,8 @@ def save_fig(filename, output_folder, subfolder):
     '''Creates a new folder if necessary and saves a figure with the given filename.'''
     if subfolder:
         output_folder = f'{output_folder}/{subfolder}'
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    # Several report nodes can save into the same new folder at the same time
+    os.makedirs(output_folder, exist_ok=True)
     plt.savefig(f'{output_folder}/{filename}.png') 
 
 def get_full_filepath(fn):
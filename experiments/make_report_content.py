@@ -1,9 +1,10 @@
 import sys, os
 sys.path.append("..")
-from create_final_timestep_csvs import create_final_csvs_for_folder
-from run_final_timestep_charts import run_all_charts_for_folder
-from run_anova import combine_anova_files, create_anova_files_for_folder, make_four_interaction_plots
-from figures_anova_boxplot import call_for_all_networks, call_for_all_num_merchants, create_boxplot_product_by_decision_strats, create_boxplot_product_by_dist, create_boxplot_product_by_num_merchants, boxplot_prod_by_type_and_distmult, create_four_heatmaps
+from create_final_timestep_csvs import create_final_csvs_for_folder, create_location_final_timestep_csv
+from run_final_timestep_charts import run_all_charts_for_folder, run_all_functions_for_file
+from run_anova import update_anova_all_networks, make_four_interaction_plots, make_interaction_plot
+from figures_anova_boxplot import call_for_all_networks, call_for_all_num_merchants, create_boxplot_product_by_decision_strats, create_boxplot_product_by_dist, create_boxplot_product_by_num_merchants, get_network_anova_file, boxplot_prod_by_type_and_distmult, create_four_heatmaps, get_heatmap_range, heatmap_prod_for_num_merchants_by_x
+from report_dag import ReportNode, run_report_dag
 from experiments.helper_functions import pretty_name
 
 ######
@@ -25,8 +26,7 @@ def final_csvs(main_folder_name, overwrite=True):
 
 # Run Anova
 def anova_create(main_folder_name, final_step_path):
-    create_anova_files_for_folder(final_step_path)
-    combine_anova_files(main_folder_name)
+    update_anova_all_networks(main_folder_name)
 
 def anova_stats(main_folder_name, all_anova_file):
     if main_folder_name == 'decision_strats':
@@ -71,9 +71,102 @@ def heatmaps(main_folder_name, final_step_path):
                                 x_label=label,
                                 agg_type=agg_type)
     
+#### Report graph
+def get_expr_var(main_folder_name):
+    '''Return the experiment variable for an experiment folder, ie decision_strat for decision_strats'''
+    return 'decision_strat' if main_folder_name == 'decision_strats' else main_folder_name
+
+def get_experiment_nodes(main_folder_name):
+    '''Return the report nodes for one experiment (see report_dag.py). Each results csv gets
+    its own final csv and charts nodes, so a new sweep cell only adds a few small nodes,
+    and the ANOVA table only reads the new final csv.'''
+    results_path = f'outputs/csv_results/{main_folder_name}'
+    final_step_path = f'outputs/final_step/csvs/{main_folder_name}/'
+    all_anova_file = f'{final_step_path}anova_all_networks.csv'
+    expr_var = get_expr_var(main_folder_name)
+    nodes = []
+    
+    networks = [folder for folder in sorted(os.listdir(results_path)) if folder != '.DS_Store']
+    
+    # One final csv, and one set of charts, for each results csv
+    final_csv_nodes, final_csv_files = [], []
+    for folder in networks:
+        chart_id = 0
+        for filename in sorted(os.listdir(f'{results_path}/{folder}')):
+            if not filename.endswith('.csv'):
+                continue
+            results_file = f'{results_path}/{folder}/{filename}'
+            name = f'final_csv/{main_folder_name}/{folder}/{filename}'
+            nodes.append(ReportNode(name, create_location_final_timestep_csv, 
+                                    args=('outputs/csv_results', f'{main_folder_name}/{folder}', filename),
+                                    inputs=[results_file]))
+            final_csv_nodes.append(name)
+            final_csv_files.append(f'{final_step_path}{folder}/{filename}')
+            if '400.csv' in filename:
+                nodes.append(ReportNode(f'charts/{main_folder_name}/{folder}/{filename}', run_all_functions_for_file,
+                                        args=(f'{results_path}/{folder}', filename, chart_id),
+                                        inputs=[results_file]))
+                chart_id += 1
+    
+    anova_node = f'anova/{main_folder_name}'
+    nodes.append(ReportNode(anova_node, update_anova_all_networks, args=(main_folder_name,),
+                            inputs=final_csv_files, deps=final_csv_nodes))
+    
+    # Interaction plots, boxplots and heatmaps all read the anova files
+    def add_anova_node(name, func, kwargs, inputs=[all_anova_file]):
+        nodes.append(ReportNode(f'{name}/{main_folder_name}', func, kwargs=kwargs, 
+                                inputs=inputs, deps=[anova_node]))
+    
+    for value_var, letter in zip([[], 'product_ratios_a', 'product_ratios_b', 'product_ratios_c'], ['ALL', 'a', 'b', 'c']):
+        add_anova_node(f'interaction/{letter}', make_interaction_plot, 
+                       dict(file=all_anova_file, var2=expr_var, value_vars=value_var, prod_letter=letter, expr_var=expr_var))
+    for n in NUM_MERCHANTS:
+        if 'dist' in main_folder_name:
+            for network in NETWORKS + [None]:
+                add_anova_node(f'boxplot_type_distmult/{n}/{network}', boxplot_prod_by_type_and_distmult,
+                               dict(all_anova_file=all_anova_file, num_merchants=n, network=network, expr_var=main_folder_name))
+            add_anova_node(f'boxplot_dist/{n}', create_boxplot_product_by_dist,
+                           dict(all_anova_file=all_anova_file, num_merchants=n, expr_var=main_folder_name))
+        else:
+            add_anova_node(f'boxplot_decision_strats/{n}', create_boxplot_product_by_decision_strats,
+                           dict(all_anova_file=all_anova_file, num_merchants=n, expr_var=main_folder_name))
+    for network in [network for network in NETWORKS if network in networks]:
+        network_anova_file = f'{final_step_path}{network}/anova_{network}.csv'
+        # These boxplots always read the dist_mult anova files
+        dist_mult_anova_file = get_network_anova_file(network)
+        add_anova_node(f'boxplot_num_merchants/{network}', create_boxplot_product_by_num_merchants,
+                       dict(network=network, expr_var=main_folder_name, anova_filepath=dist_mult_anova_file),
+                       inputs=[dist_mult_anova_file])
+        for agg_type in ['mean', 'var', 'median']:
+            vmin, vmax = get_heatmap_range(expr_var, agg_type)
+            add_anova_node(f'heatmap/{network}/{agg_type}', heatmap_prod_for_num_merchants_by_x,
+                           dict(csv=network_anova_file, prod_type='A', x_var=expr_var, x_label=pretty_name(expr_var),
+                                vmin=vmin, vmax=vmax, agg_type=agg_type),
+                           inputs=[network_anova_file])
+    return nodes
+
+def get_report_nodes(experiments=EXPERIMENTS):
+    '''Return the report nodes for all experiments that have results.'''
+    nodes = []
+    for main_folder_name in experiments:
+        if os.path.exists(f'outputs/csv_results/{main_folder_name}'):
+            nodes += get_experiment_nodes(main_folder_name)
+    names = {node.name for node in nodes}
+    for node in nodes:
+        # The num_merchants boxplots read the dist_mult anova files, so wait for them when they are being made
+        if node.name.startswith('boxplot_num_merchants/') and 'anova/dist_mult' in names:
+            node.deps.append('anova/dist_mult')
+    return nodes
+
 #### Running everything
-def make_all_report_content():
-    '''Run this function to generate EVERYTHING, assuming that the initial csvs have been created.'''
+def make_all_report_content(number_processes=None, force=False):
+    '''Run this function to generate EVERYTHING, assuming that the initial csvs have been created.
+    Only the parts of the report whose inputs have changed since the last run are made again,
+    unless `force` is True. Independent parts are made in parallel on `number_processes` processes.'''
+    return run_report_dag(get_report_nodes(), number_processes=number_processes, force=force)
+
+def make_all_report_content_in_order():
+    '''Generate EVERYTHING from scratch, in order, in this process.'''
     for main_folder_name in EXPERIMENTS:
         final_step_path = f'outputs/final_step/csvs/{main_folder_name}/'
         all_anova_file = f'outputs/final_step/csvs/{main_folder_name}/anova_all_networks.csv'
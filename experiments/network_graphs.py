@@ -1,8 +1,10 @@
 import sys
 sys.path.append("..")
 from experiments.imports import *
-import csv, pickle
+import csv
 from experiments.helper_functions import save_fig, get_figure_title_and_shortfn_from_filename
+from ABM.model import MerchantModel
+from ABM.constants import get_num_locations, NODE_DEGREE, ITINERARIES, ORBIS, BA_GRAPH, WATTS_GRAPH
 import networkx as nx
 
 #### STYLING OPTIONS
@@ -21,6 +23,16 @@ LABEL_OPTIONS = {
 }
 
 
+def load_social_network(network_filename):
+    '''Return the social network for a name in the format [spatial]_[social]_[num_merchants],
+    with node labels from the merchants' starting locations. The network itself comes
+    from the model's social network cache.'''
+    network_parts = split_on_underscore(network_filename)
+    spatial, num_merchants = network_parts['spatial'], int(network_parts['num_merchants'])
+    model = MerchantModel(num_merchants, get_num_locations(spatial), spatial, 
+                          network_parts['social'], NODE_DEGREE)
+    return model.social_network
+
 ### PART 0: Social network full visualization
 def visualize_full_network(G, network_file):
     '''Visualize a given nx graph'''
@@ -56,7 +68,7 @@ def full_visualize_all_networks():
                  'orbis_ba_50',
                  'orbis_watts-strogatz_50']
     for fn in filenames:
-        G= pickle.load(open(f'social_networks/{fn}.pickle', 'rb')) 
+        G = load_social_network(fn)
         visualize_full_network(G, fn)
         graph_edges_using_subgraph(G, 'London', fn)
 
@@ -108,7 +120,6 @@ def get_avg(centrality_dict):
 def split_on_underscore(filename):
     '''Take a filename in the format [spatial]_[social]_[num_merchants] 
     and return a dictionary with keys-> values'''
-    filename = filename[:-(len('.pickle'))]
     split = filename.split("_")
     return {'spatial': split[0], 'social': split[1], 'num_merchants': split[2]}
 
@@ -131,11 +142,10 @@ def create_csv_with_network_metrics(num_merchants):
     with open(f'outputs/networks/network_metrics_{num_merchants}.csv', 'w') as f:
         w = csv.writer(f)
         should_write_header = True
-        for network_filename in os.listdir('social_networks'):
-            if 'AGENT_INFO' in network_filename or not f'{num_merchants}' in network_filename:
-                pass
-            else:
-               G= pickle.load(open(f'social_networks/{network_filename}', 'rb')) 
+        for spatial in [ITINERARIES, ORBIS]:
+            for social in [BA_GRAPH, WATTS_GRAPH]:
+               network_filename = f'{spatial}_{social}_{num_merchants}'
+               G = load_social_network(network_filename)
                metrics = get_metrics(G, network_filename)
                if should_write_header:
                    w.writerow(metrics.keys())
@@ -165,7 +175,7 @@ def visual_centrality(centrality='degree', filename='outputs/networks/network_me
 if __name__ == '__main__':
     ### VISUALS
     network_filename = 'orbis_watts-strogatz_50'
-    G= pickle.load(open(f'social_networks/{network_filename}.pickle', 'rb'))
+    G = load_social_network(network_filename)
 
     # visualize_full_network(G, network_filename)
     # full_visualize_all_networks()
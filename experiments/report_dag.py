@@ -0,0 +1,142 @@
+import hashlib, json, os, time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# A small build system for report content. Each node of the graph is a function call that
+# makes some artefacts (csvs or figures) from some input files, and can depend on other
+# nodes (usually because it reads their outputs). A node is only run again when the
+# fingerprint of its inputs, function and arguments has changed since its last successful
+# run, or when one of its dependencies was run again. Nodes whose dependencies are done
+# are run in parallel on a pool of processes.
+
+MANIFEST_PATH = 'outputs/report_manifest.json'
+
+
+class ReportNode():
+    """One step of the report.
+    - name (string): unique name, used in `deps` of other nodes and in the manifest
+    - func: a module-level function (so it can be sent to another process)
+    - args (tuple) and kwargs (dict): passed to func
+    - inputs (list of strings): files or folders that func reads. Folders include all of their files.
+    - deps (list of strings): names of nodes that must run first
+    """
+    def __init__(self, name, func, args=(), kwargs=None, inputs=(), deps=()):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.inputs = list(inputs)
+        self.deps = list(deps)
+
+    def get_fingerprint(self):
+        '''Return a hash of the function, its arguments, and the size and modification
+        time of every input file.'''
+        digest = hashlib.sha256()
+        digest.update(f'{self.func.__module__}.{self.func.__name__}'.encode())
+        digest.update(repr((self.args, sorted(self.kwargs.items()))).encode())
+        for path in sorted(get_input_files(self.inputs)):
+            stat = os.stat(path)
+            digest.update(f'{path}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        return digest.hexdigest()
+
+
+def get_input_files(inputs):
+    '''Return every file in `inputs`, which contains files and folders.
+    Missing inputs are skipped, as they may not have been made yet.'''
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, filenames in os.walk(path):
+                files += [os.path.join(root, filename) for filename in filenames
+                          if filename != '.DS_Store']
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+def save_manifest(manifest, manifest_path):
+    '''Write the manifest to a temporary file and move it into place, so that an
+    interrupted build never leaves a broken manifest.'''
+    folder = os.path.dirname(manifest_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+def run_node(node):
+    '''Run one node and return its name and how long it took, in seconds.'''
+    start = time.perf_counter()
+    node.func(*node.args, **node.kwargs)
+    return node.name, time.perf_counter() - start
+
+def check_graph(nodes):
+    '''Raise a ValueError if a node name is repeated, a dependency does not exist,
+    or there is a cycle.'''
+    names = [node.name for node in nodes]
+    if len(set(names)) != len(names):
+        raise ValueError("Report nodes must have unique names")
+    by_name = {node.name: node for node in nodes}
+    for node in nodes:
+        for dep in node.deps:
+            if dep not in by_name:
+                raise ValueError(f"Report node {node.name} depends on unknown node {dep}")
+    visited, in_progress = set(), set()
+    def visit(name):
+        if name in in_progress:
+            raise ValueError(f"Report nodes have a cycle through {name}")
+        if name not in visited:
+            in_progress.add(name)
+            for dep in by_name[name].deps:
+                visit(dep)
+            in_progress.remove(name)
+            visited.add(name)
+    for name in names:
+        visit(name)
+
+def run_report_dag(nodes, number_processes=None, manifest_path=MANIFEST_PATH, force=False):
+    '''Run every stale node in `nodes` (all of them if `force` is True), in dependency
+    order, using a pool of `number_processes` processes (None uses all cores).
+    The manifest is saved after each node finishes, so an interrupted build keeps its progress.
+    Returns a dictionary of the name of each node that was run to its run time in seconds.'''
+    check_graph(nodes)
+    manifest = load_manifest(manifest_path)
+    remaining = {node.name: node for node in nodes}
+    rebuilt = set()
+    finished = set()
+    timings = {}
+    with ProcessPoolExecutor(max_workers=number_processes) as executor:
+        running = {}
+        while remaining or running:
+            # Start (or skip) every node whose dependencies have finished
+            for name, node in list(remaining.items()):
+                if not all(dep in finished for dep in node.deps):
+                    continue
+                del remaining[name]
+                # Computed now, since inputs can be outputs of dependencies
+                fingerprint = node.get_fingerprint()
+                is_stale = (force or manifest.get(name) != fingerprint
+                            or any(dep in rebuilt for dep in node.deps))
+                if is_stale:
+                    running[executor.submit(run_node, node)] = (node, fingerprint)
+                else:
+                    finished.add(name)
+            if not running:
+                # Only skipped nodes this round, so check for newly ready nodes
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node, fingerprint = running.pop(future)
+                name, seconds = future.result()
+                print(f'{name}: {seconds:.1f}s')
+                timings[name] = seconds
+                manifest[name] = fingerprint
+                save_manifest(manifest, manifest_path)
+                rebuilt.add(name)
+                finished.add(name)
+    print(f'Report: ran {len(timings)} of {len(nodes)} nodes')
+    return timings
@@ -0,0 +1,99 @@
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    # The results store is optional, results are always written to csv as well.
+    pa = None
+
+# A partitioned Parquet dataset of all model results. Each run's parameters are stored
+# as typed columns, and the dataset is split into folders by the partition columns,
+# so that reading one part of the parameter grid only opens the files it needs.
+# Each cell of the parameter grid is written to its own file, named after its results csv
+# (which includes every parameter that identifies the cell), and stored in the `cell` column.
+# Writing a cell again only replaces that cell's file.
+# >>> df = read_results(RESULTS_STORE_PATH, spatial_network_type='orbis', num_merchants=[50, 200])
+
+# Relative to the repository root, like the csv_results folder in run_model.py
+RESULTS_STORE_PATH = 'experiments/outputs/results_store'
+
+STRATEGY_COLUMN = 'strategy'
+CELL_COLUMN = 'cell'
+PARTITION_COLUMNS = ['spatial_network_type', 'social_network_type', 'num_merchants',
+                     'distance_multiplier', STRATEGY_COLUMN]
+
+# Agent reporter columns that are "NA" for locations, stored as nullable integers
+MERCHANT_ONLY_SUFFIXES = (' Stock', ' Demand')
+MERCHANT_ONLY_COLUMNS = ['num_trades']
+
+
+def has_results_store():
+    '''Returns True if pyarrow is installed, which is needed to read or write the results store.'''
+    return pa is not None
+
+def get_partitioning():
+    '''Return the hive partitioning of the results store, with the type of each partition column.'''
+    return ds.partitioning(pa.schema([('spatial_network_type', pa.string()),
+                                      ('social_network_type', pa.string()),
+                                      ('num_merchants', pa.int64()),
+                                      ('distance_multiplier', pa.float64()),
+                                      (STRATEGY_COLUMN, pa.string())]),
+                           flavor='hive')
+
+def convert_to_store_types(df, proportions, cell):
+    '''Return a copy of a results dataframe (as written by do_model_runs) with a
+    `strategy` column, formatted as in the csv filenames, ie "(1, 0, 0)", a `cell` column,
+    and with the merchant-only columns as nullable integers instead of a mix of ints and "NA".'''
+    df = df.copy()
+    df[STRATEGY_COLUMN] = str(proportions)
+    df[CELL_COLUMN] = cell
+    for column in df.columns:
+        if column.endswith(MERCHANT_ONLY_SUFFIXES) or column in MERCHANT_ONLY_COLUMNS:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype('Int64')
+    for column in ['agent_location', 'latin_name', 'modern_name']:
+        df[column] = df[column].astype('string')
+    # Given as ints or floats depending on the strategy, eg (1, 0, 0) or (0.5, 0.5, 0)
+    for column in ['distance_multiplier', 'proportion_profit', 'proportion_generalist', 'proportion_specialist']:
+        df[column] = df[column].astype(float)
+    return df
+
+def write_results(df, proportions, cell, store_path=RESULTS_STORE_PATH):
+    '''Write the results of one cell of the parameter grid to the results store, in a file 
+    named after `cell` (the cell's results csv filename, without the extension). 
+    Results already stored for the same cell are replaced, and other cells are kept.'''
+    df = convert_to_store_types(df, proportions, cell)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(table, store_path, format='parquet',
+                     partitioning=get_partitioning(),
+                     basename_template=f'{cell}-{{i}}.parquet',
+                     existing_data_behavior='overwrite_or_ignore')
+
+def get_filter_value(column, value):
+    '''Return `value` as stored in `column`. Strategies are stored as strings, so a
+    strategy given as a tuple, ie (1, 0, 0), is formatted as write_results does.'''
+    if column == STRATEGY_COLUMN and isinstance(value, tuple):
+        return str(value)
+    return value
+
+def get_filter_expression(filters):
+    '''Return a pyarrow expression that is True for rows where each column in `filters`
+    equals the given value, or is one of the values if a list or set is given.
+    Tuples are single values, as strategies are given as tuples.'''
+    expression = None
+    for column, value in filters.items():
+        if isinstance(value, (list, set)):
+            condition = ds.field(column).isin([get_filter_value(column, v) for v in value])
+        else:
+            condition = ds.field(column) == get_filter_value(column, value)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def read_results(store_path=RESULTS_STORE_PATH, columns=None, **filters):
+    '''Return a dataframe of the stored results that match `filters`, only reading the
+    given `columns` (None reads all of them). Filters on partition columns skip whole
+    folders, and filters on other columns are applied while reading.
+    >>> read_results(spatial_network_type='itineraries', distance_multiplier=[0, 0.5],
+                     agent_category='location', columns=['iteration', 'Step', 'modern_name'])'''
+    dataset = ds.dataset(store_path, format='parquet', partitioning=get_partitioning())
+    table = dataset.to_table(columns=columns, filter=get_filter_expression(filters))
+    return table.to_pandas()
@@ -1,14 +1,17 @@
 from collections import namedtuple
 import sys
 sys.path.append("..")
-from experiments.create_final_timestep_csvs import get_total_product_at_final_timestep
 from ABM.constants import *
 import os, pandas as pd
 import matplotlib.pyplot as plt, seaborn as sns
 import statsmodels.api as sm
 from statsmodels.formula.api import ols
 from statsmodels.graphics.factorplots import interaction_plot
-from experiments.helper_functions import save_fig, pretty_name
+from experiments.helper_functions import save_fig, pretty_name, read_source_csv, convert_to_folder_name
+from experiments.results_store import RESULTS_STORE_PATH, CELL_COLUMN, STRATEGY_COLUMN, read_results
+
+# Subfolders of an experiment's final_step folder, one for each network combination
+ANOVA_NETWORKS = ['itin_ba', 'itin_ws', 'orbis_ba', 'orbis_ws']
 
 def convert_one_file_to_ANOVA_df(filepath, location, product_type):
     '''Given the filepath to a final_step csv, return a dataframe with the summary
@@ -16,15 +19,17 @@ def convert_one_file_to_ANOVA_df(filepath, location, product_type):
     >>>convert_one_file_to_ANOVA_df(
         f'outputs/final_step/csvs/{csv_results_filename}.csv', 
         'London',
-        'PRODUCT_A Product')'''    
-    final_timestep_df = pd.read_csv(filepath, encoding='latin-1')
+        'PRODUCT_A Product')
+    The file is read once, for both the location's products and the total in the system.'''    
+    product_columns = list(dict.fromkeys([product_type, 'PRODUCT_B Product', 'PRODUCT_C Product']))
+    final_timestep_df = pd.read_csv(filepath, encoding='latin-1', usecols=['agent_location'] + product_columns)
     filename = filepath.split('/')[-1].split('.csv')[0]
     split_name = filename.split('_')
     num_merchants = split_name[3]
     dist_mult = split_name[4]
     decision_strat = split_name[5]
     location_df = final_timestep_df[final_timestep_df['agent_location'] == location].copy()
-    total = get_total_product_at_final_timestep(filepath, product_type)
+    total = final_timestep_df[product_type].sum()
     
     return pd.DataFrame({'num_merchants': num_merchants,
                          'dist_mult': dist_mult,
@@ -105,7 +110,7 @@ def anova_over_all_networks(all_anova_path, var2='dist_mult', value_vars=[], spa
 
 def get_melted_anova_df(all_anova_path, var2, value_vars, spatial=None):
     var1, result = 'network', 'product_ratios'
-    df = pd.read_csv(all_anova_path) 
+    df = read_source_csv(all_anova_path) 
     if spatial is not None:
         df = df.loc[(df['network']==f'{spatial}_ba') | (df['network'] == f'{spatial}_ws'), :]
         
@@ -178,15 +183,97 @@ def make_four_interaction_plots(anova_all_file, expr_var='dist_mult'):
     for value_var, letter in zip(value_vars, prod_letters):
         make_interaction_plot(anova_all_file, var2=expr_var, value_vars=value_var, prod_letter=letter, expr_var=expr_var)
  
+def get_file_fingerprint(filepath):
+    '''Return a string that changes whenever the file is rewritten.'''
+    stat = os.stat(filepath)
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+def update_anova_all_networks(main_folder_name, location='London', product_type='PRODUCT_A Product'):
+    '''Create or update the anova_all_networks csv for an experiment folder, with the same
+    rows as create_anova_files_for_folder followed by combine_anova_files, and rewrite the
+    per-network anova csvs from it. Each row records
+    the final_step csv it came from, and a fingerprint of that file, `location` and `product_type`.
+    Only files that are new or have changed since the last update are read, and all files are
+    read again if `location` or `product_type` changed. Rows for deleted files are dropped.
+    Returns the combined dataframe.'''
+    folder_path = f'outputs/final_step/csvs/{main_folder_name}/'
+    all_anova_path = folder_path + 'anova_all_networks.csv'
+    existing = None
+    if os.path.exists(all_anova_path):
+        existing = pd.read_csv(all_anova_path, index_col=0, 
+                               dtype={'num_merchants': str, 'dist_mult': str, 'decision_strat': str})
+        if 'source_file' not in existing.columns:
+            # Made before rows recorded their source, so rebuild everything
+            existing = None
+    
+    frames = []
+    num_read = 0
+    for subfolder in ANOVA_NETWORKS:
+        if not os.path.exists(folder_path + subfolder):
+            continue
+        for filename in sorted(os.listdir(folder_path + subfolder)):
+            if not filename.endswith('.csv') or 'anova' in filename:
+                continue
+            source_file = f'{subfolder}/{filename}'
+            fingerprint = f'{get_file_fingerprint(folder_path + source_file)}-{location}-{product_type}'
+            if existing is not None:
+                rows = existing[existing['source_file'] == source_file]
+                if len(rows) > 0 and (rows['source_fingerprint'] == fingerprint).all():
+                    frames.append(rows)
+                    continue
+            anova_df = convert_one_file_to_ANOVA_df(folder_path + source_file, location, product_type)
+            anova_df['network'] = subfolder
+            anova_df['source_file'] = source_file
+            anova_df['source_fingerprint'] = fingerprint
+            frames.append(anova_df)
+            num_read += 1
+    result = pd.concat(frames)
+    result.to_csv(all_anova_path)
+    # Per-network files, as written by create_two_way_df, are read by the heatmaps and boxplots
+    for subfolder in ANOVA_NETWORKS:
+        network_df = result[result['network'] == subfolder]
+        if len(network_df) > 0:
+            network_df = network_df.drop(columns=['network', 'source_file', 'source_fingerprint'])
+            network_df.to_csv(f'{folder_path}{subfolder}/anova_{subfolder}.csv')
+    print(f'anova_all_networks: read {num_read} new or changed files, reused {len(frames) - num_read}')
+    return result
+
+def get_anova_df_from_store(store_path=RESULTS_STORE_PATH, location='London', product_type='PRODUCT_A Product', 
+                            **filters):
+    '''Return the rows of update_anova_all_networks (without the source columns) for the cells
+    in the results store that match `filters` (see read_results). The parameters come from the
+    store's typed columns instead of the filenames, and only the needed columns of location rows are read.
+    >>> get_anova_df_from_store(distance_multiplier=[0, 0.1, 0.5, 0.8, 1], strategy='(1, 0, 0)')'''
+    product_columns = list(dict.fromkeys([product_type, 'PRODUCT_B Product', 'PRODUCT_C Product']))
+    columns = [CELL_COLUMN, 'iteration', 'Step', 'agent_location', 'spatial_network_type', 'social_network_type',
+               'num_merchants', 'distance_multiplier', STRATEGY_COLUMN] + product_columns
+    df = read_results(store_path, columns=columns, agent_category='location', **filters)
+    df = df.sort_values([CELL_COLUMN, 'iteration'], kind='stable')
+    # As in the final_step csvs: the final step of each iteration, with the total over the whole cell
+    df = df[df['Step'] == df.groupby([CELL_COLUMN, 'iteration'])['Step'].transform('max')]
+    total = df.groupby(CELL_COLUMN)[product_type].transform('sum')
+    at_location = df['agent_location'] == location
+    df, total = df[at_location], total[at_location]
+    networks = [convert_to_folder_name(spatial, social) 
+                for spatial, social in zip(df['spatial_network_type'], df['social_network_type'])]
+    return pd.DataFrame({'num_merchants': df['num_merchants'].astype(str),
+                         # Formatted as in the filenames, ie 0 and 0.5
+                         'dist_mult': df['distance_multiplier'].map('{:g}'.format),
+                         'decision_strat': df[STRATEGY_COLUMN],
+                         'product_amount': df[product_type],
+                         'product_amount_b': df['PRODUCT_B Product'],
+                         'product_amount_c': df['PRODUCT_C Product'],
+                         'total_product_in_system': total,
+                         'network': networks}).reset_index(drop=True)
+
 def combine_anova_files(main_folder_name):
     '''Create a new csv that has a column "Network" which contains a string corresponding to the
     network combination that produced this result. Network combinations are IB, IW, OB, OW.
     `is_dist_mult` is a boolean determines which files to combine'''
     
     folder_path = f'outputs/final_step/csvs/{main_folder_name}/'
-    subfolders = ['itin_ba', 'itin_ws', 'orbis_ba', 'orbis_ws']
     frames = []
-    for subfolder in subfolders:
+    for subfolder in ANOVA_NETWORKS:
         full_path = folder_path + subfolder + '/anova_' + subfolder + '.csv'
         anova_df = pd.read_csv(full_path)
         short_name = 'itin_ws' if subfolder == 'itin_ws_0.5_rewire' else subfolder
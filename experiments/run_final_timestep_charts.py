@@ -1,5 +1,6 @@
 from experiments.imports import *
 from experiments.helper_functions import pretty_name, save_fig, create_figure_title
+from experiments.figure_pool import FigureJob, render_figures
 
 # This file has functions that create graphs related to the distributions at the
 # final timestep. It has the Mercury-style charts, and the total product over 
@@ -61,46 +62,77 @@ def run_function_over_folder(func, folderpath, exp='dist_mult'):
     this function runs that function over all csvs in the given folderpath, recursively.
     It creates folders to match the folder(s) it reads from.'''
     for root, dirs, files in os.walk(folderpath):
-        subfolder = root.split('outputs/csv_results/')[-1]
-        include_decision_strat = True if 'decision_strat' in subfolder else False
         id_num = 0
         for file in sorted(files):
             folder = f"{pretty_name(file.split('_')[0])}_{pretty_name(file.split('_')[1])}"
             dir =  f'outputs/final_step/{exp}/{folder.lower()}'
             
-            if not os.path.exists(dir):
-                os.makedirs(dir)  
+            os.makedirs(dir, exist_ok=True)
             new_file = f"TOTALS_{file.split('.csv')[0]}.png"
             if '400.csv' in file and new_file not in os.listdir(dir):
-                title = create_figure_title(file, include_decision_strat)
-                full_filepath = os.path.join(root, file)
-                
-                if func == 'mercury':
-                    mercury_style_charts(file=full_filepath, 
-                                        df=None, 
-                                        title=title, 
-                                        id_num=id_num, 
-                                        filename=f'{file.split("/")[-1].strip(".csv")}',
-                                        subfolder=subfolder)
-                elif func == 'final product':
-                    final_timestep_charts(file=full_filepath, 
-                                          df=None, 
-                                          title=title, 
-                                          id_num=id_num, 
-                                          filename=f'{file.split("/")[-1].strip(".csv")}',
-                                          subfolder=subfolder)
-                    
+                run_function_for_file(func, root, file, id_num)
                 id_num += 1
 
-def run_all_charts_for_folder(foldername='dist_mult'):
+def run_function_for_file(func, root, file, id_num=0, df=None):
+    '''Run the graphing function named `func` ("mercury" or "final product") for one 
+    results csv `file` in the folder `root`. `df` is the file's table, if already loaded.'''
+    subfolder = root.split('outputs/csv_results/')[-1]
+    include_decision_strat = True if 'decision_strat' in subfolder else False
+    title = create_figure_title(file, include_decision_strat)
+    full_filepath = os.path.join(root, file)
+    
+    if func == 'mercury':
+        mercury_style_charts(file=full_filepath, 
+                            df=df, 
+                            title=title, 
+                            id_num=id_num, 
+                            filename=f'{file.split("/")[-1].strip(".csv")}',
+                            subfolder=subfolder)
+    elif func == 'final product':
+        final_timestep_charts(file=full_filepath, 
+                              df=df, 
+                              title=title, 
+                              id_num=id_num, 
+                              filename=f'{file.split("/")[-1].strip(".csv")}',
+                              subfolder=subfolder)
+
+def run_all_functions_for_file(root, file, id_num=0):
+    '''Make the mercury and final product charts for one results csv, reading it once.'''
+    df = pd.read_csv(os.path.join(root, file))
+    run_function_for_file("mercury", root, file, id_num, df)
+    run_function_for_file("final product", root, file, id_num, df)
+
+def get_chart_jobs_for_folder(folderpath, exp='dist_mult'):
+    '''Return figure jobs for the mercury and final product charts of every csv that
+    run_function_over_folder would draw. Both charts of a csv share one load of the file.'''
+    jobs = []
+    for root, dirs, files in os.walk(folderpath):
+        id_num = 0
+        for file in sorted(files):
+            folder = f"{pretty_name(file.split('_')[0])}_{pretty_name(file.split('_')[1])}"
+            dir =  f'outputs/final_step/{exp}/{folder.lower()}'
+            
+            os.makedirs(dir, exist_ok=True)
+            new_file = f"TOTALS_{file.split('.csv')[0]}.png"
+            if '400.csv' in file and new_file not in os.listdir(dir):
+                for func in ["mercury", "final product"]:
+                    jobs.append(FigureJob(run_function_for_file, 
+                                          dict(func=func, root=root, file=file, id_num=id_num),
+                                          source=os.path.join(root, file), source_arg='df'))
+                id_num += 1
+    return jobs
+
+def run_all_charts_for_folder(foldername='dist_mult', number_processes=None):
+    '''Make the mercury and final product charts for every results csv of an experiment,
+    rendering them in parallel on `number_processes` processes (None uses all cores).'''
     path_to_data = f'outputs/csv_results/{foldername}/'
+    jobs = []
     for folder in os.listdir(path_to_data):
         if folder == '.DS_Store':
             continue
-        print('folder:' , folder)
         full_path = f'{path_to_data}/{folder}'
-        run_function_over_folder("mercury", full_path, exp=foldername)
-        run_function_over_folder("final product", full_path, exp=foldername)         
+        jobs += get_chart_jobs_for_folder(full_path, exp=foldername)
+    return render_figures(jobs, number_processes)
         
         
     
@@ -208,8 +240,7 @@ def final_timestep_agents(df: pd.DataFrame, title, filename):
     ax.set_title("Number of agents \n" + title)
     plt.tight_layout()
     output_folder = f'{output_path}/final_step'
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
     plt.savefig(f'{output_folder}/{filename}.png')
     # plt.show()
     plt.close()
@@ -1,14 +1,21 @@
 import sys, time, os
 sys.path.append("..")
 from ABM.constants import *
-from ABM.model import MerchantModel, mesa
+from ABM.model import MerchantModel, mesa, load_checkpoint
+from ABM.LocationStatistics import LocationStatistics
 import pandas as pd
+import numpy as np
 import time, os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm.auto import tqdm
 from experiments.helper_functions import convert_to_folder_name
+from experiments.results_store import RESULTS_STORE_PATH, has_results_store, write_results
 
 # This file is to automate running experiments
 
 ITERATIONS = 30   
+# Number of steps between checkpoints of a run, when checkpointing
+CHECKPOINT_PERIOD = 50
 spatial_networks = [
                     ITINERARIES, 
                     ORBIS
@@ -30,6 +37,162 @@ specialist_decision_strats = [(0,0,1),
                             (0, 0.5, 0.5), 
                             (0.5, 0, 0.5)]
 
+def get_collection_params(collection_period=COLLECTION_PERIOD, 
+                          collection_steps=COLLECTION_STEPS, 
+                          collected_agents=COLLECTED_AGENTS):
+    '''Return the dictionary of data collection parameters that differ from the defaults 
+    (collecting every step for all agents), so that default runs keep the same csv columns.'''
+    collection_params = {}
+    if collection_steps is not None:
+        collection_params["collection_steps"] = list(collection_steps)
+    elif collection_period != COLLECTION_PERIOD:
+        collection_params["collection_period"] = collection_period
+    if collected_agents != COLLECTED_AGENTS:
+        collection_params["collected_agents"] = collected_agents
+    return collection_params
+
+def get_stopping_params(convergence_tolerance=CONVERGENCE_TOLERANCE, 
+                        convergence_window=CONVERGENCE_WINDOW):
+    '''Return the dictionary of early stopping parameters (see MerchantModel.has_converged), 
+    which is empty when runs are not stopped early, so that default runs keep the same csv columns.'''
+    if convergence_tolerance is None:
+        return {}
+    return {"convergence_tolerance": convergence_tolerance, "convergence_window": convergence_window}
+
+def get_model_params(spatial, social, num_merchants, prod_criteria, distance_mult, proportions,
+                     collection_params={}, stopping_params={}):
+    '''Return the dictionary of MerchantModel parameters used for every run in a cell.'''
+    profit, generalist, specialist = proportions
+    params = {  "num_merchants":        num_merchants,
+                "num_locations":        get_num_locations(spatial),
+                "spatial_network_type": spatial,
+                "social_network_type" : social,
+                "producer_criteria"   : prod_criteria,
+                "distance_multiplier":  distance_mult,
+                "discard_fraction":     0.14,
+                "proportion_profit":    profit,
+                "proportion_generalist": generalist,
+                "proportion_specialist": specialist,
+                "no_trade_tolerance":  -1,
+                "location_trades": False,
+                **collection_params,
+                **stopping_params
+    }
+    return params
+
+def get_results_file_path(spatial, social, num_merchants, prod_criteria, distance_mult, proportions,
+                          num_iterations, max_steps, save_folder_start, collection_params={}, seed=None,
+                          burn_in=None, stopping_params={}):
+    '''Return a tuple of (output folder, csv filename without extension, full file path)
+    for the results of one cell. Non-default collection params, the seed, the
+    (steps, distance multiplier) of a shared burn-in and any early stopping rule are appended to the filename.'''
+    output_folder = f'{save_folder_start}/{convert_to_folder_name(spatial, social)}'
+    csv_results_filename = f'{spatial}_{social}_{prod_criteria}_{num_merchants}_{distance_mult}_{proportions}_{num_iterations}_{max_steps}'
+    if "collection_steps" in collection_params:
+        csv_results_filename += f'_steps{"-".join(str(s) for s in collection_params["collection_steps"])}'
+    if "collection_period" in collection_params:
+        csv_results_filename += f'_every{collection_params["collection_period"]}'
+    if "collected_agents" in collection_params:
+        csv_results_filename += f'_{collection_params["collected_agents"]}'
+    if seed is not None:
+        csv_results_filename += f'_seed{seed}'
+    if burn_in is not None:
+        csv_results_filename += f'_burnin{burn_in[0]}-{burn_in[1]}'
+    if "convergence_tolerance" in stopping_params:
+        csv_results_filename += f'_converge{stopping_params["convergence_tolerance"]}-{stopping_params["convergence_window"]}'
+    file_path = f'{output_folder}/{csv_results_filename}.csv'
+    return output_folder, csv_results_filename, file_path
+
+def get_run_seed(seed, iteration):
+    '''Return the model seed for one iteration of a cell with the given seed, or None
+    (a new seed for every run) if seed is None. The seed of each iteration only depends on
+    `seed` and `iteration`, so iterations give the same results however they are run.'''
+    if seed is None:
+        return None
+    return int(np.random.SeedSequence([seed, iteration]).generate_state(1)[0])
+
+def get_checkpoint_path(checkpoint_folder, csv_results_filename, iteration):
+    '''Return the path of the checkpoint for one iteration of a cell, or None if not checkpointing.'''
+    if checkpoint_folder is None:
+        return None
+    return f'{checkpoint_folder}/{csv_results_filename}_{iteration}.pickle'
+
+def remove_checkpoints(checkpoint_folder, csv_results_filename, num_iterations):
+    '''Remove the checkpoints of a cell once its results have been saved.'''
+    for iteration in range(num_iterations):
+        checkpoint_path = get_checkpoint_path(checkpoint_folder, csv_results_filename, iteration)
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+def resume_model(params, checkpoint_path, seed=None):
+    '''Return the model saved at `checkpoint_path`, after checking that it was
+    built with `params` (and `seed`, if given).'''
+    checkpoint = load_checkpoint(checkpoint_path)
+    expected = {**params, "seed": seed} if seed is not None else params
+    if any(checkpoint['init_params'][name] != value for name, value in expected.items()):
+        raise ValueError(f"The checkpoint {checkpoint_path} was saved by a run with different parameters")
+    return MerchantModel.from_checkpoint(checkpoint)
+
+def continue_model(model, max_steps, checkpoint_path=None, checkpoint_period=CHECKPOINT_PERIOD):
+    '''Step the model until it has run `max_steps` steps, saving a checkpoint to 
+    `checkpoint_path` (if given) every `checkpoint_period` steps.'''
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+        if checkpoint_path is not None and model.schedule.steps % checkpoint_period == 0:
+            model.save_checkpoint(checkpoint_path)
+    return model
+
+def run_model(params, max_steps, seed=None, checkpoint_path=None):
+    '''Run the model once with `params` for `max_steps` steps, and return the model.
+    If `checkpoint_path` is given, the run is saved there every CHECKPOINT_PERIOD steps,
+    and continues from the checkpoint if one is already there (ie it was stopped).'''
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        model = resume_model(params, checkpoint_path, seed)
+    else:
+        model = MerchantModel(**params, seed=seed)
+    return continue_model(model, max_steps, checkpoint_path)
+
+def run_iteration(params, run_id, iteration, max_steps, seed=None, checkpoint_path=None):
+    '''Run the model once with `params` for `max_steps` steps, and return a DataFrame 
+    of the collected steps with the same columns that mesa.batch_run would give.
+    If `seed` is given, the iteration's seed (see get_run_seed) is added as a seed column.
+    If runs can stop early, the step the run stopped at is added as a stop_step column.'''
+    run_seed = get_run_seed(seed, iteration)
+    model = run_model(params, max_steps, run_seed, checkpoint_path)
+    params = get_run_columns(model, params, run_seed)
+    return model.datacollector.get_batch_run_dataframe(run_id, iteration, params)
+
+def get_run_columns(model, params, run_seed):
+    '''Return the parameter columns to write for one finished run: `params`, and the run's
+    seed and stop step if they are used.'''
+    if run_seed is not None:
+        params = {**params, "seed": run_seed}
+    if params.get("convergence_tolerance") is not None:
+        params = {**params, "stop_step": model.schedule.steps, "converged": model.stop_step is not None}
+    return params
+
+def get_summary_file_path(file_path):
+    '''Return the path of the summary csv for the results csv at `file_path`.'''
+    return f'{file_path.split(".csv")[0]}_summary.csv'
+
+def run_summary_iterations(params, num_iterations, max_steps, seed=None, checkpoint_paths=None):
+    '''Run the model `num_iterations` times, only keeping running statistics of each 
+    location's final share of each product (see ABM/LocationStatistics.py).
+    `checkpoint_paths` gives the checkpoint path for each iteration, if checkpointing.
+    Returns the summary DataFrame.'''
+    if num_iterations < 1:
+        raise ValueError(f"A summary needs at least one iteration, not {num_iterations}")
+    # Only the final step of the locations is needed, so collect as little as possible
+    params = {**params, "collection_period": FINAL_STEP_ONLY, "collected_agents": COLLECT_LOCATIONS}
+    statistics = None
+    for iteration in tqdm(range(num_iterations)):
+        checkpoint_path = checkpoint_paths[iteration] if checkpoint_paths is not None else None
+        model = run_model(params, max_steps, get_run_seed(seed, iteration), checkpoint_path)
+        if statistics is None:
+            statistics = LocationStatistics.from_model(model)
+        statistics.add_model(model)
+    return statistics.get_summary_dataframe()
+
 def do_model_runs(spatial, 
                   social, 
                   num_merchants, 
@@ -38,56 +201,254 @@ def do_model_runs(spatial,
                   proportions,
                   id_num, num_iterations, max_steps=100, 
                   save_folder_start='experiments/outputs/csv_results/',
-                  replacing=False):
+                  replacing=False,
+                  collection_period=COLLECTION_PERIOD,
+                  collection_steps=COLLECTION_STEPS,
+                  collected_agents=COLLECTED_AGENTS,
+                  store_path=RESULTS_STORE_PATH,
+                  summary_only=False,
+                  seed=None,
+                  checkpoint_folder=None,
+                  convergence_tolerance=CONVERGENCE_TOLERANCE,
+                  convergence_window=CONVERGENCE_WINDOW):
     '''Do `num_iterations` runs of the model with these parameters. 
     - id_num is used to create the filename for the final png.
     - `save_folder_start` is something like 'outputs/csv_results/dist_mult/', 
     ie the full folder path that will contain a new folder (if not already 
     existing) with spatial_social, ie itin_ba
+    - `collection_period`, `collection_steps` and `collected_agents` choose which steps 
+    and agents are written (see ColumnarDataCollector). The final step is always written.
+    - results are also written to the partitioned results store at `store_path`
+    (see experiments/results_store.py) if pyarrow is installed. None skips the store.
+    - if `summary_only` is True, no per-agent rows are written. Instead, a table of the
+    mean, standard deviation and quantiles of each location's final share of each product,
+    across iterations, is written next to where the results csv would be, ending in _summary.csv
+    - if `seed` is given, each iteration is run with a seed derived from it (see get_run_seed),
+    so the results can be reproduced. Otherwise every run gets a new seed.
+    - if `checkpoint_folder` is given, each run saves a checkpoint there every CHECKPOINT_PERIOD
+    steps, so that a stopped cell continues where it stopped when run again. The checkpoints
+    are removed once the results are saved.
+    - if `convergence_tolerance` is given, each run stops before `max_steps` once the share of 
+    deposited product at each location changes by less than the tolerance over `convergence_window`
+    steps (see MerchantModel.has_converged). The stop_step and converged columns record where each run stopped.
     '''
     
     title = f"{spatial}, {social}, merchants: {num_merchants}, dist_mult: {distance_mult}, proportions: {proportions} \n \
               num iterations: {num_iterations}"
     
-    profit, generalist, specialist = proportions
-    params = {  "num_merchants":        num_merchants,
-                "num_locations":        get_num_locations(spatial),
-                "spatial_network_type": spatial,
-                "social_network_type" : social,
-                "producer_criteria"   : prod_criteria,
-                "distance_multiplier":  distance_mult,
-                "discard_fraction":     0.14,
-                "proportion_profit":    profit,
-                "proportion_generalist": generalist,
-                "proportion_specialist": specialist,
-                "no_trade_tolerance":  -1,
-                "location_trades": False
-    }
-    
-    output_folder = f'{save_folder_start}/{convert_to_folder_name(spatial, social)}'
-    csv_results_filename = f'{spatial}_{social}_{prod_criteria}_{num_merchants}_{distance_mult}_{proportions}_{num_iterations}_{max_steps}'
-    file_path = f'{output_folder}/{csv_results_filename}.csv'
+    collection_params = get_collection_params(collection_period, collection_steps, collected_agents)
+    stopping_params = get_stopping_params(convergence_tolerance, convergence_window)
+    params = get_model_params(spatial, social, num_merchants, prod_criteria, distance_mult, proportions,
+                              collection_params, stopping_params)
+    output_folder, csv_results_filename, file_path = get_results_file_path(
+        spatial, social, num_merchants, prod_criteria, distance_mult, proportions,
+        num_iterations, max_steps, save_folder_start, collection_params, seed, 
+        stopping_params=stopping_params)
     
+    if summary_only:
+        file_path = get_summary_file_path(file_path)
+        csv_results_filename += '_summary'
     if replacing==False and os.path.exists(file_path):
         print("FILE FOUND, not replacing: ", csv_results_filename)
         return
 
-    results = mesa.batch_run(
-        MerchantModel,
-        parameters=params,
-        iterations=num_iterations,
-        max_steps=max_steps,
-        number_processes=1,
-        data_collection_period=1,
-        display_progress=True
-    )
+    checkpoint_paths = [get_checkpoint_path(checkpoint_folder, csv_results_filename, iteration)
+                        for iteration in range(num_iterations)]
+    if summary_only:
+        summary = run_summary_iterations(params, num_iterations, max_steps, seed, checkpoint_paths)
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        summary.to_csv(file_path, index=False)
+        remove_checkpoints(checkpoint_folder, csv_results_filename, num_iterations)
+        return csv_results_filename
+
+    results = [run_iteration(params, iteration, iteration, max_steps, seed, checkpoint_paths[iteration]) 
+               for iteration in tqdm(range(num_iterations))]
     
-    df = pd.DataFrame(results)
+    df = pd.concat(results, ignore_index=True)
+    save_results(df, proportions, output_folder, file_path, store_path)
+    remove_checkpoints(checkpoint_folder, csv_results_filename, num_iterations)
+    
+    return csv_results_filename
+
+def run_forked_iterations(params, variants, burn_in_steps, max_steps, run_id, iteration, seed=None):
+    '''Run the model with `params` for `burn_in_steps` steps, then continue a copy of it
+    to `max_steps` steps for each dictionary of parameter changes in `variants`, ie
+    [{'distance_multiplier': 0.1}, {'distance_multiplier': 0.5}] (see MerchantModel.from_checkpoint).
+    Returns a list with the DataFrame of each variant, as run_iteration would give.'''
+    run_seed = get_run_seed(seed, iteration)
+    checkpoint = run_model(params, burn_in_steps, run_seed).get_checkpoint()
+    results = []
+    for changes in variants:
+        model = continue_model(MerchantModel.from_checkpoint(checkpoint, **changes), max_steps)
+        variant_params = get_run_columns(model, {**params, **changes}, run_seed)
+        results.append(model.datacollector.get_batch_run_dataframe(run_id, iteration, variant_params))
+    return results
+
+def do_forked_model_runs(spatial, 
+                         social, 
+                         num_merchants, 
+                         prod_criteria,
+                         distance_mults,
+                         proportions,
+                         num_iterations, 
+                         burn_in_steps,
+                         max_steps=100,
+                         burn_in_distance_mult=0,
+                         save_folder_start='experiments/outputs/csv_results/',
+                         replacing=False,
+                         store_path=RESULTS_STORE_PATH,
+                         seed=None):
+    '''Like do_model_runs for each distance multiplier in `distance_mults`, but every 
+    iteration first runs `burn_in_steps` steps once, with `burn_in_distance_mult`, and 
+    each distance multiplier continues from that shared state. The results of each
+    distance multiplier are written to their own csv, ending in _burnin{steps}-{distance mult}.
+    Returns the list of csv filenames that were written.'''
+    params = get_model_params(spatial, social, num_merchants, prod_criteria, burn_in_distance_mult, proportions)
+    file_paths = {}
+    for distance_mult in distance_mults:
+        output_folder, csv_results_filename, file_path = get_results_file_path(
+            spatial, social, num_merchants, prod_criteria, distance_mult, proportions,
+            num_iterations, max_steps, save_folder_start, seed=seed, burn_in=(burn_in_steps, burn_in_distance_mult))
+        if replacing==False and os.path.exists(file_path):
+            print("FILE FOUND, not replacing: ", csv_results_filename)
+            continue
+        file_paths[distance_mult] = (output_folder, csv_results_filename, file_path)
+    if not file_paths:
+        return []
+
+    variants = [{'distance_multiplier': distance_mult} for distance_mult in file_paths]
+    results = [run_forked_iterations(params, variants, burn_in_steps, max_steps, iteration, iteration, seed)
+               for iteration in tqdm(range(num_iterations))]
+    
+    written = []
+    for i, (output_folder, csv_results_filename, file_path) in enumerate(file_paths.values()):
+        df = pd.concat([iteration_results[i] for iteration_results in results], ignore_index=True)
+        save_results(df, proportions, output_folder, file_path, store_path)
+        written.append(csv_results_filename)
+    return written
+
+def save_results(df, proportions, output_folder, file_path, store_path):
+    '''Write the results of one cell to its csv file, and to the results store 
+    if `store_path` is not None and pyarrow is installed.'''
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
     df.to_csv(file_path)
+    if store_path is not None:
+        if has_results_store():
+            write_results(df, proportions, os.path.splitext(os.path.basename(file_path))[0], store_path)
+        else:
+            print("pyarrow is not installed, results are only saved to csv")
+
+################################################################################
+# Parallel runs across a whole parameter grid
+
+def make_cell(spatial, social, num_merchants, prod_criteria, distance_mult, proportions,
+              num_iterations, max_steps, save_folder_start,
+              collection_period=COLLECTION_PERIOD,
+              collection_steps=COLLECTION_STEPS,
+              collected_agents=COLLECTED_AGENTS,
+              seed=None,
+              convergence_tolerance=CONVERGENCE_TOLERANCE,
+              convergence_window=CONVERGENCE_WINDOW):
+    '''Return a dictionary describing one cell of the parameter grid, ie the
+    arguments that do_model_runs would be called with.'''
+    return {'spatial': spatial,
+            'social': social,
+            'num_merchants': num_merchants,
+            'prod_criteria': prod_criteria,
+            'distance_mult': distance_mult,
+            'proportions': proportions,
+            'num_iterations': num_iterations,
+            'max_steps': max_steps,
+            'save_folder_start': save_folder_start,
+            'collection_params': get_collection_params(collection_period, collection_steps, collected_agents),
+            'seed': seed,
+            'stopping_params': get_stopping_params(convergence_tolerance, convergence_window)}
+
+def get_cell_file_path(cell):
+    '''Return a tuple of (output folder, csv filename, full file path) for a cell.'''
+    return get_results_file_path(cell['spatial'], cell['social'], cell['num_merchants'],
+                                 cell['prod_criteria'], cell['distance_mult'], cell['proportions'],
+                                 cell['num_iterations'], cell['max_steps'], cell['save_folder_start'],
+                                 cell['collection_params'], cell['seed'],
+                                 stopping_params=cell['stopping_params'])
+
+def run_one_iteration(task):
+    '''Run a single iteration of one cell. `task` is a tuple of 
+    (cell index, model params, iteration, max_steps, seed).
+    Returns the cell index, iteration and the DataFrame of results for this iteration, 
+    with RunId and iteration set as they would be in a run over all iterations.'''
+    cell_index, params, iteration, max_steps, seed = task
+    return cell_index, iteration, run_iteration(params, iteration, iteration, max_steps, seed)
+
+def run_cells_in_parallel(cells, number_processes=None, replacing=False, store_path=RESULTS_STORE_PATH):
+    '''Run every (cell, iteration) pair of the given cells as one work queue on a pool
+    of `number_processes` processes (None uses all cores).
+    Each cell is written to the same csv file (and results store) as do_model_runs 
+    would write, as soon as all of its iterations have finished. Cells with an existing file are skipped
+    unless `replacing` is True. Returns the list of csv filenames that were written.'''
+    tasks = []
+    remaining = {}
+    for cell_index, cell in enumerate(cells):
+        _, csv_results_filename, file_path = get_cell_file_path(cell)
+        if replacing==False and os.path.exists(file_path):
+            print("FILE FOUND, not replacing: ", csv_results_filename)
+            continue
+        params = get_model_params(cell['spatial'], cell['social'], cell['num_merchants'],
+                                  cell['prod_criteria'], cell['distance_mult'], cell['proportions'],
+                                  cell['collection_params'], cell['stopping_params'])
+        remaining[cell_index] = {}
+        for iteration in range(cell['num_iterations']):
+            tasks.append((cell_index, params, iteration, cell['max_steps'], cell['seed']))
     
-    return csv_results_filename
+    written = []
+    with ProcessPoolExecutor(max_workers=number_processes) as executor:
+        futures = [executor.submit(run_one_iteration, task) for task in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            cell_index, iteration, results = future.result()
+            remaining[cell_index][iteration] = results
+            cell = cells[cell_index]
+            if len(remaining[cell_index]) == cell['num_iterations']:
+                # Rows are written in iteration order, as batch_run does
+                iteration_results = remaining.pop(cell_index)
+                df = pd.concat([iteration_results[i] for i in range(cell['num_iterations'])], 
+                               ignore_index=True)
+                output_folder, csv_results_filename, file_path = get_cell_file_path(cell)
+                save_results(df, cell['proportions'], output_folder, file_path, store_path)
+                written.append(csv_results_filename)
+    return written
+
+def get_decision_strat_cells(social_net, mer, dist_mult, 
+                             spatial_networks=spatial_networks, 
+                             specialist=False):
+    '''Return the cells run by test_decision_strat.'''
+    strats = specialist_decision_strats if specialist else DECISION_STRATS
+    return [make_cell(spatial, social_net, mer, NODE_DEGREE, dist_mult, dec_strat, 30, 400,
+                      'experiments/outputs/csv_results/decision_strats/')
+            for dec_strat in strats for spatial in spatial_networks]
+
+def get_decision_varying_merchants_cells(social_net, dist_mult, 
+                                         spatial_networks=spatial_networks, 
+                                         specialist=False):
+    '''Return the cells run by test_decision_varying_merchants.'''
+    return [cell for mer in merchant_numbers 
+            for cell in get_decision_strat_cells(social_net, mer, dist_mult, spatial_networks, specialist)]
+
+def get_dist_mult_cells(social_net, spatial_networks=spatial_networks):
+    '''Return the cells run by test_dist_mult.'''
+    return [make_cell(spatial, social_net, mer, NODE_DEGREE, dist_mult, (1,0,0), 30, 400,
+                      'experiments/outputs/csv_results/dist_mult/')
+            for spatial in spatial_networks for mer in merchant_numbers for dist_mult in distance_multipliers]
+
+def run_thesis_sweep(number_processes=None, replacing=False):
+    '''Run all four thesis experiments (see the end of this file) as a single work 
+    queue across `number_processes` processes.'''
+    cells = get_dist_mult_cells(BA_GRAPH, spatial_networks=[ITINERARIES, ORBIS]) \
+          + get_dist_mult_cells(WATTS_GRAPH, spatial_networks=[ITINERARIES, ORBIS]) \
+          + get_decision_varying_merchants_cells(BA_GRAPH, 1, spatial_networks=[ITINERARIES, ORBIS]) \
+          + get_decision_varying_merchants_cells(WATTS_GRAPH, 1, spatial_networks=[ITINERARIES, ORBIS])
+    return run_cells_in_parallel(cells, number_processes=number_processes, replacing=replacing)
 
 def test_decision_strat(social_net, mer, dist_mult, 
                         spatial_networks=spatial_networks, 
@@ -158,6 +519,9 @@ if __name__ == '__main__':
     # test_decision_varying_merchants(BA_GRAPH, 1, spatial_networks=[ITINERARIES, ORBIS])
     # test_decision_varying_merchants(WATTS_GRAPH, 1, spatial_networks=[ITINERARIES, ORBIS])
     
+    ## OR, run all four at once on every core
+    # run_thesis_sweep(number_processes=None)
+    
     # quickly_run()
         
     
@@ -0,0 +1,127 @@
+import pandas as pd
+import numpy as np
+import os
+from scipy.stats import rankdata
+
+# Scores model runs against the CEIPAC stamp data, by comparing each location's share of
+# the product at the final step with each site's share of the Dressel 20 stamps.
+# The stamp file is read once, and model locations are matched to stamp sites once for
+# each spatial network. Every run is then scored with array operations over all runs at once:
+# - ks: Kolmogorov-Smirnov statistic between the simulated and observed shares
+# - emd: Earth Mover's (Wasserstein-1) distance between the simulated and observed shares
+# - spearman: rank correlation between the simulated and observed share of each site
+# Only sites that are both model locations and stamp sites are compared, and shares are
+# taken over those sites, so both sum to 1.
+# >>> score_final_step_files(['../experiments/outputs/final_step/csvs/dist_mult/itin_ba/itineraries_ba_node degree_200_0.1_(1, 0, 0)_30_400.csv'])
+
+STAMP_FILE = os.path.join(os.path.dirname(__file__), 'brittania_stamps.csv')
+
+
+def load_observed_counts(stamp_file=STAMP_FILE, pottery_type='Dressel 20', site_col_name='site'):
+    '''Return a Series of the number of stamps of `pottery_type` found at each site
+    (all types if pottery_type is None).'''
+    df = pd.read_csv(stamp_file, usecols=['type', site_col_name])
+    if pottery_type is not None:
+        df = df[df['type'] == pottery_type]
+    return df[site_col_name].value_counts()
+
+
+class SiteIndex():
+    """The model locations that are also stamp sites, and the observed share of each.
+    - location_names (list of strings): modern name of each model location, in the column order of the simulated products
+    - observed_counts (Series): number of stamps per site, from load_observed_counts
+    """
+    def __init__(self, location_names, observed_counts):
+        location_names = [str(name) for name in location_names]
+        matched = [i for i, name in enumerate(location_names) if name in observed_counts.index]
+        self.location_index = np.array(matched, dtype=np.int64)
+        self.site_names = [location_names[i] for i in matched]
+        counts = observed_counts[self.site_names].to_numpy(dtype=float)
+        self.observed = counts / counts.sum()
+
+    def get_simulated_shares(self, products):
+        '''Given a (runs x locations) array of product, return the (runs x matched sites)
+        share of the product at each matched site. Runs with no product have shares of 0.'''
+        matched = np.asarray(products, dtype=float)[:, self.location_index]
+        total = matched.sum(axis=1, keepdims=True)
+        return np.divide(matched, total, out=np.zeros_like(matched), where=total > 0)
+
+
+def get_ecdf_distances(simulated, observed):
+    '''Return arrays of the KS statistic and Earth Mover's distance between the values in
+    each row of `simulated` (runs x sites) and the values in `observed`, which must lie in [0, 1].
+    Both distances compare the empirical CDFs at every value of either sample.'''
+    num_runs, num_simulated = simulated.shape
+    simulated = np.sort(simulated, axis=1)
+    observed = np.sort(observed)
+    points = np.sort(np.concatenate([simulated, np.broadcast_to(observed, (num_runs, len(observed)))], axis=1), axis=1)
+
+    # Search every row at once, by shifting row r to [2r, 2r + 1]
+    offset = 2 * np.arange(num_runs)[:, None]
+    below = np.searchsorted((simulated + offset).ravel(), (points + offset).ravel(), side='right')
+    simulated_cdf = (below.reshape(points.shape) - num_simulated * np.arange(num_runs)[:, None]) / num_simulated
+    observed_cdf = np.searchsorted(observed, points, side='right') / len(observed)
+
+    difference = np.abs(simulated_cdf - observed_cdf)
+    ks = difference.max(axis=1)
+    emd = (difference[:, :-1] * np.diff(points, axis=1)).sum(axis=1)
+    return ks, emd
+
+def get_rank_correlations(simulated, observed):
+    '''Return the Spearman rank correlation between each row of `simulated` (runs x sites)
+    and `observed`. Rows with every value the same have a correlation of nan.'''
+    simulated_ranks = rankdata(simulated, axis=1)
+    observed_ranks = rankdata(observed)
+    simulated_ranks -= simulated_ranks.mean(axis=1, keepdims=True)
+    observed_ranks -= observed_ranks.mean()
+    covariance = simulated_ranks @ observed_ranks
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return covariance / (np.sqrt((simulated_ranks ** 2).sum(axis=1)) * np.sqrt((observed_ranks ** 2).sum()))
+
+def score_runs(products, site_index):
+    '''Given a (runs x locations) array of product at each location, return a DataFrame
+    with the ks, emd and spearman scores of each run (see the top of this file).'''
+    simulated = site_index.get_simulated_shares(products)
+    ks, emd = get_ecdf_distances(simulated, site_index.observed)
+    return pd.DataFrame({'ks': ks, 'emd': emd,
+                         'spearman': get_rank_correlations(simulated, site_index.observed)})
+
+def get_products_by_run(df, product_type='PRODUCT_A Product'):
+    '''Given final step rows for locations (as in outputs/final_step/csvs), with a `file` column,
+    return a (runs x locations) DataFrame of `product_type`, indexed by file and iteration.'''
+    return df.pivot_table(index=['file', 'iteration'], columns='agent_location',
+                          values=product_type, aggfunc='sum', fill_value=0)
+
+def score_final_step_files(filepaths, product_type='PRODUCT_A Product', observed_counts=None):
+    '''Score every iteration of every final step csv in `filepaths` against the stamp data.
+    Files are grouped by spatial network (the start of the filename), so that each network's
+    locations are matched to stamp sites once and all of its runs are scored together.
+    Returns a DataFrame with one row per run: file, iteration, ks, emd, spearman.'''
+    if observed_counts is None:
+        observed_counts = load_observed_counts()
+    frames_by_network = {}
+    for filepath in filepaths:
+        filename = filepath.split('/')[-1]
+        df = pd.read_csv(filepath, usecols=['iteration', 'agent_location', product_type])
+        df['file'] = filename
+        frames_by_network.setdefault(filename.split('_')[0], []).append(df)
+
+    results = []
+    for network, frames in frames_by_network.items():
+        products = get_products_by_run(pd.concat(frames), product_type)
+        site_index = SiteIndex(products.columns, observed_counts)
+        scores = score_runs(products.to_numpy(), site_index)
+        scores.index = products.index
+        results.append(scores.reset_index())
+    return pd.concat(results, ignore_index=True)
+
+def score_final_step_folder(folder_path, product_type='PRODUCT_A Product'):
+    '''Score every final step csv in the subfolders of a folder like
+    '../experiments/outputs/final_step/csvs/dist_mult' (see score_final_step_files).'''
+    filepaths = []
+    for subfolder in sorted(os.listdir(folder_path)):
+        if subfolder != '.DS_Store' and not 'anova' in subfolder and os.path.isdir(f'{folder_path}/{subfolder}'):
+            for filename in sorted(os.listdir(f'{folder_path}/{subfolder}')):
+                if filename.endswith('.csv') and not 'anova' in filename:
+                    filepaths.append(f'{folder_path}/{subfolder}/{filename}')
+    return score_final_step_files(filepaths, product_type)
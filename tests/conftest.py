@@ -0,0 +1,16 @@
+import os, sys
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture(scope='session')
+def cache_dir(tmp_path_factory):
+    '''A folder shared by every test, where models write their network caches.'''
+    return tmp_path_factory.mktemp('caches')
+
+@pytest.fixture(autouse=True)
+def in_cache_dir(cache_dir, monkeypatch):
+    '''Run each test in the shared cache folder, so the repository's caches are not touched.'''
+    monkeypatch.chdir(cache_dir)
@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+
+from experiments.run_anova import update_anova_all_networks
+
+FOLDER = 'outputs/final_step/csvs/dist_mult'
+FILENAME = 'itin_ba/itineraries_ba_node degree_20_0.5_(1, 0, 0)_2_5.csv'
+
+
+def write_final_step_csv(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame({'agent_location': ['London', 'York', 'London', 'York'],
+                  'PRODUCT_A Product': [1, 2, 3, 4],
+                  'PRODUCT_B Product': [5, 6, 7, 8],
+                  'PRODUCT_C Product': [9, 10, 11, 12]}).to_csv(path)
+
+def test_rows_are_rebuilt_for_another_location_or_product(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    write_final_step_csv(f'{FOLDER}/{FILENAME}')
+    london = update_anova_all_networks('dist_mult')
+    assert london['product_amount'].tolist() == [1, 3]
+    assert london['num_merchants'].tolist() == ['20', '20']
+
+    york = update_anova_all_networks('dist_mult', location='York')
+    assert york['product_amount'].tolist() == [2, 4]
+    product_b = update_anova_all_networks('dist_mult', location='York', product_type='PRODUCT_B Product')
+    assert product_b['product_amount'].tolist() == [6, 8]
+    assert product_b['total_product_in_system'].tolist() == [26, 26]
+    network_file = pd.read_csv(f'{FOLDER}/itin_ba/anova_itin_ba.csv', index_col=0)
+    assert network_file['product_amount'].tolist() == [6, 8]
+
+    # The same location and product again reuses the rows
+    capsys.readouterr()
+    again = update_anova_all_networks('dist_mult', location='York', product_type='PRODUCT_B Product')
+    assert again['product_amount'].tolist() == [6, 8]
+    assert 'read 0 new or changed files, reused 1' in capsys.readouterr().out
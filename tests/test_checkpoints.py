@@ -0,0 +1,123 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from ABM.constants import *
+from ABM.model import CHECKPOINT_VERSION, MerchantModel, load_checkpoint
+import run_model as run_model_module
+from run_model import CHECKPOINT_PERIOD, continue_model, get_model_params, run_model
+
+ENGINES = [AGENT_ENGINE, ARRAY_ENGINE]
+CHANGES = [{}, {'location_trades': True, 'no_trade_tolerance': 3}]
+SEED = 3
+
+
+def get_params(engine, **changes):
+    params = get_model_params(ITINERARIES, BA_GRAPH, 50, NODE_DEGREE, 0.5, (0.3, 0.3, 0.4))
+    params.update(step_engine=engine, **changes)
+    return params
+
+def assert_same_run(model, other):
+    assert model.schedule.steps == other.schedule.steps
+    assert model.datacollector.get_agent_vars_dataframe().equals(other.datacollector.get_agent_vars_dataframe())
+    assert model.datacollector.get_model_vars_dataframe().equals(other.datacollector.get_model_vars_dataframe())
+    np.testing.assert_array_equal(model.get_deposited_product(), other.get_deposited_product())
+    np.testing.assert_array_equal(model.location_membership.location_index, 
+                                  other.location_membership.location_index)
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('changes', CHANGES)
+def test_restored_model_continues_the_same_run(engine, changes, tmp_path):
+    params = get_params(engine, **changes)
+    uninterrupted = run_model(params, 70, SEED)
+    model = run_model(params, 40, SEED)
+    model.save_checkpoint(str(tmp_path / 'model.pickle'))
+    restored = MerchantModel.from_checkpoint(load_checkpoint(str(tmp_path / 'model.pickle')))
+    assert restored.schedule.steps == 40
+    assert_same_run(continue_model(restored, 70), uninterrupted)
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_run_model_resumes_from_its_checkpoint(engine, tmp_path, monkeypatch):
+    params = get_params(engine, location_trades=True, no_trade_tolerance=3)
+    checkpoint_path = str(tmp_path / 'run.pickle')
+    max_steps = CHECKPOINT_PERIOD + 30
+    # A run that was stopped after its first checkpoint
+    continue_model(MerchantModel(**params, seed=SEED), CHECKPOINT_PERIOD + 10, checkpoint_path)
+    resumed_steps = []
+    resume_model = run_model_module.resume_model
+    def spy_resume_model(*args):
+        model = resume_model(*args)
+        resumed_steps.append(model.schedule.steps)
+        return model
+    monkeypatch.setattr(run_model_module, 'resume_model', spy_resume_model)
+    resumed = run_model(params, max_steps, SEED, checkpoint_path)
+    assert resumed_steps == [CHECKPOINT_PERIOD]
+    assert_same_run(resumed, run_model(params, max_steps, SEED))
+
+def test_resuming_with_different_params_is_rejected(tmp_path):
+    params = get_params(AGENT_ENGINE)
+    checkpoint_path = str(tmp_path / 'run.pickle')
+    run_model(params, 10, SEED).save_checkpoint(checkpoint_path)
+    with pytest.raises(ValueError):
+        run_model(params, 20, SEED + 1, checkpoint_path)
+    with pytest.raises(ValueError):
+        run_model({**params, 'distance_multiplier': 0.1}, 20, SEED, checkpoint_path)
+
+def test_checkpoint_in_an_older_layout_is_rejected(tmp_path):
+    checkpoint = run_model(get_params(AGENT_ENGINE), 5, SEED).get_checkpoint()
+    checkpoint['version'] = CHECKPOINT_VERSION - 1
+    with open(tmp_path / 'old.pickle', 'wb') as f:
+        pickle.dump(checkpoint, f)
+    with pytest.raises(ValueError):
+        load_checkpoint(str(tmp_path / 'old.pickle'))
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_forked_variants(engine):
+    checkpoint = run_model(get_params(engine), 20, SEED).get_checkpoint()
+    with pytest.raises(ValueError):
+        MerchantModel.from_checkpoint(checkpoint, num_merchants=20)
+    with pytest.raises(ValueError):
+        MerchantModel.from_checkpoint(checkpoint, producer_criteria=RANDOM)
+    with pytest.raises(ValueError):
+        MerchantModel.from_checkpoint(checkpoint, placement_seed=1)
+
+    fork = MerchantModel.from_checkpoint(checkpoint, distance_multiplier=0, seed=SEED + 1)
+    assert fork.init_params['distance_multiplier'] == 0
+    np.testing.assert_array_equal(fork.get_deposited_product(), 
+                                  MerchantModel.from_checkpoint(checkpoint).get_deposited_product())
+    continue_model(fork, 30)
+    assert fork.schedule.steps == 30
+
+    # With new collection params, data is collected from the checkpoint's step onwards
+    recollected = MerchantModel.from_checkpoint(checkpoint, collection_period=5)
+    continue_model(recollected, 30)
+    steps = recollected.datacollector.get_agent_vars_dataframe().index.get_level_values('Step').unique()
+    assert list(steps) == [20, 25, 30]
+
+def get_specialist_items(model):
+    return [agent.specialist_item for agent in model.merchant_agents 
+            if getattr(agent, 'specialist_item', None) is not None]
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_fork_with_a_new_seed_keeps_the_world(engine):
+    params = get_params(engine, producer_criteria=RANDOM)
+    burn_in = run_model(params, 20, SEED)
+    checkpoint = burn_in.get_checkpoint()
+    fork = MerchantModel.from_checkpoint(checkpoint, seed=SEED + 1)
+    # A model built from scratch with the new seed would place producers and specialist items elsewhere
+    other = MerchantModel(**params, seed=SEED + 1)
+    assert other.producer_types != burn_in.producer_types
+    assert get_specialist_items(other) != get_specialist_items(burn_in)
+
+    assert fork.producer_types == burn_in.producer_types
+    assert len(get_specialist_items(fork)) > 0
+    assert get_specialist_items(fork) == get_specialist_items(burn_in)
+    if engine == ARRAY_ENGINE:
+        np.testing.assert_array_equal(fork.schedule.specialist_index, burn_in.schedule.specialist_index)
+    assert fork.social_network_seed == burn_in.social_network_seed
+
+    # Only the steps after the checkpoint use the new seed
+    continue_model(fork, 40)
+    continue_model(burn_in, 40)
+    assert not fork.datacollector.get_agent_vars_dataframe().equals(burn_in.datacollector.get_agent_vars_dataframe())
@@ -0,0 +1,70 @@
+import mesa
+import pytest
+
+from ABM.constants import *
+from ABM.reporters import *
+from ABM.model import MerchantModel
+from run_model import get_model_params
+
+
+def get_mesa_reporters():
+    '''The reporters that were registered with mesa.DataCollector before the columnar collector.'''
+    reporters = {"agent_category": get_agent_category,
+                 "agent_type": get_agent_type,
+                 "agent_location": get_agent_location,
+                 "agent_stable_id": get_agent_stable_id,
+                 "latin_name": get_agent_latin_name,
+                 "modern_name": get_agent_modern_name}
+    for prod in Product:
+        p = prod.value
+        reporters[f"{prod.name} Product"] = lambda a, p=p: get_agent_product(p, a)
+        reporters[f"{prod.name} Stock"] = lambda a, p=p: get_agent_stock(p, a)
+        reporters[f"{prod.name} Demand"] = lambda a, p=p: get_agent_demand(p, a)
+    reporters["num_trades"] = get_agent_num_trades
+    reporters["node_degree"] = get_node_degree
+    return reporters
+
+def get_model(engine, **changes):
+    params = get_model_params(ITINERARIES, BA_GRAPH, 30, NODE_DEGREE, 0.5, (0.3, 0.3, 0.4))
+    params.update(step_engine=engine, location_trades=True, no_trade_tolerance=2, **changes)
+    return MerchantModel(**params, seed=5)
+
+@pytest.mark.parametrize('engine', [AGENT_ENGINE, ARRAY_ENGINE])
+def test_matches_mesa_data_collector(engine):
+    model = get_model(engine)
+    reference = mesa.DataCollector(model_reporters={SUM_PRODUCT_REPORTER: get_product_at_sites},
+                                   agent_reporters=get_mesa_reporters())
+    reference.collect(model)
+    # More steps than the initial capacity, so the arrays have to grow
+    for _ in range(70):
+        model.step()
+        reference.collect(model)
+    expected = reference.get_agent_vars_dataframe()
+    actual = model.datacollector.get_agent_vars_dataframe()
+    assert list(actual.columns) == list(expected.columns)
+    assert actual.index.equals(expected.index)
+    assert actual.astype(str).equals(expected.astype(str))
+    assert list(model.datacollector.get_model_vars_dataframe()[SUM_PRODUCT_REPORTER]) \
+           == list(reference.get_model_vars_dataframe()[SUM_PRODUCT_REPORTER])
+
+@pytest.mark.parametrize('changes, expected_steps', [({'collection_period': 4}, [0, 4, 8, 10]),
+                                                     ({'collection_period': FINAL_STEP_ONLY}, [10]),
+                                                     ({'collection_steps': [3, 7]}, [3, 7, 10])])
+def test_keeps_only_the_requested_steps(changes, expected_steps):
+    full = get_model(ARRAY_ENGINE)
+    model = get_model(ARRAY_ENGINE, **changes)
+    for _ in range(10):
+        full.step()
+        model.step()
+    df = model.datacollector.get_agent_vars_dataframe()
+    assert sorted(df.index.get_level_values('Step').unique()) == expected_steps
+    expected = full.datacollector.get_agent_vars_dataframe().loc[expected_steps]
+    assert df.astype(str).equals(expected.astype(str))
+
+@pytest.mark.parametrize('collected_agents, category', [(COLLECT_LOCATIONS, 'location'), 
+                                                        (COLLECT_MERCHANTS, 'merchant')])
+def test_collects_only_the_requested_agents(collected_agents, category):
+    model = get_model(ARRAY_ENGINE, collected_agents=collected_agents)
+    model.step()
+    df = model.datacollector.get_agent_vars_dataframe()
+    assert set(df['agent_category']) == {category}
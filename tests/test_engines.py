@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from ABM.constants import *
+from run_model import get_model_params, run_model
+
+STRATEGIES = [(1, 0, 0), (0.3, 0.3, 0.4)]
+NUM_SEEDS = 12
+
+
+def get_params(engine, proportions=(1, 0, 0), **changes):
+    params = get_model_params(ITINERARIES, BA_GRAPH, 50, NODE_DEGREE, 0.5, proportions)
+    params.update(step_engine=engine, **changes)
+    return params
+
+def get_run_totals(engine, proportions):
+    '''Return (seeds x products) deposited product and the (seeds,) number of trades.'''
+    deposited, trades = [], []
+    for seed in range(NUM_SEEDS):
+        model = run_model(get_params(engine, proportions), 50, seed)
+        deposited.append(model.get_deposited_product().sum(axis=0))
+        trades.append(sum(a.num_trades for a in model.merchant_agents))
+    return np.array(deposited, dtype=float), np.array(trades, dtype=float)
+
+def assert_same_mean(a, b):
+    '''The means of the samples in a and b (along the first axis) agree within 3 standard errors.'''
+    standard_error = np.sqrt(a.var(axis=0, ddof=1) / len(a) + b.var(axis=0, ddof=1) / len(b))
+    assert np.all(np.abs(a.mean(axis=0) - b.mean(axis=0)) <= 3 * standard_error + 1)
+
+@pytest.mark.parametrize('proportions', STRATEGIES)
+def test_array_engine_matches_agent_engine_on_average(proportions):
+    agent_deposited, agent_trades = get_run_totals(AGENT_ENGINE, proportions)
+    array_deposited, array_trades = get_run_totals(ARRAY_ENGINE, proportions)
+    assert agent_deposited.sum() > 0
+    assert_same_mean(agent_deposited, array_deposited)
+    assert_same_mean(agent_trades, array_trades)
+
+@pytest.mark.parametrize('engine', [AGENT_ENGINE, ARRAY_ENGINE])
+@pytest.mark.parametrize('changes', [{}, {'location_trades': True, 'no_trade_tolerance': 3}])
+def test_same_seed_gives_the_same_run(engine, changes):
+    first = run_model(get_params(engine, (0.3, 0.3, 0.4), **changes), 30, 7)
+    second = run_model(get_params(engine, (0.3, 0.3, 0.4), **changes), 30, 7)
+    other = run_model(get_params(engine, (0.3, 0.3, 0.4), **changes), 30, 8)
+    first_df = first.datacollector.get_agent_vars_dataframe()
+    assert first_df.equals(second.datacollector.get_agent_vars_dataframe())
+    assert not first_df.equals(other.datacollector.get_agent_vars_dataframe())
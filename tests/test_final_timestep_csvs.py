@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+from experiments.create_final_timestep_csvs import read_location_final_timestep_rows
+
+
+def write_results(path, agent_categories):
+    rows = [{'AgentID': agent, 'iteration': iteration, 'Step': step, 'agent_category': category,
+             'modern_name': f'place {agent}', 'PRODUCT_A Product': 10 * step + agent, 'PRODUCT_A Stock': 1}
+            for iteration in range(2) for step in range(3) 
+            for agent, category in enumerate(agent_categories)]
+    pd.DataFrame(rows).to_csv(path)
+
+@pytest.mark.parametrize('chunksize', [1, 4, 1000])
+def test_final_location_rows(tmp_path, chunksize):
+    path = tmp_path / 'results.csv'
+    write_results(path, ['merchant', 'location', 'location'])
+    df = read_location_final_timestep_rows(path, chunksize=chunksize)
+    assert 'PRODUCT_A Stock' not in df.columns
+    assert df['iteration'].tolist() == [0, 0, 1, 1]
+    assert df['Step'].tolist() == [2, 2, 2, 2]
+    assert df['AgentID'].tolist() == [1, 2, 1, 2]
+
+def test_results_without_locations(tmp_path):
+    path = tmp_path / 'results.csv'
+    write_results(path, ['merchant', 'merchant'])
+    df = read_location_final_timestep_rows(path, chunksize=4)
+    assert df.empty
+    assert list(df.columns) == ['Unnamed: 0', 'AgentID', 'iteration', 'Step', 'agent_category', 
+                                'modern_name', 'PRODUCT_A Product']
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from ABM.constants import *
+from ABM.LocationMembership import LocationMembership
+from run_model import get_model_params, run_model
+
+NUM_LOCATIONS = 4
+
+
+def assert_consistent(membership, location_index):
+    '''The members, positions and counts all agree with the location of each merchant.'''
+    np.testing.assert_array_equal(membership.location_index, location_index)
+    np.testing.assert_array_equal(membership.counts, np.bincount(location_index, minlength=NUM_LOCATIONS))
+    for location in range(NUM_LOCATIONS):
+        members = membership.get_members(location)
+        assert sorted(members.tolist()) == np.flatnonzero(location_index == location).tolist()
+        np.testing.assert_array_equal(membership.position[members], np.arange(len(members)))
+        assert (membership.members[location, len(members):] == -1).all()
+
+def test_members_start_in_order_of_merchant_id():
+    membership = LocationMembership([2, 0, 2, 1, 2], NUM_LOCATIONS)
+    assert membership.get_members(2).tolist() == [0, 2, 4]
+    assert membership.get_count(3) == 0
+    assert_consistent(membership, np.array([2, 0, 2, 1, 2]))
+
+def test_move_swaps_the_last_member_into_the_movers_place():
+    membership = LocationMembership([2, 0, 2, 1, 2], NUM_LOCATIONS)
+    membership.move(0, 1)
+    assert membership.get_members(2).tolist() == [4, 2]
+    assert membership.get_members(1).tolist() == [3, 0]
+    membership.move(3, 1) # already there
+    assert_consistent(membership, np.array([1, 0, 2, 1, 2]))
+
+@pytest.mark.parametrize('seed', range(3))
+def test_random_moves_stay_consistent_and_rows_grow(seed):
+    rng = np.random.default_rng(seed)
+    location_index = np.arange(20) % NUM_LOCATIONS
+    membership = LocationMembership(location_index, NUM_LOCATIONS)
+    assert membership.members.shape[1] == 5
+    membership.move_many(np.arange(20), np.full(20, 3))
+    assert membership.members.shape[1] == 20
+    location_index[:] = 3
+    assert_consistent(membership, location_index)
+    for _ in range(10):
+        merchants = rng.choice(20, size=5, replace=False)
+        new_locations = rng.integers(NUM_LOCATIONS, size=5)
+        membership.move_many(merchants, new_locations)
+        location_index[merchants] = new_locations
+        assert_consistent(membership, location_index)
+
+def test_state_round_trip():
+    membership = LocationMembership([0, 1, 2, 3], NUM_LOCATIONS)
+    state = membership.get_state()
+    location_index = membership.location_index
+    membership.move_many(np.array([0, 1, 2]), np.array([3, 3, 3]))
+    membership.set_state(state)
+    # Restored in place, as the array engine shares location_index
+    assert membership.location_index is location_index
+    assert_consistent(membership, np.array([0, 1, 2, 3]))
+
+@pytest.mark.parametrize('engine', [AGENT_ENGINE, ARRAY_ENGINE])
+def test_merchants_move_to_neighbouring_locations(engine):
+    params = get_model_params(ITINERARIES, BA_GRAPH, 50, NODE_DEGREE, 0.5, (0.3, 0.3, 0.4))
+    params.update(step_engine=engine, no_trade_tolerance=0)
+    model = run_model(params, 0, 4)
+    num_merchants = model.num_merchants
+    neighbours = [{n - num_merchants for n in location.neighbours_dist} for location in model.location_agents]
+    num_moves = 0
+    for _ in range(10):
+        before = model.location_membership.location_index.copy()
+        model.step()
+        after = model.location_membership.location_index
+        moved = np.flatnonzero(before != after)
+        num_moves += len(moved)
+        assert all(after[m] in neighbours[before[m]] for m in moved)
+        assert [agent.location_id - num_merchants for agent in model.merchant_agents] == after.tolist()
+        for location in model.location_agents:
+            assert all(model.merchant_agents[m].location_id == location.grid_id for m in location.merchants)
+    assert num_moves > 0
+
+    graph = model.get_graph_with_interlayer_edges()
+    interlayer = [(u, v) for u, v, kind in graph.edges(data='type') if kind == 'interlayer']
+    assert len(interlayer) == num_merchants
+    assert graph.number_of_edges() == model.G.number_of_edges() + num_merchants
+    assert sorted(tuple(sorted(edge)) for edge in interlayer) == model.get_interlayer_edges()
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from ABM.constants import *
+from ABM.LocationStatistics import LocationStatistics
+from run_model import run_summary_iterations, get_model_params
+
+
+def get_random_runs(num_runs, num_locations=5, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 50, size=(num_runs, num_locations, len(Product)))
+
+def get_shares(runs):
+    total = runs.sum(axis=1, keepdims=True)
+    return np.divide(runs, total, out=np.zeros(runs.shape), where=total > 0)
+
+def test_mean_and_variance_match_numpy():
+    runs = get_random_runs(40)
+    statistics = LocationStatistics([f'location {i}' for i in range(5)])
+    for run in runs:
+        statistics.add_run(run)
+    shares = get_shares(runs)
+    assert statistics.count == 40
+    np.testing.assert_allclose(statistics.mean, shares.mean(axis=0))
+    np.testing.assert_allclose(statistics.get_variance(), shares.var(axis=0, ddof=1))
+
+@pytest.mark.parametrize('num_runs', [1, 3, 10, 200])
+@pytest.mark.parametrize('q', [0.05, 0.25, 0.5, 0.75, 0.95])
+def test_quantile_is_within_one_bin_of_numpy(num_runs, q):
+    runs = get_random_runs(num_runs, seed=num_runs)
+    statistics = LocationStatistics([f'location {i}' for i in range(5)], num_bins=1000)
+    for run in runs:
+        statistics.add_run(run)
+    shares = get_shares(runs)
+    # The estimate is in the same histogram bin as the smallest share with a cumulative share of at least q
+    expected = np.quantile(shares, q, axis=0, method='inverted_cdf')
+    np.testing.assert_allclose(statistics.get_quantile(q), expected, rtol=0, atol=1 / 1000 + 1e-12)
+
+def test_quantile_of_a_constant_share_is_exact():
+    statistics = LocationStatistics(['a', 'b'], num_bins=10)
+    for _ in range(5):
+        statistics.add_run(np.array([[1, 3, 0], [2, 1, 0]]))
+    np.testing.assert_array_equal(statistics.get_quantile(0.5), [[1 / 3, 3 / 4, 0], [2 / 3, 1 / 4, 0]])
+
+def test_summary_dataframe_has_a_row_per_location_and_product():
+    statistics = LocationStatistics(['a', 'b'])
+    statistics.add_run(np.array([[1, 3, 0], [2, 1, 0]]))
+    df = statistics.get_summary_dataframe()
+    assert len(df) == 2 * len(Product)
+    assert list(df['runs'].unique()) == [1]
+    assert df['share_std'].isna().all()
+
+def test_summary_without_iterations_raises():
+    params = get_model_params(ITINERARIES, BA_GRAPH, 20, NODE_DEGREE, 0.5, (1, 0, 0))
+    with pytest.raises(ValueError):
+        run_summary_iterations(params, 0, 5)
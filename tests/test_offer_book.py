@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from ABM.constants import *
+from ABM.OfferBook import OfferBook
+
+NUM_MERCHANTS = 6
+
+
+def random_offers(rng, num_offers):
+    '''Return (buyers, sellers, product types, prices) arrays, with whole prices so that there are ties.'''
+    return (rng.integers(NUM_MERCHANTS, size=num_offers),
+            rng.integers(NUM_MERCHANTS, size=num_offers),
+            rng.integers(len(Product), size=num_offers),
+            rng.integers(5, size=num_offers).astype(float))
+
+def test_best_offer_and_first_offer_wins_ties():
+    book = OfferBook(NUM_MERCHANTS)
+    assert book.get_best_offer(0, 0) is None
+    book.add_offer(buyer=1, seller=0, product_type=0, price=2.0)
+    book.add_offer(buyer=2, seller=0, product_type=0, price=3.0)
+    book.add_offer(buyer=3, seller=0, product_type=0, price=3.0)
+    book.add_offer(buyer=4, seller=0, product_type=1, price=1.0)
+    assert book.get_best_offer(0, 0) == (2, 3.0)
+    assert book.get_best_offer(0, 1) == (4, 1.0)
+    assert book.get_best_offer(1, 0) is None
+    prices, buyers = book.get_best_offers()
+    assert prices.shape == buyers.shape == (NUM_MERCHANTS, len(Product))
+    assert buyers[0, 0] == 2 and prices[0, 0] == 3.0
+    assert buyers[1, 0] == -1 and prices[1, 0] == -np.inf
+
+@pytest.mark.parametrize('seed', range(5))
+def test_add_offers_matches_add_offer(seed):
+    rng = np.random.default_rng(seed)
+    sequential, batched = OfferBook(NUM_MERCHANTS), OfferBook(NUM_MERCHANTS)
+    # Offers already in the book, then a batch that ties or beats some of them
+    for offers in [random_offers(rng, 10), random_offers(rng, 40)]:
+        for buyer, seller, product_type, price in zip(*offers):
+            sequential.add_offer(buyer, seller, product_type, price)
+        batched.add_offers(*offers)
+    np.testing.assert_array_equal(batched.best_price, sequential.best_price)
+    np.testing.assert_array_equal(batched.best_buyer, sequential.best_buyer)
+
+def test_clear():
+    book = OfferBook(NUM_MERCHANTS)
+    book.add_offers(*random_offers(np.random.default_rng(0), 20))
+    book.clear()
+    assert all(book.get_best_offer(seller, product_type) is None 
+               for seller in range(NUM_MERCHANTS) for product_type in range(len(Product)))
+
+def test_offer_log():
+    assert list(OfferBook(NUM_MERCHANTS).get_offer_log_dataframe().columns) == \
+           ['step', 'buyer', 'seller', 'product_type', 'price']
+    unlogged = OfferBook(NUM_MERCHANTS, log_offers=False)
+    unlogged.add_offer(1, 0, 0, 2.0, step=0)
+    assert unlogged.get_offer_log_dataframe().empty
+
+    book = OfferBook(NUM_MERCHANTS, log_offers=True)
+    book.add_offer(1, 0, 0, 2.0, step=0)
+    book.add_offers(np.array([2, 3]), np.array([1, 1]), np.array([0, 2]), np.array([1.0, 4.0]), step=1)
+    df = book.get_offer_log_dataframe()
+    assert df['step'].tolist() == [0, 1, 1]
+    assert df['buyer'].tolist() == [1, 2, 3]
+    assert df['seller'].tolist() == [0, 1, 1]
+    assert df['product_type'].tolist() == [0, 0, 2]
+    assert df['price'].tolist() == [2.0, 1.0, 4.0]
+
+def test_state_round_trip():
+    book = OfferBook(NUM_MERCHANTS, log_offers=True)
+    book.add_offers(*random_offers(np.random.default_rng(0), 20), step=0)
+    state = book.get_state()
+    restored = OfferBook(NUM_MERCHANTS, log_offers=True)
+    restored.set_state(state)
+    # The state is a copy, so later offers do not change it
+    book.add_offer(0, 0, 0, 10.0, step=1)
+    restored.set_state(state)
+    book.set_state(state)
+    np.testing.assert_array_equal(restored.best_price, book.best_price)
+    np.testing.assert_array_equal(restored.best_buyer, book.best_buyer)
+    assert restored.get_offer_log_dataframe().equals(book.get_offer_log_dataframe())
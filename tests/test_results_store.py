@@ -0,0 +1,83 @@
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from ABM.constants import *
+from experiments.create_final_timestep_csvs import read_location_final_timestep_rows
+from experiments.results_store import CELL_COLUMN, STRATEGY_COLUMN, read_results
+from experiments.run_anova import convert_one_file_to_ANOVA_df, get_anova_df_from_store
+from run_model import do_model_runs
+
+NUM_MERCHANTS = 20
+NUM_ITERATIONS = 2
+MAX_STEPS = 5
+# Cells that differ only in parameters that are not partition columns, so they share a folder
+CELLS = [(NODE_DEGREE, 1), (NODE_DEGREE, 2), (RANDOM, 1)]
+
+
+def run_cell(prod_criteria, seed, csv_folder, store_path):
+    do_model_runs(ITINERARIES, BA_GRAPH, NUM_MERCHANTS, prod_criteria, 0.5, (1, 0, 0), 0, 
+                  NUM_ITERATIONS, MAX_STEPS, save_folder_start=csv_folder, replacing=True, 
+                  store_path=store_path, seed=seed)
+
+def read_csvs(csv_folder):
+    folder = os.path.join(csv_folder, 'itin_ba')
+    return {os.path.splitext(filename)[0]: pd.read_csv(os.path.join(folder, filename)) 
+            for filename in sorted(os.listdir(folder))}
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('results')
+    csv_folder, store_path = str(folder / 'csvs'), str(folder / 'store')
+    for prod_criteria, seed in CELLS:
+        run_cell(prod_criteria, seed, csv_folder, store_path)
+    return csv_folder, store_path
+
+def test_every_cell_is_kept(store):
+    csv_folder, store_path = store
+    csvs = read_csvs(csv_folder)
+    assert len(csvs) == len(CELLS)
+    sizes = read_results(store_path).groupby(CELL_COLUMN).size().to_dict()
+    assert sizes == {cell: len(df) for cell, df in csvs.items()}
+
+def test_writing_a_cell_again_only_replaces_that_cell(store):
+    csv_folder, store_path = store
+    before = read_results(store_path).sort_values([CELL_COLUMN, 'iteration', 'Step', 'AgentID'])
+    run_cell(NODE_DEGREE, 1, csv_folder, store_path)
+    after = read_results(store_path).sort_values([CELL_COLUMN, 'iteration', 'Step', 'AgentID'])
+    # The cell is seeded, so it is replaced by the same rows, rather than added again
+    pd.testing.assert_frame_equal(after.reset_index(drop=True), before.reset_index(drop=True))
+
+def test_read_results_filters(store):
+    _, store_path = store
+    df = read_results(store_path, columns=['producer_criteria', 'Step', 'agent_category'], 
+                      producer_criteria=RANDOM, agent_category='location', Step=[0, MAX_STEPS])
+    assert list(df.columns) == ['producer_criteria', 'Step', 'agent_category']
+    assert len(df) > 0
+    assert set(df['producer_criteria']) == {RANDOM}
+    assert set(df['agent_category']) == {'location'}
+    assert set(df['Step']) <= {0, MAX_STEPS}
+
+@pytest.mark.parametrize('strategy', [(1, 0, 0), '(1, 0, 0)', [(1, 0, 0), (0, 1, 0)]])
+def test_read_results_by_strategy(store, strategy):
+    _, store_path = store
+    df = read_results(store_path, columns=[STRATEGY_COLUMN], strategy=strategy)
+    assert len(df) == len(read_results(store_path, columns=[STRATEGY_COLUMN]))
+    assert read_results(store_path, columns=[STRATEGY_COLUMN], strategy=(0, 1, 0)).empty
+
+def test_anova_from_store_matches_csvs(store, tmp_path):
+    csv_folder, store_path = store
+    frames = []
+    for cell in read_csvs(csv_folder):
+        if NODE_DEGREE not in cell:
+            continue
+        final_step_file = str(tmp_path / f'{cell}.csv')
+        read_location_final_timestep_rows(os.path.join(csv_folder, 'itin_ba', f'{cell}.csv')).to_csv(final_step_file)
+        frames.append(convert_one_file_to_ANOVA_df(final_step_file, 'London', 'PRODUCT_A Product'))
+    from_csvs = pd.concat(frames, ignore_index=True)
+    from_store = get_anova_df_from_store(store_path, producer_criteria=NODE_DEGREE)
+    assert set(from_store['network']) == {'itin_ba'}
+    pd.testing.assert_frame_equal(from_store.drop(columns='network').astype(str), from_csvs.astype(str))
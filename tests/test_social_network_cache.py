@@ -0,0 +1,79 @@
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pytest
+
+from ABM.constants import *
+from ABM.model import MerchantModel, read_or_create_file
+
+
+def build_model(social_network_seed, social=BA_GRAPH):
+    return MerchantModel(num_merchants=30, num_locations=get_num_locations(ITINERARIES), 
+                         spatial_network_type=ITINERARIES, social_network_type=social, 
+                         producer_criteria=NODE_DEGREE, seed=1, social_network_seed=social_network_seed)
+
+def fail_to_generate(self):
+    raise AssertionError("The social network was generated again")
+
+def sorted_edges(model):
+    return sorted(tuple(sorted(edge)) for edge in model.social_network.edges())
+
+@pytest.fixture
+def empty_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def test_same_seed_loads_the_cached_network(empty_cache, monkeypatch):
+    generated = build_model(social_network_seed=5)
+    filename = generated.get_social_network_filename()
+    assert os.path.isfile(filename)
+    monkeypatch.setattr(MerchantModel, 'create_new_social_net', fail_to_generate)
+    loaded = build_model(social_network_seed=5)
+    assert loaded.get_social_network_filename() == filename
+    assert sorted_edges(loaded) == sorted_edges(generated)
+    # Neighbour order is the same whether the network was generated or loaded
+    for node in range(30):
+        assert list(loaded.social_network.neighbors(node)) == list(generated.social_network.neighbors(node))
+
+def test_different_seeds_get_different_files(empty_cache):
+    first = build_model(social_network_seed=5)
+    second = build_model(social_network_seed=6)
+    assert first.get_social_network_filename() != second.get_social_network_filename()
+    assert sorted_edges(first) != sorted_edges(second)
+    assert len(os.listdir('social_networks')) == 2 + 2 # each file and its lock file
+
+def test_generator_params_are_part_of_the_filename(empty_cache, monkeypatch):
+    model = build_model(social_network_seed=5, social=WATTS_GRAPH)
+    filename = model.get_social_network_filename()
+    params = {**SOCIAL_NETWORK_GENERATOR_PARAMS[WATTS_GRAPH], 'p': 0.25}
+    monkeypatch.setitem(SOCIAL_NETWORK_GENERATOR_PARAMS, WATTS_GRAPH, params)
+    assert model.get_social_network_filename() != filename
+
+def create_slowly(log_filename):
+    with open(log_filename, 'a') as log:
+        log.write(f'{os.getpid()}\n')
+    time.sleep(0.2)
+    return np.arange(10)
+
+def read_or_create_array(filename, log_filename):
+    return read_or_create_file(filename, read=np.load, write=np.save,
+                               create=lambda: create_slowly(log_filename)).tolist()
+
+def test_read_or_create_file_creates_once(tmp_path):
+    filename = str(tmp_path / 'cache' / 'array.npy')
+    log_filename = str(tmp_path / 'created.log')
+    with Pool(4) as pool:
+        results = pool.starmap(read_or_create_array, [(filename, log_filename)] * 4)
+    assert results == [list(range(10))] * 4
+    with open(log_filename) as log:
+        assert len(log.readlines()) == 1
+
+def test_read_or_create_file_reads_an_existing_file(tmp_path):
+    filename = str(tmp_path / 'array.npy')
+    np.save(filename, np.arange(3))
+    def fail_to_create():
+        raise AssertionError("The file was created again")
+    result = read_or_create_file(filename, read=np.load, create=fail_to_create, write=np.save)
+    assert result.tolist() == [0, 1, 2]
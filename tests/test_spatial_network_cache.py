@@ -0,0 +1,51 @@
+import os
+import pickle
+import numpy as np
+import pytest
+
+from ABM.constants import *
+from ABM.model import MerchantModel
+
+
+def build_model(spatial=ITINERARIES):
+    return MerchantModel(num_merchants=10, num_locations=get_num_locations(spatial), 
+                         spatial_network_type=spatial, social_network_type=BA_GRAPH, 
+                         producer_criteria=NODE_DEGREE, seed=1)
+
+def fail_to_compile(self):
+    raise AssertionError("The spatial network was compiled again")
+
+@pytest.fixture
+def empty_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def test_compiled_network_is_reused(empty_cache, monkeypatch, spatial=ITINERARIES):
+    compiled = build_model(spatial)
+    assert os.path.isfile(f'spatial_networks/{spatial}_COMPILED.pickle')
+    monkeypatch.setattr(MerchantModel, 'compile_spatial_network', fail_to_compile)
+    monkeypatch.setattr(MerchantModel, 'create_new_spatial_distance_table', fail_to_compile)
+    loaded = build_model(spatial)
+    assert [str(n) for n in loaded.spatial_network] == [str(n) for n in compiled.spatial_network]
+    assert sorted(map(str, loaded.spatial_network.edges(data='weight'))) \
+           == sorted(map(str, compiled.spatial_network.edges(data='weight')))
+    np.testing.assert_array_equal(loaded.spatial_distances, compiled.spatial_distances)
+
+def test_stale_compiled_network_is_recompiled(empty_cache, monkeypatch):
+    build_model()
+    filename = f'spatial_networks/{ITINERARIES}_COMPILED.pickle'
+    data = pickle.load(open(filename, 'rb'))
+    data['source_hash'] = 'stale'
+    data['edges'] = []
+    pickle.dump(data, open(filename, 'wb'))
+
+    calls = []
+    compile_spatial_network = MerchantModel.compile_spatial_network
+    def counting_compile(self):
+        calls.append(1)
+        return compile_spatial_network(self)
+    monkeypatch.setattr(MerchantModel, 'compile_spatial_network', counting_compile)
+    model = build_model()
+    assert calls == [1]
+    assert model.spatial_network.number_of_edges() > 0
+    assert pickle.load(open(filename, 'rb'))['source_hash'] == model.spatial_source_hash